@@ -0,0 +1,120 @@
+# blocking.py
+"""
+Свой пул потоков для блокирующих вызовов из async-кода (SQLAlchemy, Stripe/PayPal SDK).
+
+run_blocking(fn, *args, name=..., timeout=...) вместо asyncio.to_thread:
+- Пул ограничен BLOCKING_WORKERS потоками — не больше, чем соединений в пуле SQLAlchemy
+  (5 + 10 overflow по умолчанию): лишние вызовы ждут в очереди пула, а не соединения
+  внутри потока. Дефолтный executor asyncio остаётся для DNS/прочего, у advisory lock
+  лидера (leader.py) — свои потоки: heartbeat не должен ждать очереди этого пула.
+- contextvars копируются в поток (как в to_thread) — метрики job_runs считаются и там.
+- timeout (BLOCKING_TIMEOUT секунд по умолчанию, None — без ограничения): вызывающий
+  получает asyncio.TimeoutError. Сам поток прервать нельзя — он доработает в фоне,
+  но event loop и апдейт дальше не ждут. Поэтому таймаут — только для чтения: вызов,
+  который пишет (commit, сессия у провайдера, соединение LISTEN), зовём с timeout=None —
+  иначе запись случится, а вызывающий её результата не узнает (строки истекли, а прощание
+  не отправлено; outbox остался claimed и уйдёт повторно).
+- Пул один на процесс: им пользуются loop бота, scheduler и background_loop Flask
+  (server.py). Поэтому остановка одного loop'а пул не закрывает — он живёт до выхода
+  процесса, а при выходе concurrent.futures сам дожидается начатых и поставленных вызовов.
+- blocking_stats(): по каждому name — число вызовов, ошибки, таймауты, ожидание в очереди
+  пула и время выполнения (сумма и максимум). Показывается в /health.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "10"))
+BLOCKING_TIMEOUT = float(os.getenv("BLOCKING_TIMEOUT", "30"))
+BLOCKING_SLOW_SECONDS = float(os.getenv("BLOCKING_SLOW_SECONDS", "2"))   # медленнее — warning в лог
+
+_executor = None
+_executor_lock = threading.Lock()
+_stats: dict[str, dict] = {}
+_stats_lock = threading.Lock()   # пишут и поток пула, и event loop
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+        return _executor
+
+
+def shutdown_executor(wait: bool = True):
+    """
+    Закрыть пул (тесты, явная остановка всего процесса): начатые вызовы дорабатывают,
+    поставленные в очередь — отменяются. Из loop'а бота не зовём — пул общий.
+    """
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def _record(name: str, field: str, value: float = None):
+    with _stats_lock:
+        stat = _stats.get(name)
+        if stat is None:
+            stat = _stats[name] = {
+                "calls": 0, "errors": 0, "timeouts": 0,
+                "wait_seconds": 0.0, "max_wait_seconds": 0.0,
+                "run_seconds": 0.0, "max_run_seconds": 0.0,
+            }
+        if value is None:
+            stat[field] += 1
+        else:
+            stat[f"{field}_seconds"] += value
+            stat[f"max_{field}_seconds"] = max(stat[f"max_{field}_seconds"], value)
+
+
+async def run_blocking(fn, *args, name: str | None = None, timeout: float | None = BLOCKING_TIMEOUT, **kwargs):
+    """Вызывает fn(*args, **kwargs) в пуле blocking и ждёт результат не дольше timeout."""
+    name = name or getattr(fn, "__qualname__", type(fn).__name__)
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    submitted = time.perf_counter()
+
+    def call():
+        started = time.perf_counter()
+        _record(name, "wait", started - submitted)
+        try:
+            return ctx.run(fn, *args, **kwargs)
+        except Exception:
+            _record(name, "errors")
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            _record(name, "run", elapsed)
+            if elapsed > BLOCKING_SLOW_SECONDS:
+                logger.warning(f"[blocking] {name} took {elapsed:.2f}s")
+
+    _record(name, "calls")
+    future = loop.run_in_executor(get_executor(), call)
+    if timeout is None:
+        return await future
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        _record(name, "timeouts")
+        logger.error(f"[blocking] {name} timed out after {timeout}s (still running in pool)")
+        raise
+
+
+def blocking_stats() -> dict:
+    """name -> счётчики; средние — для удобства чтения в /health."""
+    with _stats_lock:
+        out = {name: dict(stat) for name, stat in _stats.items()}
+    for stat in out.values():
+        calls = stat["calls"] or 1
+        stat["avg_wait_seconds"] = round(stat["wait_seconds"] / calls, 4)
+        stat["avg_run_seconds"] = round(stat["run_seconds"] / calls, 4)
+    return out
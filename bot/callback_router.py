@@ -0,0 +1,143 @@
+# callback_router.py
+"""
+Роутер inline-кнопок вида "prefix:value".
+
+Вместо цепочки callback_query_handler(lambda c: c.data.startswith(...)) — один хендлер
+dp на все кнопки: callback_data разбирается один раз, хендлер ищется по префиксу в dict,
+состояние FSM читается один раз. Стоимость не растёт с числом шагов онбординга.
+
+    callbacks = CallbackRouter()
+    callbacks.attach(dp)
+
+    @callbacks.route("format", state=Onboarding.format)
+    async def process_format(c, state, value): ...
+
+- Хендлер получает (callback, state, value); если в сигнатуре есть user / subscription —
+  ещё и контекст пользователя из user_context (тот же кэш, что у middleware).
+- Хендлер с @rate_limit (throttling.py) — отдельный лимит нажатий на пользователя;
+  сверх него — вежливый answer() без вызова хендлера.
+- Кнопка из прошлого шага (состояние уже другое) или неизвестный префикс — только
+  c.answer(), чтобы у пользователя не крутились «часики».
+- stats(): по каждому префиксу — вызовы, ошибки, гистограмма времени хендлера
+  (CALLBACK_LATENCY_BUCKETS_MS), среднее и максимум. Показывается в /health.
+"""
+import time
+import logging
+
+from aiogram import types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State
+
+from user_context import user_cache, context_args
+from throttling import throttler, reject_callback
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_active = None   # роутер, подключённый к dp (для /health)
+
+
+def callback_stats() -> dict:
+    return _active.stats() if _active is not None else {}
+
+
+class Route:
+    def __init__(self, handler, states):
+        self.handler = handler
+        self.states = states              # None — в любом состоянии
+        self.context = context_args(handler)
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(CALLBACK_LATENCY_BUCKETS_MS) + 1)   # последний — «больше максимума»
+
+    def observe(self, ms: float):
+        self.calls += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        for i, bound in enumerate(CALLBACK_LATENCY_BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def stats(self) -> dict:
+        labels = [f"<={b}ms" for b in CALLBACK_LATENCY_BUCKETS_MS] + [f">{CALLBACK_LATENCY_BUCKETS_MS[-1]}ms"]
+        return {
+            "handler": self.handler.__name__,
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.calls, 1) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 1),
+            "histogram": dict(zip(labels, self.buckets)),
+        }
+
+
+def _state_names(state) -> set | None:
+    if state is None or state == "*":
+        return None
+    if not isinstance(state, (list, tuple, set, frozenset)):
+        state = [state]
+    return {s.state if isinstance(s, State) else s for s in state}
+
+
+class CallbackRouter:
+    def __init__(self):
+        self._routes: dict[str, Route] = {}
+        self._unknown = 0
+        self._stale = 0
+
+    def route(self, prefix: str, state=None):
+        """Регистрирует хендлер кнопок "prefix:...". state — State / список / None (любое)."""
+        def decorator(handler):
+            if prefix in self._routes:
+                raise ValueError(f"callback prefix '{prefix}' is already routed")
+            self._routes[prefix] = Route(handler, _state_names(state))
+            return handler
+        return decorator
+
+    def attach(self, dp):
+        global _active
+        dp.register_callback_query_handler(self.dispatch, state="*")
+        _active = self
+
+    async def dispatch(self, c: types.CallbackQuery, state: FSMContext):
+        prefix, _, value = (c.data or "").partition(":")
+        route = self._routes.get(prefix)
+        if route is None:
+            self._unknown += 1
+            logger.debug(f"[callbacks] no route for {c.data!r}")
+            await c.answer()
+            return
+
+        if route.states is not None and await state.get_state() not in route.states:
+            self._stale += 1
+            await c.answer()
+            return
+
+        if not throttler.handler_allowed(c.from_user.id, route.handler):
+            await reject_callback(c)
+            return
+
+        kwargs = {}
+        if route.context:
+            user, subscription = await user_cache.get(c.from_user.id)
+            kwargs = {name: ctx for name, ctx in (("user", user), ("subscription", subscription)) if name in route.context}
+
+        started = time.perf_counter()
+        try:
+            await route.handler(c, state, value, **kwargs)
+        except Exception:
+            route.errors += 1
+            raise
+        finally:
+            route.observe((time.perf_counter() - started) * 1000)
+
+    def stats(self) -> dict:
+        return {
+            "routes": {prefix: route.stats() for prefix, route in self._routes.items()},
+            "unknown": self._unknown,
+            "stale": self._stale,
+        }
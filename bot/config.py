@@ -2,16 +2,34 @@ import os
 # --- НАСТРОЙКИ БОТА ---
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_FALLBACK_ID = int(os.getenv("ADMIN_FALLBACK_ID", "0")) or None
+# Базовый URL Bot API. Пусто — api.telegram.org; для нагрузочных тестов — локальный
+# fake_telegram_api.py (например, http://127.0.0.1:8081)
+TELEGRAM_API_BASE = (os.getenv("TELEGRAM_API_BASE") or "https://api.telegram.org").rstrip("/")
+GROUP_ID = int(os.getenv("GROUP_ID", "0")) or None  # закрытая группа (сверка участников, удаление)
+# Получение апдейтов: polling (локальная разработка) или webhook (прод, см. main.start_bot).
+# В проде задавайте BOT_MODE=webhook явно: polling — значение по умолчанию только для разработки.
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Выбросить накопившиеся апдейты при переходе на polling (deleteWebhook). По умолчанию — нет:
+# иначе при каждой смене лидера теряются сообщения и нажатия, пришедшие, пока бот не читал.
+TELEGRAM_DROP_PENDING_UPDATES = os.getenv("TELEGRAM_DROP_PENDING_UPDATES", "0") == "1"
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")   # заголовок X-Telegram-Bot-Api-Secret-Token
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram/webhook")
+# Публичный адрес сервера для setWebhook (по умолчанию — PUBLIC_BASE_URL)
+TELEGRAM_WEBHOOK_BASE = (os.getenv("TELEGRAM_WEBHOOK_BASE") or os.getenv("PUBLIC_BASE_URL") or "").rstrip("/")
+# Только те типы апдейтов, на которые есть хендлеры
+# (по чатам Telegram не фильтрует: в группах держим privacy mode у BotFather — тогда приходят
+# только команды и ответы боту, а остальное отбрасывает update_queue.is_group_noise)
+TELEGRAM_ALLOWED_UPDATES = ["message", "callback_query"]
 VIDEO_PENDING_FILE_ID = os.getenv("VIDEO_PENDING_FILE_ID")
 VIDEO_PRESENTATION_FILE_ID = os.getenv("VIDEO_PRESENTATION_FILE_ID")
-VIDEO_REVIEWS = os.getenv("VIDEO_REVIEWS")
+VIDEO_REVIEWS = os.getenv("VIDEO_REVIEWS")  # JSON {"review_1": "<file_id>", ...} или file_id через запятую
 
 _admin_ids = os.getenv("ADMIN_IDS", "")
 ADMIN_IDS = [s.strip() for s in _admin_ids.split(",") if s.strip()]
 
 
-# --- ВИДЕО FILE_ID (ЗАМЕНИТЕ НА РЕАЛЬНЫЕ ПОСЛЕ ЗАГРУЗКИ ВИДЕО) ---
-# Для тестирования используем None, чтобы отправлять текстовые заглушки
+# --- ВИДЕО FILE_ID ---
+# Основной источник — таблица media_assets (см. media.py); env выше — запасной вариант.
 # VIDEO_REVIEWS = {
 #     "review_1": None,  # Замените на реальные file_id после загрузки видео
 #     "review_2": None,
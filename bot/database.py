@@ -1,12 +1,13 @@
 #database.py
 import os
 import enum
+import json
 from config import ADMIN_IDS
 from datetime import datetime, timedelta  
 from sqlalchemy import (
     create_engine, Column, Integer, String, Float, Text,
-    Boolean, DateTime, BigInteger, SmallInteger, ForeignKey,
-    UniqueConstraint, or_, func, Enum
+    Boolean, DateTime, Date, BigInteger, SmallInteger, ForeignKey,
+    UniqueConstraint, Index, JSON, or_, func, Enum, select, update, text
 )
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
 from dotenv import load_dotenv
@@ -29,6 +30,9 @@ engine = create_engine(DATABASE_URL, pool_pre_ping=True)
 
 # Настройка SQLAlchemy
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+EXPIRE_BATCH_SIZE = int(os.getenv("EXPIRE_BATCH_SIZE", "500"))   # сколько подписок истекаем за один UPDATE
+SUBSCRIPTION_CHANNEL = "subscription_changed"   # канал pg_notify для expiry.py
 Base = declarative_base()
 
 # ------------------------
@@ -90,6 +94,7 @@ class Subscription(Base):
     # Доступ к группе
     has_group_access = Column(Boolean, default=False)
     group_joined_at = Column(DateTime, nullable=True)
+    group_removed_at = Column(DateTime, nullable=True)  # когда удалили из группы (сбрасывается при активации)
     
     # анти-спам и напоминания
     last_nudge_at   = Column(DateTime, nullable=True)   # когда последний раз пинали pending
@@ -152,6 +157,124 @@ class VideoReaction(Base):
     user = relationship("User", back_populates="reactions")
     video = relationship("Video", back_populates="reactions")
 
+# =========================
+# TELEGRAM OUTBOX
+# =========================
+class TelegramOutbox(Base):
+    """
+    Исходящие сообщения Telegram. Строка пишется в той же транзакции, что и изменение
+    состояния (например, last_warned_at), а отправляет её диспетчер из outbox.py.
+    status: pending -> sending -> sent | dead (после OUTBOX_MAX_ATTEMPTS попыток).
+    """
+    __tablename__ = "telegram_outbox"
+    __table_args__ = (Index("ix_telegram_outbox_status_next_attempt", "status", "next_attempt_at"),)
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(BigInteger, nullable=False, index=True)
+    method = Column(String, nullable=False, default="sendMessage")   # метод Bot API
+    payload = Column(JSON, nullable=False)                           # тело запроса (с chat_id)
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = Column(DateTime, nullable=True)                   # аренда строки диспетчером
+    sent_at = Column(DateTime, nullable=True)
+
+# =========================
+# MEDIA: file_id REGISTRY
+# =========================
+class MediaAsset(Base):
+    """
+    Логический ключ медиа ("pending", "presentation", "review_1"...) -> Telegram file_id.
+    local_path — файл для первой загрузки, если file_id ещё не известен.
+    """
+    __tablename__ = "media_assets"
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String, unique=True, index=True, nullable=False)
+    file_id = Column(String, nullable=True)
+    local_path = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# =========================
+# SCHEDULER: состояние джобов
+# =========================
+class JobState(Base):
+    """
+    Последний запуск каждого джоба scheduler.py: по нему считаем следующий запуск после
+    рестарта (догоняем пропущенное). locked_until — аренда на время выполнения,
+    чтобы один и тот же джоб не шёл дважды одновременно.
+    """
+    __tablename__ = "job_state"
+
+    name = Column(String, primary_key=True)
+    last_started_at = Column(DateTime, nullable=True)
+    last_finished_at = Column(DateTime, nullable=True)
+    last_status = Column(String, nullable=True)        # ok / failed / timeout
+    last_error = Column(Text, nullable=True)
+    last_duration = Column(Float, nullable=True)       # секунды
+    last_result = Column(JSON, nullable=True)
+    locked_until = Column(DateTime, nullable=True)
+
+class FSMState(Base):
+    """
+    Состояние aiogram FSM (онбординг) по (chat_id, user_id) — переживает рестарт и общее
+    для всех процессов. Пишет fsm_storage.PostgresStorage; брошенные сессии чистит TTL.
+    """
+    __tablename__ = "fsm_state"
+
+    chat_id = Column(BigInteger, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    state = Column(String, nullable=True)
+    data = Column(JSON, nullable=False, default=dict)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class JobRun(Base):
+    """
+    История запусков джобов tasks.py (см. job_runs.py): один запуск — одна строка.
+    По ней видно, какой джоб тормозит и как растёт время с ростом базы (/jobs у админа).
+    """
+    __tablename__ = "job_runs"
+    __table_args__ = (Index("ix_job_runs_job_name_started_at", "job_name", "started_at"),)
+
+    id = Column(Integer, primary_key=True)
+    job_name = Column(String, nullable=False)
+    started_at = Column(DateTime, nullable=False, index=True)
+    finished_at = Column(DateTime, nullable=True)
+    duration = Column(Float, nullable=True)                  # секунды
+    status = Column(String, nullable=False)                  # ok / failed / cancelled
+    candidates = Column(Integer, nullable=True)
+    ok = Column(Integer, nullable=True)
+    failed = Column(Integer, nullable=True)
+    api_calls = Column(Integer, nullable=False, default=0)   # запросы к Telegram / Stripe / PayPal
+    p95_ms = Column(Float, nullable=True)                    # p95 времени на один элемент
+    error = Column(Text, nullable=True)
+
+class OnboardingEvent(Base):
+    """
+    Шаг онбординга, который прошёл пользователь (start, format, level, ... payment_link).
+    Пишется пачками из буфера onboarding_events.py; по нему видно, где отваливаются.
+    """
+    __tablename__ = "onboarding_events"
+    __table_args__ = (Index("ix_onboarding_events_step_created_at", "step", "created_at"),)
+
+    id = Column(BigInteger, primary_key=True)
+    telegram_id = Column(BigInteger, nullable=False, index=True)
+    step = Column(String, nullable=False)
+    value = Column(String, nullable=True)       # выбранный вариант (video, newbie, stripe, ...)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class OnboardingFunnel(Base):
+    """Предпосчитанная воронка: сколько разных пользователей дошло до шага за день (UTC)."""
+    __tablename__ = "onboarding_funnel"
+
+    day = Column(Date, primary_key=True)
+    step = Column(String, primary_key=True)
+    users = Column(Integer, nullable=False, default=0)
+    events = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
 # Создание таблиц
 def create_tables():
     Base.metadata.create_all(bind=engine)
@@ -278,6 +401,7 @@ def activate_subscription(db, user_id: int, order_id: str, amount: float = None,
     subscription.expires_at = subscription.activated_at + timedelta(days=30)
     
     subscription.has_group_access = True
+    subscription.group_removed_at = None
     if not subscription.group_joined_at:
         subscription.group_joined_at = now
 
@@ -287,7 +411,8 @@ def activate_subscription(db, user_id: int, order_id: str, amount: float = None,
     if currency is not None:
         subscription.currency = currency
 
-    # 3. Сохраняем изменения в базе данных.
+    # 3. Сохраняем изменения в базе данных (и сообщаем движку истечения — уйдёт вместе с COMMIT).
+    notify_subscription_changed(db, subscription)
     db.commit()
     db.refresh(subscription)
     
@@ -299,10 +424,51 @@ def cancel_subscription(db, subscription_id: str):
         sub.status = "cancelled"
         sub.cancelled_at = datetime.utcnow()
         sub.has_group_access = False
+        notify_subscription_changed(db, sub)
         db.commit()
         db.refresh(sub)
     return sub
 
+def notify_subscription_changed(db, sub):
+    """
+    pg_notify о новом статусе/сроке подписки. Postgres доставляет уведомление слушателям
+    (expiry.py) только после COMMIT этой транзакции; при ROLLBACK оно пропадает.
+    """
+    db.flush()
+    payload = json.dumps({
+        "id": sub.id,
+        "status": sub.status,
+        "expires_at": sub.expires_at.isoformat() if sub.expires_at else None,
+    })
+    db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": SUBSCRIPTION_CHANNEL, "payload": payload})
+
+def expire_subscriptions(db, now: datetime | None = None, limit: int = EXPIRE_BATCH_SIZE, ids=None):
+    """
+    Set-based истечение одной пачки:
+        WITH due AS (SELECT id ... WHERE status='active' AND expires_at < now
+                     ORDER BY expires_at LIMIT n FOR UPDATE SKIP LOCKED)
+        UPDATE subscriptions SET status='expired', has_group_access=false, cancelled_at=now
+        WHERE id IN (SELECT id FROM due) RETURNING id, telegram_id, user_id
+    Без загрузки ORM-объектов; строки блокируются на миллисекунды. ids — ограничить конкретными
+    подписками. НЕ коммитит: вызывающий пишет уведомления (outbox) в ту же транзакцию.
+    """
+    now = now or datetime.utcnow()
+    due = select(Subscription.id).where(
+        Subscription.status == "active",
+        Subscription.expires_at != None,
+        Subscription.expires_at < now,
+    )
+    if ids is not None:
+        due = due.where(Subscription.id.in_(list(ids)))
+    due = due.order_by(Subscription.expires_at).limit(limit).with_for_update(skip_locked=True).cte("due")
+
+    return db.execute(
+        update(Subscription)
+        .where(Subscription.id.in_(select(due.c.id)))
+        .values(status="expired", has_group_access=False, cancelled_at=now)
+        .returning(Subscription.id, Subscription.telegram_id, Subscription.user_id)
+    ).all()
+
 def get_active_subscription(db, user_id: int): 
     """
     Ищет активную подписку для пользователя по его внутреннему ID.
@@ -338,6 +504,18 @@ def user_has_access(db, telegram_id: int) -> bool:
     # Вызываем get_active_subscription с правильным user.id
     return get_active_subscription(db, user.id) is not None
 
+# =========================
+# OUTBOX HELPERS
+# =========================
+def enqueue_telegram(db, payload: dict, method: str = "sendMessage"):
+    """
+    Кладёт сообщение в telegram_outbox БЕЗ commit — коммитит вызывающий,
+    вместе со своим изменением состояния.
+    """
+    row = TelegramOutbox(chat_id=payload["chat_id"], method=method, payload=payload)
+    db.add(row)
+    return row
+
 # =========================
 # CONTENT HELPERS (MODULES/VIDEOS)
 # =========================
@@ -0,0 +1,212 @@
+# expiry.py
+"""
+Точное истечение подписок (вместо часового manage_group_access_loop).
+
+- В памяти — куча (expires_at, subscription_id) на горизонт EXPIRY_HORIZON_HOURS;
+  движок спит ровно до ближайшего expires_at и истекает подписку в момент окончания
+  (tasks.expire_due_subscriptions(ids=...): goodbye в outbox + удаление из группы).
+- Изменения приходят инкрементально: activate_subscription / cancel_subscription делают
+  pg_notify (database.notify_subscription_changed), движок слушает канал через LISTEN.
+- Раз в EXPIRY_RELOAD_MINUTES куча перечитывается целиком — так подтягиваются подписки,
+  вошедшие в горизонт, и просроченные (пропущенные уведомления, простой процесса).
+- Корректность не зависит от кучи: UPDATE истекает только строки, где expires_at < now
+  и status='active' — продлённую подписку устаревшая запись не тронет.
+Запускается только у лидера (main.polling_leader_work). Полный проход по таблице
+остаётся страховкой в scheduler.py (deactivate_expired, редко).
+"""
+import os
+import json
+import heapq
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from database import SessionLocal, Subscription, engine, SUBSCRIPTION_CHANNEL
+from blocking import run_blocking
+from tasks import expire_due_subscriptions
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_HORIZON_HOURS = float(os.getenv("EXPIRY_HORIZON_HOURS", "24"))
+EXPIRY_RELOAD_MINUTES = float(os.getenv("EXPIRY_RELOAD_MINUTES", "60"))
+EXPIRY_LISTEN = os.getenv("EXPIRY_LISTEN", "1") == "1"
+
+
+def load_upcoming(horizon: timedelta) -> list[tuple[int, datetime]]:
+    """Активные подписки, истекающие в пределах горизонта (и уже просроченные)."""
+    until = datetime.utcnow() + horizon
+    db = SessionLocal()
+    try:
+        return db.query(Subscription.id, Subscription.expires_at).filter(
+            Subscription.status == "active",
+            Subscription.expires_at != None,
+            Subscription.expires_at <= until,
+        ).all()
+    finally:
+        db.close()
+
+
+def _open_listener():
+    """Отдельное autocommit-соединение с LISTEN (блокирующий вызов)."""
+    raw = engine.raw_connection()
+    try:
+        pg = raw.driver_connection
+        pg.autocommit = True
+        with pg.cursor() as cur:
+            cur.execute(f"LISTEN {SUBSCRIPTION_CHANNEL}")
+    except Exception:
+        raw.invalidate()
+        raise
+    return raw
+
+
+class ExpiryEngine:
+    def __init__(self, horizon_hours: float = EXPIRY_HORIZON_HOURS, reload_minutes: float = EXPIRY_RELOAD_MINUTES,
+                 expire=None, listen: bool = EXPIRY_LISTEN):
+        """expire(ids=[...]) — корутина, истекающая подписки (по умолчанию tasks.expire_due_subscriptions)."""
+        self.horizon = timedelta(hours=horizon_hours)
+        self.reload_every = timedelta(minutes=reload_minutes)
+        self.expire = expire or expire_due_subscriptions
+        self.listen = listen
+        # Устаревшие записи из кучи не удаляем — пропускаем при извлечении;
+        # актуальный срок подписки — только в _due
+        self._heap: list[tuple[datetime, int]] = []
+        self._due: dict[int, datetime] = {}
+        self._wakeup = asyncio.Event()
+        self._listener = None
+        self._loop = None
+
+    def __len__(self):
+        return len(self._due)
+
+    # --- куча ---
+    def schedule(self, sub_id: int, expires_at: datetime | None, now: datetime | None = None):
+        """Новый срок подписки; за горизонтом или без срока — забываем (подтянет reload)."""
+        now = now or datetime.utcnow()
+        if expires_at is None or expires_at > now + self.horizon:
+            self._due.pop(sub_id, None)
+            return
+        if self._due.get(sub_id) == expires_at:
+            return
+        self._due[sub_id] = expires_at
+        heapq.heappush(self._heap, (expires_at, sub_id))
+        self._wakeup.set()
+
+    def discard(self, sub_id: int):
+        self._due.pop(sub_id, None)
+
+    def replace_all(self, rows, now: datetime | None = None):
+        now = now or datetime.utcnow()
+        self._heap, self._due = [], {}
+        for sub_id, expires_at in rows:
+            self.schedule(sub_id, expires_at, now)
+        self._wakeup.set()
+
+    def next_at(self) -> datetime | None:
+        heap = self._heap
+        while heap and self._due.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def pop_due(self, now: datetime) -> list[int]:
+        ids = []
+        while (when := self.next_at()) is not None and when <= now:
+            _, sub_id = heapq.heappop(self._heap)
+            del self._due[sub_id]
+            ids.append(sub_id)
+        return ids
+
+    def handle_change(self, payload: str):
+        """Payload pg_notify: {"id", "status", "expires_at"}."""
+        try:
+            data = json.loads(payload)
+            sub_id = int(data["id"])
+            expires_at = datetime.fromisoformat(data["expires_at"]) if data.get("expires_at") else None
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"[expiry] bad notification {payload!r}: {e}")
+            return
+        if data.get("status") == "active":
+            self.schedule(sub_id, expires_at)
+        else:
+            self.discard(sub_id)
+
+    # --- LISTEN ---
+    async def _ensure_listener(self):
+        if not self.listen or self._listener is not None:
+            return
+        try:
+            self._listener = await run_blocking(_open_listener, timeout=None)
+        except Exception as e:
+            logger.warning(f"[expiry] LISTEN unavailable, relying on reload: {e}")
+            return
+        self._loop.add_reader(self._listener.driver_connection.fileno(), self._on_notify)
+
+    def _on_notify(self):
+        pg = self._listener.driver_connection
+        try:
+            pg.poll()
+        except Exception as e:
+            # Переподключимся на следующем reload; пропущенное подтянет он же
+            logger.warning(f"[expiry] listener connection lost: {e}")
+            self._close_listener()
+            return
+        while pg.notifies:
+            self.handle_change(pg.notifies.pop(0).payload)
+
+    def _close_listener(self):
+        if self._listener is None:
+            return
+        try:
+            self._loop.remove_reader(self._listener.driver_connection.fileno())
+        except Exception:
+            pass
+        try:
+            # invalidate: соединение с активным LISTEN не должно вернуться в пул
+            self._listener.invalidate()
+        except Exception:
+            pass
+        self._listener = None
+
+    # --- цикл ---
+    async def reload(self):
+        rows = await run_blocking(load_upcoming, self.horizon)
+        self.replace_all(rows)
+        logger.info(f"[expiry] loaded {len(self)} subscriptions expiring within {self.horizon}")
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        next_reload = datetime.utcnow()
+        try:
+            while True:
+                now = datetime.utcnow()
+                if now >= next_reload:
+                    await self._ensure_listener()
+                    try:
+                        await self.reload()
+                    except Exception as e:
+                        logger.error(f"[expiry] reload failed: {e}")
+                    next_reload = now + self.reload_every
+
+                due = self.pop_due(datetime.utcnow())
+                if due:
+                    try:
+                        result = await self.expire(ids=due)
+                        logger.info(f"[expiry] fired {len(due)}: {result}")
+                    except Exception:
+                        # Строки остались active — их вернёт следующий reload
+                        logger.exception(f"[expiry] failed to expire {due}")
+                    continue
+
+                self._wakeup.clear()
+                wake_at = min(filter(None, (self.next_at(), next_reload)))
+                timeout = max((wake_at - datetime.utcnow()).total_seconds(), 0)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._close_listener()
+
+
+async def run_expiry_engine():
+    await ExpiryEngine().run()
@@ -0,0 +1,383 @@
+# fake_telegram_api.py
+"""
+Локальная замена Telegram Bot API для нагрузочных тестов.
+
+Понимает тот же формат URL, что и настоящий API: <base>/bot<token>/<method>,
+параметры — JSON, form-urlencoded, multipart или query string.
+
+Реализованы: getMe, getUpdates (long polling с offset), deleteWebhook, setWebhook,
+sendMessage, sendVideo, sendMediaGroup, answerCallbackQuery, pinChatMessage,
+getChatMember, banChatMember/kickChatMember, unbanChatMember.
+
+Настройки: задержка ответа (latency_ms ± jitter_ms), доля ответов 429 (rate_429)
+с parameters.retry_after. Все вызовы записываются (calls) для проверок в бенчмарках.
+
+Служебные эндпоинты:
+    POST /_fake/updates   — положить апдейты в очередь getUpdates (объект или список)
+    GET  /_fake/calls     — записанные вызовы (?method=sendMessage)
+    POST /_fake/members   — {"chat_id": ..., "user_id": ..., "status": "member"}
+    POST /_fake/reset     — очистить очередь, вызовы и участников
+
+Подключение бота: TELEGRAM_API_BASE=http://127.0.0.1:8081 (см. config.py).
+Запуск отдельно:
+    python fake_telegram_api.py --port 8081 --latency-ms 50 --jitter-ms 20 --rate-429 0.01
+"""
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import itertools
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+# Методы, которые не тормозим и не ломаем 429 — иначе бенчмарк меряет сам себя
+_SERVICE_METHODS = {"getme", "getupdates", "deletewebhook", "setwebhook"}
+
+
+class _ApiError(Exception):
+    def __init__(self, code: int, description: str, parameters: dict | None = None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.parameters = parameters
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _maybe_json(value):
+    """Form-параметры (reply_markup, media) приходят JSON-строкой — разворачиваем."""
+    if isinstance(value, str) and value[:1] in "[{":
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+# =========================
+# Генераторы апдейтов
+# =========================
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+
+def _chat(chat_id: int, chat_type: str) -> dict:
+    chat = {"id": chat_id, "type": chat_type}
+    if chat_type == "private":
+        chat.update(first_name=f"User{chat_id}")
+    else:
+        chat.update(title=f"Group {chat_id}")
+    return chat
+
+
+def make_message_update(user_id: int, text: str, chat_type: str = "private", chat_id: int | None = None) -> dict:
+    """Апдейт с текстовым сообщением; команды (/start) размечаются entity bot_command."""
+    message = {
+        "message_id": random.randint(1, 2 ** 31),
+        "date": int(time.time()),
+        "from": _user(user_id),
+        "chat": _chat(chat_id or user_id, chat_type),
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"message": message}
+
+
+def make_callback_update(user_id: int, data: str, message_id: int = 1) -> dict:
+    """Апдейт с нажатием inline-кнопки под сообщением бота в личке."""
+    return {
+        "callback_query": {
+            "id": str(random.randint(1, 2 ** 62)),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "from": BOT_USER,
+                "chat": _chat(user_id, "private"),
+                "text": "...",
+            },
+        }
+    }
+
+
+# =========================
+# Сервер
+# =========================
+class FakeTelegramAPI:
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, rate_429: float = 0.0,
+                 retry_after: int = 1, seed: int | None = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+
+        self.calls: list[dict] = []
+        self._updates: list[dict] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._members: dict[tuple[int, int], str] = {}   # (chat_id, user_id) -> status
+        self._new_updates: asyncio.Condition | None = None
+        self._runner: web.AppRunner | None = None
+        self.base_url: str | None = None
+
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self._handle_api)
+        self.app.router.add_get("/bot{token}/{method}", self._handle_api)
+        self.app.router.add_post("/_fake/updates", self._handle_push_updates)
+        self.app.router.add_get("/_fake/calls", self._handle_calls)
+        self.app.router.add_post("/_fake/members", self._handle_members)
+        self.app.router.add_post("/_fake/reset", self._handle_reset)
+
+        self._methods = {
+            "getme": self._get_me,
+            "getupdates": self._get_updates,
+            "deletewebhook": self._delete_webhook,
+            "setwebhook": lambda params: True,
+            "sendmessage": self._send_message,
+            "sendvideo": self._send_video,
+            "sendmediagroup": self._send_media_group,
+            "answercallbackquery": lambda params: True,
+            "pinchatmessage": lambda params: True,
+            "getchatmember": self._get_chat_member,
+            "banchatmember": self._ban_chat_member,
+            "kickchatmember": self._ban_chat_member,
+            "unbanchatmember": self._unban_chat_member,
+        }
+
+    # --- жизненный цикл ---
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запускает сервер в текущем loop. port=0 — свободный порт. Возвращает base URL."""
+        self._new_updates = asyncio.Condition()
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        real_port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{real_port}"
+        logger.info(f"Fake Telegram API listening on {self.base_url}")
+        return self.base_url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    # --- управление из кода ---
+    def push_updates(self, updates: list[dict]) -> list[int]:
+        """Кладёт апдейты в очередь getUpdates, проставляя update_id. Вызывать из loop сервера."""
+        ids = []
+        for update in updates:
+            update = dict(update, update_id=next(self._update_ids))
+            self._updates.append(update)
+            ids.append(update["update_id"])
+        if self._new_updates is not None:
+            asyncio.ensure_future(self._notify_updates())
+        return ids
+
+    async def _notify_updates(self):
+        async with self._new_updates:
+            self._new_updates.notify_all()
+
+    def set_member(self, chat_id: int, user_id: int, status: str = "member"):
+        self._members[(int(chat_id), int(user_id))] = status
+
+    def calls_for(self, method: str) -> list[dict]:
+        method = method.lower()
+        return [c for c in self.calls if c["method"].lower() == method]
+
+    def pending_updates(self) -> int:
+        return len(self._updates)
+
+    def reset(self):
+        self.calls.clear()
+        self._updates.clear()
+        self._members.clear()
+
+    # --- HTTP ---
+    async def _read_params(self, request: web.Request) -> dict:
+        params = {k: _maybe_json(v) for k, v in request.query.items()}
+        if request.method == "POST" and request.can_read_body:
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            else:
+                form = await request.post()
+                for key, value in form.items():
+                    params[key] = _maybe_json(value) if isinstance(value, str) else f"<file:{getattr(value, 'filename', key)}>"
+        return params
+
+    async def _handle_api(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._read_params(request)
+        call = {"method": method, "params": params, "at": time.time()}
+        self.calls.append(call)
+
+        key = method.lower()
+        if key not in _SERVICE_METHODS:
+            delay = self.latency_ms + (self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0)
+            if delay > 0:
+                await asyncio.sleep(delay / 1000)
+            if self.rate_429 and self._random.random() < self.rate_429:
+                call["status"] = 429
+                return self._error(_ApiError(
+                    429, f"Too Many Requests: retry after {self.retry_after}",
+                    {"retry_after": self.retry_after},
+                ))
+
+        handler = self._methods.get(key)
+        if handler is None:
+            call["status"] = 404
+            return self._error(_ApiError(404, "Not Found: method not found"))
+        try:
+            result = handler(params)
+            if asyncio.iscoroutine(result):
+                result = await result
+        except _ApiError as e:
+            call["status"] = e.code
+            return self._error(e)
+        call["status"] = 200
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def _error(e: _ApiError) -> web.Response:
+        body = {"ok": False, "error_code": e.code, "description": e.description}
+        if e.parameters:
+            body["parameters"] = e.parameters
+        return web.json_response(body, status=e.code)
+
+    async def _handle_push_updates(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        ids = self.push_updates(data if isinstance(data, list) else [data])
+        return web.json_response({"ok": True, "update_ids": ids})
+
+    async def _handle_calls(self, request: web.Request) -> web.Response:
+        method = request.query.get("method")
+        calls = self.calls_for(method) if method else self.calls
+        return web.json_response({"ok": True, "count": len(calls), "calls": calls})
+
+    async def _handle_members(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        for item in data if isinstance(data, list) else [data]:
+            self.set_member(item["chat_id"], item["user_id"], item.get("status", "member"))
+        return web.json_response({"ok": True})
+
+    async def _handle_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({"ok": True})
+
+    # --- методы Bot API ---
+    def _get_me(self, params):
+        return BOT_USER
+
+    async def _get_updates(self, params):
+        offset = _as_int(params.get("offset"))
+        limit = min(int(params.get("limit") or 100), 100)
+        timeout = float(params.get("timeout") or 0)
+
+        if isinstance(offset, int):
+            # Как в Telegram: всё, что меньше offset, считается подтверждённым
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout > 0:
+            try:
+                async with self._new_updates:
+                    await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    def _delete_webhook(self, params):
+        if str(params.get("drop_pending_updates", "")).lower() in ("1", "true"):
+            self._updates.clear()
+        return True
+
+    def _message(self, params, **extra) -> dict:
+        chat_id = _as_int(params.get("chat_id"))
+        if chat_id in (None, ""):
+            raise _ApiError(400, "Bad Request: chat_id is empty")
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "from": BOT_USER,
+            "chat": _chat(chat_id, "private" if isinstance(chat_id, int) and chat_id > 0 else "supergroup"),
+        }
+        message.update(extra)
+        return message
+
+    def _send_message(self, params):
+        if not params.get("text"):
+            raise _ApiError(400, "Bad Request: message text is empty")
+        return self._message(params, text=params["text"])
+
+    def _video(self, file_id) -> dict:
+        file_id = file_id if isinstance(file_id, str) and not file_id.startswith("<file:") else f"fake-video-{next(self._message_ids)}"
+        return {"file_id": file_id, "file_unique_id": file_id[-16:], "width": 1280, "height": 720, "duration": 60}
+
+    def _send_video(self, params):
+        if not params.get("video"):
+            raise _ApiError(400, "Bad Request: there is no video in the request")
+        return self._message(params, video=self._video(params["video"]), caption=params.get("caption"))
+
+    def _send_media_group(self, params):
+        media = params.get("media")
+        if not isinstance(media, list) or not 2 <= len(media) <= 10:
+            raise _ApiError(400, "Bad Request: wrong number of media in the group")
+        group_id = str(next(self._message_ids))
+        return [
+            self._message(params, media_group_id=group_id, video=self._video(item.get("media")), caption=item.get("caption"))
+            for item in media
+        ]
+
+    def _get_chat_member(self, params):
+        user_id = _as_int(params.get("user_id"))
+        status = self._members.get((_as_int(params.get("chat_id")), user_id), "left")
+        return {"user": _user(user_id), "status": status}
+
+    def _ban_chat_member(self, params):
+        self.set_member(params.get("chat_id"), params.get("user_id"), "kicked")
+        return True
+
+    def _unban_chat_member(self, params):
+        key = (_as_int(params.get("chat_id")), _as_int(params.get("user_id")))
+        only_if_banned = str(params.get("only_if_banned", "")).lower() in ("1", "true")
+        if self._members.get(key) == "kicked" or not only_if_banned:
+            self._members[key] = "left"
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальная замена Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429 (0..1)")
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    fake = FakeTelegramAPI(args.latency_ms, args.jitter_ms, args.rate_429, args.retry_after)
+
+    async def on_startup(app):
+        fake._new_updates = asyncio.Condition()
+        fake.base_url = f"http://{args.host}:{args.port}"
+
+    fake.app.on_startup.append(on_startup)
+    print(f"TELEGRAM_API_BASE=http://{args.host}:{args.port}")
+    web.run_app(fake.app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
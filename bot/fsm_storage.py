@@ -0,0 +1,314 @@
+# fsm_storage.py
+"""
+FSM-хранилище aiogram на Postgres (таблица fsm_state) вместо MemoryStorage.
+
+- Ключ — (chat_id, user_id); онбординг переживает рестарт и виден всем процессам.
+- Polling (BOT_MODE=polling): апдейты читает один процесс-лидер, поэтому:
+  - кэш чтения на ключ: get_state/get_data не ходят в БД FSM_CACHE_SECONDS после
+    последнего чтения/записи;
+  - set_state / set_data / reset — запись сразу (переход между шагами не теряем);
+    update_data (ответы на каждом шаге) — write-behind: ключ помечается «грязным», фоновая
+    задача сбрасывает все грязные ключи одним upsert раз в FSM_FLUSH_INTERVAL секунд
+    или сразу, как их набралось FSM_FLUSH_BATCH. close() досбрасывает остаток.
+- Webhook (BOT_MODE=webhook): апдейты одного пользователя могут попасть в разные воркеры
+  (и в старый и новый инстанс во время деплоя) — кэш и write-behind выключены
+  (cache_seconds=0, write_behind=False): каждое чтение из БД, каждая запись сразу.
+- Пустые записи (state=None, data={}) удаляются; брошенные сессии старше FSM_STATE_TTL_DAYS
+  чистит cleanup_fsm_states() (джоб fsm_cleanup в scheduler.py).
+Записи одного ключа идут по одной (свой asyncio.Lock на ключ, пока есть кто его ждёт), поэтому
+более старый снимок ключа не перезапишет более новый; разные чаты пишутся параллельно.
+"""
+import os
+import copy
+import time
+import asyncio
+import logging
+import typing
+import contextlib
+from datetime import datetime, timedelta
+
+from aiogram.dispatcher.storage import BaseStorage
+from sqlalchemy import tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from database import SessionLocal, FSMState
+from blocking import run_blocking
+from config import BOT_MODE
+
+logger = logging.getLogger(__name__)
+
+FSM_STORAGE = os.getenv("FSM_STORAGE", "postgres")   # postgres | memory
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1.0"))
+FSM_FLUSH_BATCH = int(os.getenv("FSM_FLUSH_BATCH", "100"))
+FSM_CACHE_SECONDS = float(os.getenv("FSM_CACHE_SECONDS", "300"))
+FSM_STATE_TTL_DAYS = int(os.getenv("FSM_STATE_TTL_DAYS", "7"))
+
+Key = tuple[int, int]
+
+
+# =========================
+# Доступ к БД (блокирующие)
+# =========================
+def load_fsm_state(chat_id: int, user_id: int) -> tuple[str | None, dict]:
+    db = SessionLocal()
+    try:
+        row = db.query(FSMState.state, FSMState.data).filter(
+            FSMState.chat_id == chat_id, FSMState.user_id == user_id
+        ).first()
+    finally:
+        db.close()
+    return (row.state, dict(row.data or {})) if row else (None, {})
+
+
+def split_rows(rows: list[tuple[Key, str | None, dict]]) -> tuple[list[dict], list[Key]]:
+    """Записи на upsert и ключи на удаление (пустое состояние хранить незачем)."""
+    now = datetime.utcnow()
+    upserts, deletes = [], []
+    for (chat_id, user_id), state, data in rows:
+        if state is None and not data:
+            deletes.append((chat_id, user_id))
+        else:
+            upserts.append({"chat_id": chat_id, "user_id": user_id, "state": state, "data": data, "updated_at": now})
+    return upserts, deletes
+
+
+def save_fsm_states(rows: list[tuple[Key, str | None, dict]]):
+    """Одна транзакция на пачку: один upsert и один DELETE."""
+    upserts, deletes = split_rows(rows)
+    db = SessionLocal()
+    try:
+        if upserts:
+            stmt = insert(FSMState).values(upserts)
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=["chat_id", "user_id"],
+                set_={"state": stmt.excluded.state, "data": stmt.excluded.data, "updated_at": stmt.excluded.updated_at},
+            ))
+        if deletes:
+            db.query(FSMState).filter(
+                tuple_(FSMState.chat_id, FSMState.user_id).in_(deletes)
+            ).delete(synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def cleanup_fsm_states(ttl_days: int = FSM_STATE_TTL_DAYS) -> int:
+    """Удаляет брошенные сессии (не менялись ttl_days дней). Возвращает число строк."""
+    db = SessionLocal()
+    try:
+        deleted = db.query(FSMState).filter(
+            FSMState.updated_at < datetime.utcnow() - timedelta(days=ttl_days)
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+# =========================
+# Хранилище
+# =========================
+class PostgresStorage(BaseStorage):
+    def __init__(self, flush_interval: float = FSM_FLUSH_INTERVAL, flush_batch: int = FSM_FLUSH_BATCH,
+                 cache_seconds: float = FSM_CACHE_SECONDS, write_behind: bool = True):
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.cache_seconds = cache_seconds
+        self.write_behind = write_behind
+        self._cache: dict[Key, dict] = {}   # key -> {"state", "data", "at"}
+        self._dirty: set[Key] = set()
+        # Примитивы asyncio создаём в том loop, где хранилище реально используется
+        self._loop = None
+        self._key_locks: dict[Key, list] = {}   # key -> [asyncio.Lock, сколько держат/ждут]
+        self._wake = None
+        self._flusher = None
+
+    # ---------- служебное ----------
+    def _key(self, chat, user) -> Key:
+        chat, user = self.check_address(chat=chat, user=user)
+        return int(chat), int(user)
+
+    def _ensure_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._key_locks = {}
+            self._wake = asyncio.Event()
+            self._flusher = None
+
+    async def _entry(self, key: Key) -> dict:
+        self._ensure_loop()
+        entry = self._cache.get(key)
+        if entry is not None and (key in self._dirty or time.monotonic() - entry["at"] < self.cache_seconds):
+            return entry
+        state, data = await run_blocking(load_fsm_state, *key)
+        entry = {"state": state, "data": data, "at": time.monotonic()}
+        if self.cache_seconds > 0:
+            self._cache[key] = entry
+        return entry
+
+    def _touch(self, key: Key, state, data):
+        self._cache[key] = {"state": state, "data": data, "at": time.monotonic()}
+
+    def _unref(self, key: Key):
+        entry = self._key_locks[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._key_locks[key]
+
+    @contextlib.asynccontextmanager
+    async def _locked(self, keys):
+        """Замки ключей (в порядке сортировки — без взаимных блокировок у пачек); свободные удаляются."""
+        held = []
+        try:
+            for key in sorted(keys):
+                entry = self._key_locks.setdefault(key, [asyncio.Lock(), 0])
+                entry[1] += 1
+                try:
+                    await entry[0].acquire()
+                except BaseException:
+                    self._unref(key)
+                    raise
+                held.append(key)
+            yield
+        finally:
+            for key in held:
+                self._key_locks[key][0].release()
+                self._unref(key)
+
+    async def _write(self, keys):
+        """Сбрасывает ключи в БД сейчас. Снимок берётся под замками ключей — порядок записей ключа сохраняется."""
+        async with self._locked(keys):
+            rows = [(key, self._cache[key]["state"], copy.deepcopy(self._cache[key]["data"]))
+                    for key in keys if key in self._cache]
+            self._dirty.difference_update(keys)
+            if not rows:
+                return
+            try:
+                await run_blocking(save_fsm_states, rows, timeout=None)
+            except Exception:
+                if self.write_behind:
+                    # не потеряли: останутся грязными и уйдут со следующим сбросом
+                    self._dirty.update(key for key, _, _ in rows)
+                else:
+                    # без фонового сброса — забываем; следующее чтение возьмёт то, что в БД
+                    for key, _, _ in rows:
+                        self._cache.pop(key, None)
+                raise
+            if self.cache_seconds <= 0:
+                for key, _, _ in rows:
+                    if key not in self._dirty:
+                        self._cache.pop(key, None)
+
+    def _mark_dirty(self, key: Key):
+        self._dirty.add(key)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+        if len(self._dirty) >= self.flush_batch:
+            self._wake.set()
+
+    async def _flush_loop(self):
+        while self._dirty:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"[fsm] flush failed ({len(self._dirty)} keys pending): {e}")
+        self._prune_cache()
+
+    def _prune_cache(self):
+        deadline = time.monotonic() - self.cache_seconds
+        for key in [k for k, e in self._cache.items() if e["at"] < deadline and k not in self._dirty]:
+            del self._cache[key]
+
+    async def flush(self):
+        if self._dirty:
+            await self._write(set(self._dirty))
+
+    # ---------- BaseStorage ----------
+    async def close(self):
+        if self._loop is asyncio.get_running_loop():
+            await self.flush()
+            if self._flusher and not self._flusher.done():
+                self._flusher.cancel()
+        self._cache.clear()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        entry = await self._entry(self._key(chat, user))
+        return entry["state"] if entry["state"] is not None else self.resolve_state(default)
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        entry = await self._entry(self._key(chat, user))
+        return copy.deepcopy(entry["data"] if entry["data"] or default is None else default)
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        key = self._key(chat, user)
+        entry = await self._entry(key)
+        self._touch(key, self.resolve_state(state), entry["data"])
+        await self._write({key})
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        key = self._key(chat, user)
+        entry = await self._entry(key)
+        self._touch(key, entry["state"], copy.deepcopy(data or {}))
+        await self._write({key})
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        key = self._key(chat, user)
+        entry = await self._entry(key)
+        merged = dict(entry["data"])
+        merged.update(data or {}, **kwargs)
+        self._touch(key, entry["state"], merged)
+        if self.write_behind:
+            self._mark_dirty(key)
+        else:
+            await self._write({key})
+
+    async def reset_state(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          with_data: typing.Optional[bool] = True):
+        # одной записью вместо двух (set_state + set_data)
+        key = self._key(chat, user)
+        entry = await self._entry(key)
+        self._touch(key, None, {} if with_data else entry["data"])
+        await self._write({key})
+
+
+def create_storage() -> BaseStorage:
+    """FSM_STORAGE=memory — для локальной разработки без БД."""
+    if FSM_STORAGE == "memory":
+        from aiogram.contrib.fsm_storage.memory import MemoryStorage
+        return MemoryStorage()
+    if BOT_MODE == "webhook":
+        # апдейты пользователя обрабатывает не один процесс — только БД как источник правды
+        return PostgresStorage(cache_seconds=0, write_behind=False)
+    return PostgresStorage()
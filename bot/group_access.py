@@ -0,0 +1,293 @@
+# group_access.py
+"""
+Сверка участников закрытой группы с подписками.
+
+CLOSED_GROUP_LINK — общая ссылка, поэтому реальный состав группы может расходиться с БД.
+reconcile_group() параллельно (с ограничением и через send_engine) запрашивает getChatMember
+для всех, у кого has_group_access, и для недавно истёкших/отменённых подписок, и строит diff:
+  - members_without_access — в группе, но доступа нет (кандидаты на удаление);
+  - subscribers_not_joined — доступ есть, но в группу не вошли;
+  - unknown               — Telegram не ответил (ошибка / исчерпаны повторы).
+
+Удаление из группы — remove_from_group(): пачка telegram_id, ban -> unban через
+TelegramService.kick_from_group, не больше GROUP_REMOVE_CONCURRENCY одновременно.
+Идемпотентно: тех, у кого снова есть доступ, не трогаем; уже удалённых (group_removed_at)
+пропускаем, если не force=True.
+
+Запуск вручную:
+    python group_access.py              # только отчёт
+    python group_access.py --remove     # + удалить members_without_access
+"""
+import os
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, and_
+
+from config import GROUP_ID
+from database import SessionLocal, Subscription
+from blocking import run_blocking
+from telegram_service import TelegramService, with_http_session
+
+logger = logging.getLogger(__name__)
+
+GROUP_RECONCILE_CONCURRENCY = int(os.getenv("GROUP_RECONCILE_CONCURRENCY", "20"))
+GROUP_RECENT_EXPIRED_DAYS = int(os.getenv("GROUP_RECENT_EXPIRED_DAYS", "30"))   # насколько далеко смотреть назад
+GROUP_REMOVE_CONCURRENCY = int(os.getenv("GROUP_REMOVE_CONCURRENCY", "10"))
+
+# Статусы getChatMember, при которых пользователь находится в группе
+_MEMBER_STATUSES = {"creator", "administrator", "member"}
+# Владельца и админов никогда не трогаем
+_PROTECTED_STATUSES = {"creator", "administrator"}
+
+
+def load_candidates(recent_days: int = GROUP_RECENT_EXPIRED_DAYS) -> dict[int, bool]:
+    """
+    telegram_id -> должен ли быть доступ. Берём всех с has_group_access и тех,
+    чья подписка закончилась/отменена за последние recent_days дней.
+    """
+    since = datetime.utcnow() - timedelta(days=recent_days)
+    db = SessionLocal()
+    try:
+        rows = db.query(Subscription.telegram_id, Subscription.has_group_access).filter(
+            Subscription.telegram_id != None,
+            or_(
+                Subscription.has_group_access.is_(True),
+                and_(
+                    Subscription.status.in_(("expired", "cancelled")),
+                    or_(Subscription.cancelled_at >= since, Subscription.expires_at >= since),
+                ),
+            )
+        ).all()
+    finally:
+        db.close()
+
+    access: dict[int, bool] = {}
+    for telegram_id, has_access in rows:
+        # У одного пользователя может быть несколько подписок — хватит одной с доступом
+        access[telegram_id] = access.get(telegram_id, False) or bool(has_access)
+    return access
+
+
+def member_status(data) -> str | None:
+    """Статус из ответа getChatMember; restricted с is_member=True считаем участником."""
+    if not data or not data.get("ok"):
+        return None
+    result = data.get("result") or {}
+    status = result.get("status")
+    if status == "restricted":
+        return "member" if result.get("is_member") else "left"
+    return status
+
+
+async def fetch_membership(ts: TelegramService, group_id: int, telegram_ids: list[int],
+                           limit: int = GROUP_RECONCILE_CONCURRENCY) -> dict[int, str | None]:
+    """getChatMember для каждого id, не больше limit запросов одновременно (лимиты — в send_engine)."""
+    sem = asyncio.Semaphore(max(1, limit))
+
+    async def one(telegram_id):
+        async with sem:
+            try:
+                return telegram_id, member_status(await ts.get_chat_member(group_id, telegram_id))
+            except Exception as e:
+                logger.warning(f"[group_access] getChatMember failed for {telegram_id}: {e}")
+                return telegram_id, None
+
+    return dict(await asyncio.gather(*(one(tid) for tid in telegram_ids)))
+
+
+def build_diff(access: dict[int, bool], statuses: dict[int, str | None]) -> dict:
+    """Сравнивает «кто должен быть в группе» с «кто в ней есть»."""
+    members_without_access, subscribers_not_joined, joined, unknown = [], [], [], []
+    for telegram_id, should_have in access.items():
+        status = statuses.get(telegram_id)
+        if status is None:
+            unknown.append(telegram_id)
+        elif status in _MEMBER_STATUSES:
+            if should_have:
+                joined.append(telegram_id)
+            elif status not in _PROTECTED_STATUSES:
+                members_without_access.append(telegram_id)
+        elif should_have:
+            subscribers_not_joined.append(telegram_id)
+    return {
+        "checked": len(access),
+        "members_without_access": sorted(members_without_access),
+        "subscribers_not_joined": sorted(subscribers_not_joined),
+        "joined": sorted(joined),
+        "unknown": sorted(unknown),
+    }
+
+
+def _mark_joined(telegram_ids: list[int]):
+    """Проставляет group_joined_at тем, кого реально нашли в группе (если ещё не стояло)."""
+    if not telegram_ids:
+        return
+    db = SessionLocal()
+    try:
+        db.query(Subscription).filter(
+            Subscription.telegram_id.in_(telegram_ids),
+            Subscription.has_group_access.is_(True),
+            Subscription.group_joined_at == None,
+        ).update({"group_joined_at": datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _removal_plan(telegram_ids: list[int], force: bool) -> tuple[list[int], dict[int, str]]:
+    """Делит id на «удалять» и «пропустить» (has_access / already_removed) по текущему состоянию БД."""
+    db = SessionLocal()
+    try:
+        rows = db.query(
+            Subscription.telegram_id, Subscription.has_group_access, Subscription.group_removed_at
+        ).filter(Subscription.telegram_id.in_(telegram_ids)).all()
+    finally:
+        db.close()
+
+    has_access, removed = set(), {}
+    for telegram_id, access, removed_at in rows:
+        if access:
+            has_access.add(telegram_id)
+        # «уже удалён» — только если удалены по всем его подпискам
+        removed[telegram_id] = removed.get(telegram_id, True) and removed_at is not None
+
+    todo, skipped = [], {}
+    for telegram_id in telegram_ids:
+        if telegram_id in has_access:
+            skipped[telegram_id] = "has_access"
+        elif not force and removed.get(telegram_id):
+            skipped[telegram_id] = "already_removed"
+        else:
+            todo.append(telegram_id)
+    return todo, skipped
+
+
+def pending_removals(recent_days: int = GROUP_RECENT_EXPIRED_DAYS) -> list[int]:
+    """Истёкшие/отменённые за recent_days, которых ещё не удалили из группы (прошлые прогоны упали)."""
+    since = datetime.utcnow() - timedelta(days=recent_days)
+    db = SessionLocal()
+    try:
+        rows = db.query(Subscription.telegram_id).filter(
+            Subscription.status.in_(("expired", "cancelled")),
+            Subscription.has_group_access.is_(False),
+            Subscription.group_removed_at == None,
+            Subscription.cancelled_at >= since,
+        ).distinct().all()
+    finally:
+        db.close()
+    return [tid for (tid,) in rows]
+
+
+def _record_removed(telegram_ids: list[int]):
+    if not telegram_ids:
+        return
+    db = SessionLocal()
+    try:
+        db.query(Subscription).filter(
+            Subscription.telegram_id.in_(telegram_ids),
+            Subscription.has_group_access.is_(False),
+        ).update({"group_removed_at": datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def remove_from_group(telegram_ids: list[int], group_id: int | None = GROUP_ID,
+                            limit: int = GROUP_REMOVE_CONCURRENCY, force: bool = False,
+                            ts: TelegramService | None = None) -> dict[int, dict]:
+    """
+    Удаляет пачку пользователей из группы. Возвращает telegram_id -> результат:
+    {"result": "removed" | "skipped" | "failed", "reason"/"stage"/"error": ...}.
+    """
+    telegram_ids = list(dict.fromkeys(tid for tid in telegram_ids if tid))
+    if not telegram_ids:
+        return {}
+
+    todo, skipped = await run_blocking(_removal_plan, telegram_ids, force)
+    results = {tid: {"result": "skipped", "reason": reason} for tid, reason in skipped.items()}
+
+    ts = ts or TelegramService()
+    sem = asyncio.Semaphore(max(1, limit))
+
+    async def one(telegram_id):
+        async with sem:
+            try:
+                res = await ts.kick_from_group(telegram_id, group_id)
+            except Exception as e:
+                res = {"ok": False, "stage": "ban", "error": str(e)}
+        if res["ok"]:
+            return telegram_id, {"result": "removed"}
+        logger.warning(f"[group_access] failed to remove {telegram_id} at {res['stage']}: {res['error']}")
+        return telegram_id, {"result": "failed", "stage": res["stage"], "error": res["error"]}
+
+    results.update(await asyncio.gather(*(one(tid) for tid in todo)))
+    await run_blocking(_record_removed, [tid for tid, r in results.items() if r["result"] == "removed"], timeout=None)
+
+    summary = summarize_removal(results)
+    logger.info(f"[group_access] removal: {summary}")
+    return results
+
+
+def summarize_removal(results: dict[int, dict]) -> dict:
+    summary = {"removed": 0, "skipped": 0, "failed": 0}
+    for r in results.values():
+        summary[r["result"]] += 1
+    return summary
+
+
+async def reconcile_group(group_id: int | None = GROUP_ID, remove: bool = False,
+                          limit: int = GROUP_RECONCILE_CONCURRENCY) -> dict:
+    """Полная сверка группы. remove=True — сразу удалить members_without_access."""
+    if not group_id:
+        raise RuntimeError("GROUP_ID is not set")
+
+    started = datetime.utcnow()
+    access = await run_blocking(load_candidates)
+    logger.info(f"[group_access] checking {len(access)} users in group {group_id}")
+
+    ts = TelegramService()
+    statuses = await fetch_membership(ts, group_id, list(access), limit)
+    report = build_diff(access, statuses)
+    await run_blocking(_mark_joined, report["joined"], timeout=None)
+
+    if remove and report["members_without_access"]:
+        # Членство только что проверено — удаляем даже тех, кого уже удаляли (вернулись по ссылке)
+        removed = await remove_from_group(report["members_without_access"], group_id, force=True, ts=ts)
+        report["removed"] = sorted(tid for tid, r in removed.items() if r["result"] == "removed")
+        report["remove_failed"] = sorted(tid for tid, r in removed.items() if r["result"] == "failed")
+
+    report["took_seconds"] = round((datetime.utcnow() - started).total_seconds(), 1)
+    logger.info(
+        f"[group_access] checked={report['checked']} "
+        f"without_access={len(report['members_without_access'])} "
+        f"not_joined={len(report['subscribers_not_joined'])} unknown={len(report['unknown'])} "
+        f"took={report['took_seconds']}s"
+    )
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile closed group members with subscriptions.")
+    parser.add_argument("--group", type=int, default=GROUP_ID, help="Target group/chat ID")
+    parser.add_argument("--remove", action="store_true", help="Remove members without access")
+    parser.add_argument("--concurrency", type=int, default=GROUP_RECONCILE_CONCURRENCY)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    report = asyncio.run(with_http_session(reconcile_group(args.group, args.remove, args.concurrency)))
+    for key in ("members_without_access", "subscribers_not_joined", "unknown", "removed", "remove_failed"):
+        if key in report:
+            print(f"{key}: {len(report[key])} {report[key][:50]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# job_runs.py
+"""
+История и метрики запусков джобов tasks.py (таблица job_runs).
+
+@record_job("name") оборачивает корутину-джоб: на время запуска в contextvar кладётся
+JobMetrics, куда пишут
+  - count_api_call() — каждый запрос к Telegram (send_engine) и Stripe/PayPal;
+  - observe_latency() — время обработки одного элемента (tasks._fan_out).
+contextvar копируется в задачи asyncio.gather и в поток blocking.run_blocking, поэтому считаются и
+параллельные элементы, и вызовы из потоков. После запуска пишется строка job_runs, а в dict
+результата добавляются api_calls и p95_ms (их видит сводка админу и job_state).
+/jobs у админа — recent_runs() + format_runs().
+"""
+import math
+import time
+import asyncio
+import logging
+import threading
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+
+from database import SessionLocal, JobRun
+from blocking import run_blocking
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar["JobMetrics | None"] = ContextVar("job_metrics", default=None)
+
+
+class JobMetrics:
+    def __init__(self):
+        self.api_calls = 0
+        self.latencies: list[float] = []
+        self._lock = threading.Lock()   # считаем и из потоков (run_blocking)
+
+    def add_api_call(self, n: int = 1):
+        with self._lock:
+            self.api_calls += n
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def p95_ms(self) -> float | None:
+        """p95 по nearest-rank; None — поэлементных замеров не было."""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        k = max(0, math.ceil(0.95 * len(ordered)) - 1)
+        return round(ordered[k] * 1000, 1)
+
+
+def count_api_call(n: int = 1):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add_api_call(n)
+
+
+def observe_latency(seconds: float):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.observe(seconds)
+
+
+def save_run(job_name: str, started_at: datetime, duration: float, status: str,
+             result, metrics: JobMetrics, error: str | None = None):
+    result = result if isinstance(result, dict) else {}
+    db = SessionLocal()
+    try:
+        db.add(JobRun(
+            job_name=job_name,
+            started_at=started_at,
+            finished_at=datetime.utcnow(),
+            duration=round(duration, 3),
+            status=status,
+            candidates=result.get("candidates"),
+            ok=result.get("ok"),
+            failed=result.get("failed"),
+            api_calls=metrics.api_calls,
+            p95_ms=metrics.p95_ms(),
+            error=(error or "")[:2000] or None,
+        ))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def record_job(job_name: str):
+    """Декоратор корутины-джоба: метрики запуска + строка в job_runs (ошибка записи джоб не ломает)."""
+    def decorator(fn):
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            metrics = JobMetrics()
+            token = _current.set(metrics)
+            started_at = datetime.utcnow()
+            t0 = time.perf_counter()
+            status, error, result = "ok", None, None
+            try:
+                result = await fn(*args, **kwargs)
+                if isinstance(result, dict):
+                    result["api_calls"] = metrics.api_calls
+                    result["p95_ms"] = metrics.p95_ms()
+                return result
+            except asyncio.CancelledError:
+                status, error = "cancelled", "cancelled"
+                raise
+            except Exception as e:
+                status, error = "failed", f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                _current.reset(token)
+                try:
+                    await run_blocking(
+                        save_run, job_name, started_at, time.perf_counter() - t0, status, result, metrics, error,
+                        timeout=None,
+                    )
+                except Exception as e:
+                    logger.error(f"[job_runs] failed to store run of {job_name}: {e}")
+        return wrapper
+    return decorator
+
+
+def recent_runs(limit: int = 10, job_name: str | None = None) -> list[JobRun]:
+    """Последние запуски (индексы по started_at и (job_name, started_at))."""
+    db = SessionLocal()
+    try:
+        q = db.query(JobRun)
+        if job_name:
+            q = q.filter(JobRun.job_name == job_name)
+        return q.order_by(JobRun.started_at.desc()).limit(limit).all()
+    finally:
+        db.close()
+
+
+def format_runs(runs: list[JobRun]) -> str:
+    if not runs:
+        return "Запусков джобов пока нет."
+    lines = ["<b>Последние запуски джобов</b> (UTC)"]
+    for r in runs:
+        icon = "✅" if r.status == "ok" else "❌"
+        counts = f"{r.ok}/{r.candidates} (failed: {r.failed})" if r.candidates is not None else "—"
+        p95 = f"{r.p95_ms:.0f}ms" if r.p95_ms is not None else "—"
+        lines.append(
+            f"{icon} <code>{r.job_name}</code> {r.started_at:%d.%m %H:%M} — {r.duration or 0:.1f}s, "
+            f"{counts}, api: {r.api_calls}, p95: {p95}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,205 @@
+# leader.py
+"""
+Выбор лидера через Postgres advisory lock.
+
+Фоновую работу (polling Telegram, планировщик, цикл истечения подписок) должен выполнять
+ровно один процесс, сколько бы воркеров/дино ни было запущено:
+  - лидер держит pg_try_advisory_lock на отдельном соединении; если процесс умирает,
+    соединение закрывается и Postgres сам снимает блокировку;
+  - лидер раз в LEADER_HEARTBEAT_SECONDS проверяет, что соединение живо и блокировка его;
+    если нет — отменяет работу и снова становится кандидатом;
+  - остальные раз в LEADER_RETRY_SECONDS пытаются взять блокировку (failover).
+LEADER_ELECTION=0 — выключить (локальная разработка, один процесс).
+"""
+import os
+import zlib
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+LEADER_ELECTION = os.getenv("LEADER_ELECTION", "1") == "1"
+LEADER_HEARTBEAT_SECONDS = float(os.getenv("LEADER_HEARTBEAT_SECONDS", "10"))
+LEADER_RETRY_SECONDS = float(os.getenv("LEADER_RETRY_SECONDS", "15"))
+LEADER_DB_TIMEOUT = float(os.getenv("LEADER_DB_TIMEOUT", "5"))   # если БД не ответила за это время — уступаем
+
+_status: dict[str, bool] = {}   # имя роли -> лидер ли этот процесс (для /health)
+
+# Не общий пул blocking: там в очереди стоят Stripe/PayPal и запросы хендлеров, и ожидание
+# места съедало бы LEADER_DB_TIMEOUT — heartbeat «терял» лидерство при занятом пуле.
+# Вызовов мало (раз в LEADER_HEARTBEAT_SECONDS на роль); запас — на зависший по таймауту вызов.
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="leader")
+
+
+def lock_key(name: str) -> int:
+    """Стабильный ключ advisory lock для роли (одинаковый во всех процессах)."""
+    return zlib.crc32(f"expertlash:{name}".encode())
+
+
+def leadership_status() -> dict:
+    return dict(_status)
+
+
+class LeaderLock:
+    """
+    Сессионный advisory lock на выделенном соединении. Все методы — блокирующие.
+
+    wait_for по таймауту только перестаёт ждать поток: запрос доработает и может взять
+    блокировку уже после того, как мы решили, что не лидер. Поэтому на время запроса поток
+    забирает соединение себе, а abandon() помечает брошенные вызовы: вернувшись, такой вызов
+    соединение закрывает (и с ним блокировку), а не оставляет лидеру, который о нём не знает.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.key = lock_key(name)
+        self._conn = None
+        self._generation = 0            # abandon() увеличивает: вызовы со старым номером брошены
+        self._guard = threading.Lock()
+
+    def _checkout(self):
+        with self._guard:
+            conn, self._conn = self._conn, None
+            return conn, self._generation
+
+    def _checkin(self, conn, generation: int, keep: bool) -> bool:
+        """Вернуть соединение после запроса; не нужно или вызов брошен — закрыть."""
+        with self._guard:
+            keep = keep and generation == self._generation and self._conn is None
+            if keep:
+                self._conn = conn
+        if not keep:
+            _close(conn)
+        return keep
+
+    def abandon(self):
+        """Вызыватель перестал ждать (таймаут): идущий запрос закроет своё соединение сам."""
+        with self._guard:
+            self._generation += 1
+
+    def try_acquire(self) -> bool:
+        conn, generation = self._checkout()
+        try:
+            if conn is None:
+                conn = engine.connect()
+            acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}).scalar()
+            conn.commit()
+        except Exception:
+            _close(conn)
+            raise
+        # Соединение не держим, пока мы не лидер
+        return self._checkin(conn, generation, bool(acquired))
+
+    def still_held(self) -> bool:
+        conn, generation = self._checkout()
+        if conn is None:
+            return False
+        try:
+            held = conn.execute(text(
+                "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND granted "
+                "AND pid = pg_backend_pid() AND objsubid = 1 AND objid::bigint = :key"
+            ), {"key": self.key}).scalar()
+            conn.commit()
+        except Exception:
+            _close(conn)
+            raise
+        return self._checkin(conn, generation, bool(held))
+
+    def release(self):
+        conn, _ = self._checkout()
+        if conn is None:
+            return
+        try:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.key})
+            conn.commit()
+        except Exception as e:
+            logger.warning(f"[leader] {self.name}: unlock failed: {e}")
+        finally:
+            _close(conn)
+
+    def close(self):
+        _close(self._checkout()[0])
+
+
+def _close(conn):
+    if conn is not None:
+        try:
+            # invalidate: соединение не вернётся в пул с висящей блокировкой
+            conn.invalidate()
+            conn.close()
+        except Exception:
+            pass
+
+
+def _in_thread(fn, *args):
+    return asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+async def _db_call(lock: LeaderLock, fn):
+    try:
+        return await asyncio.wait_for(_in_thread(fn), timeout=LEADER_DB_TIMEOUT)
+    except asyncio.TimeoutError:
+        lock.abandon()
+        raise
+
+
+async def run_as_leader(name: str, work, heartbeat: float = LEADER_HEARTBEAT_SECONDS,
+                        retry: float = LEADER_RETRY_SECONDS, lock: LeaderLock | None = None):
+    """
+    Выполняет work() (корутина-функция) только пока этот процесс — лидер роли name.
+    Если лидерство потеряно — work отменяется; если work завершилась сама — выходим.
+    """
+    if not LEADER_ELECTION:
+        _status[name] = True
+        return await work()
+
+    lock = lock or LeaderLock(name)
+    _status[name] = False
+    while True:
+        try:
+            acquired = await _db_call(lock, lock.try_acquire)
+        except Exception as e:
+            logger.warning(f"[leader] {name}: acquire failed: {e}")
+            acquired = False
+
+        if not acquired:
+            await asyncio.sleep(retry)
+            continue
+
+        logger.info(f"[leader] {name}: this process is the leader")
+        _status[name] = True
+        task = asyncio.create_task(work())
+        lost = False
+        try:
+            while not task.done():
+                done, _ = await asyncio.wait({task}, timeout=heartbeat)
+                if done:
+                    break
+                try:
+                    held = await _db_call(lock, lock.still_held)
+                except Exception as e:
+                    logger.warning(f"[leader] {name}: heartbeat failed: {e}")
+                    held = False
+                if not held:
+                    lost = True
+                    logger.error(f"[leader] {name}: leadership lost, stopping work")
+                    break
+        finally:
+            _status[name] = False
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            if lost:
+                await _in_thread(lock.close)
+            else:
+                await _in_thread(lock.release)
+
+        if not lost:
+            # work завершилась сама (или упала) — лидерство отдаём и выходим
+            return task.result()
+        await asyncio.sleep(retry)
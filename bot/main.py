@@ -6,6 +6,7 @@ import threading
 import sys
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TelegramAPIServer
 from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton,
     ReplyKeyboardMarkup, KeyboardButton, WebAppInfo  
@@ -13,16 +14,28 @@ from aiogram.types import (
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.contrib.middlewares.logging import LoggingMiddleware
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from config import BOT_TOKEN as CONF_BOT_TOKEN, VIDEO_PRESENTATION_FILE_ID, VIDEO_REVIEWS, ADMIN_IDS
-from payment_config import SUBSCRIPTION_PRICE, CLOSED_GROUP_LINK
-from database import (
-    create_tables, get_db, get_user_by_telegram_id, create_user,
-    update_user_onboarding, create_subscription, get_active_subscription
+from config import (
+    BOT_TOKEN as CONF_BOT_TOKEN, ADMIN_IDS, TELEGRAM_API_BASE,
+    BOT_MODE, TELEGRAM_WEBHOOK_SECRET, TELEGRAM_WEBHOOK_PATH, TELEGRAM_WEBHOOK_BASE, TELEGRAM_ALLOWED_UPDATES,
+    TELEGRAM_DROP_PENDING_UPDATES,
 )
-from payment_service import StripeService, PayPalService
-from telegram_service import TelegramService, manage_group_access_loop
-from webhook import app
+from payment_config import SUBSCRIPTION_PRICE, CLOSED_GROUP_LINK
+from database import create_tables, get_db, update_user_onboarding
+from blocking import run_blocking
+from telegram_service import TelegramService, startup_http_session, close_http_session
+from expiry import run_expiry_engine
+from job_runs import recent_runs, format_runs
+from fsm_storage import create_storage
+from user_context import UserContextMiddleware, register_user, user_cache, is_admin
+from throttling import ThrottlingMiddleware, rate_limit
+from callback_router import CallbackRouter
+from onboarding_events import track, events as onboarding_events, load_funnel, format_funnel
+from pay_links import open_payment
+from update_queue import UpdateQueue, poll_updates, is_group_noise
+from outbox import run_outbox_dispatcher
+from leader import run_as_leader
+import media
+from webhook import app, set_update_handler
 # 1. Загрузка .env и инициализация
 load_dotenv()
 ENV_BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -30,11 +43,21 @@ BOT_TOKEN = ENV_BOT_TOKEN or CONF_BOT_TOKEN
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN is not set (neither in .env nor in config.py)")
 
-bot = Bot(token=BOT_TOKEN, parse_mode="HTML")
+# TELEGRAM_API_BASE позволяет направить бота на локальный fake_telegram_api.py
+bot = Bot(token=BOT_TOKEN, parse_mode="HTML", server=TelegramAPIServer.from_base(TELEGRAM_API_BASE))
 FLASK_ENV = os.getenv("FLASK_ENV", "dev")
 
-storage = MemoryStorage()
+# Онбординг хранится в Postgres (fsm_state): переживает рестарт, общий для процессов
+storage = create_storage()
 dp = Dispatcher(bot, storage=storage)
+# Анти-флуд в личке (throttling.py) — раньше контекста: отброшенный апдейт не трогает БД
+dp.middleware.setup(ThrottlingMiddleware())
+# Пользователь и активная подписка — один раз на апдейт, из кэша (user_context.py)
+dp.middleware.setup(UserContextMiddleware())
+# Все inline-кнопки "prefix:value" — через один хендлер с разбором по префиксу (callback_router.py)
+callbacks = CallbackRouter()
+callbacks.attach(dp)
+telegram_service = TelegramService()
 
 # Создаем таблицы при запуске
 create_tables()
@@ -58,21 +81,16 @@ def create_inline_keyboard(buttons, prefix, row_width=2):
         kb.insert(InlineKeyboardButton(label, callback_data=f"{prefix}:{data_value}"))
     return kb
 
-def get_platform_keyboard(user_id: int):
-    db = next(get_db())
-    try:
-        sub = get_active_subscription(db, user_id)
-        if sub:
-            kb = InlineKeyboardMarkup().add(
-                InlineKeyboardButton(
-                    "📲 Apri la piattaforma",
-                    web_app=WebAppInfo(url=APP_URL)
-                )
+def get_platform_keyboard(subscription):
+    """Кнопка платформы — только при активной подписке (снимок из user_context)."""
+    if subscription:
+        return InlineKeyboardMarkup().add(
+            InlineKeyboardButton(
+                "📲 Apri la piattaforma",
+                web_app=WebAppInfo(url=APP_URL)
             )
-            return kb
-        return None
-    finally:
-        db.close()
+        )
+    return None
 
 # Общая клавиатура выбора метода оплаты
 def payment_method_keyboard():
@@ -88,86 +106,54 @@ def get_main_reply_keyboard():
     kb.add(KeyboardButton("⭐ Recensioni"), KeyboardButton("📞 Consulenza"))
     return kb
 
-# 5. Функция для безопасной отправки видео
-async def send_video_or_placeholder(message, file_id, caption, placeholder_text):
-    if file_id and file_id.strip():
-        try:
-            await message.answer_video(file_id, caption=caption)
-        except Exception:
-            await message.answer(f"🎬 {placeholder_text}\n\n<i>Il video non è temporaneamente disponibile</i>")
-    else:
+# 5. Функция для безопасной отправки видео (по ключу из media_assets)
+async def send_video_or_placeholder(message, media_key, caption, placeholder_text):
+    result = None
+    try:
+        result = await telegram_service.send_video_asset(message.chat.id, media_key, caption)
+    except Exception as e:
+        logging.warning(f"send_video_asset failed for '{media_key}': {e}")
+    if not result:
         await message.answer(f"🎬 {placeholder_text}\n\n<i>Il video non è temporaneamente disponibile</i>")
 
-# 6. Функция для работы с базой данных
-def get_or_create_user(telegram_id: int, username: str = None, first_name: str = None, last_name: str = None):
-    db = next(get_db())
+# Отзывы — альбомами по 10 видео (sendMediaGroup), а не отдельным вызовом на каждое
+async def send_review_videos(message):
     try:
-        user = get_user_by_telegram_id(db, telegram_id)
-        if not user:
-            # если юзер в ADMIN_IDS → роль admin, иначе student
-            from config import ADMIN_IDS
-            from database import UserRole
-
-            role = UserRole.admin if str(telegram_id) in [str(x) for x in ADMIN_IDS] else UserRole.student
-
-            user = create_user(
-                db,
-                telegram_id=telegram_id,
-                username=username,
-                first_name=first_name,
-                last_name=last_name,
-                role=role
-            )
-        return user
-    finally:
-        db.close()
-
-#  ГЛУШИТЕЛЬ ДЛЯ ГРУПП 
-@dp.message_handler(lambda m: (m.chat.type != types.ChatType.PRIVATE) and ((m.text or "").split()[0].lower() != "/app"), state="*")
-async def ignore_groups(msg: types.Message, state: FSMContext):
-    
-    return
+        await telegram_service.send_video_album(
+            message.chat.id,
+            media.REVIEW_PREFIX,
+            "Recensione {n}",
+            "🎬 Recensione della studentessa n.{n}\n\n<i>Il video non è temporaneamente disponibile</i>",
+        )
+    except Exception as e:
+        logging.warning(f"send_video_album failed for reviews: {e}")
 
 # ХЕНДЛЕР /app ДЛЯ ЛИЧКИ
 @dp.message_handler(commands=["app"], chat_type=types.ChatType.PRIVATE)
-async def private_webapp(msg: types.Message):
-    db = next(get_db())
-    try:
-        user = get_user_by_telegram_id(db, msg.from_user.id)
-
-        # Если юзер админ → всегда доступ
-        if user and user.role == "admin":
-            kb = InlineKeyboardMarkup().add(
-                InlineKeyboardButton(
-                    "📲 Apri la piattaforma (ADMIN)",
-                    web_app=WebAppInfo(url=APP_URL)
-                )
-            )
-            await msg.answer("✅ Accesso admin! Apri la piattaforma:", reply_markup=kb)
-            return
-
-        # Иначе проверяем подписку
-        sub = get_active_subscription(db, user.id)
-        if sub:
-            kb = InlineKeyboardMarkup().add(
-                InlineKeyboardButton(
-                    "📲 Apri la piattaforma",
-                    web_app=WebAppInfo(url=APP_URL)
-                )
-            )
-            await msg.answer("✅ Abbonamento attivo! Apri la piattaforma:", reply_markup=kb)
-        else:
-            await msg.answer(
-                f"❌ Non hai un abbonamento attivo.\n\n"
-                f"Puoi accedere per soli {SUBSCRIPTION_PRICE}€ al mese.\n\n"
-                "Scegli il metodo di pagamento:",
-                reply_markup=payment_method_keyboard()
+async def private_webapp(msg: types.Message, user=None, subscription=None):
+    # Если юзер админ → всегда доступ
+    if is_admin(user, msg.from_user.id):
+        kb = InlineKeyboardMarkup().add(
+            InlineKeyboardButton(
+                "📲 Apri la piattaforma (ADMIN)",
+                web_app=WebAppInfo(url=APP_URL)
             )
-            await Onboarding.payment_method.set()
+        )
+        await msg.answer("✅ Accesso admin! Apri la piattaforma:", reply_markup=kb)
+        return
+
+    # Иначе проверяем подписку
+    if subscription:
+        await msg.answer("✅ Abbonamento attivo! Apri la piattaforma:", reply_markup=get_platform_keyboard(subscription))
+    else:
+        await msg.answer(
+            f"❌ Non hai un abbonamento attivo.\n\n"
+            f"Puoi accedere per soli {SUBSCRIPTION_PRICE}€ al mese.\n\n"
+            "Scegli il metodo di pagamento:",
+            reply_markup=payment_method_keyboard()
+        )
+        await Onboarding.payment_method.set()
 
-    finally:
-        db.close()
-        
 # ХЕНДЛЕР /app ДЛЯ ГРУПП 
 @dp.message_handler(commands=["app"], chat_type=[types.ChatType.SUPERGROUP, types.ChatType.GROUP])
 async def group_webapp(msg: types.Message):
@@ -183,29 +169,17 @@ async def group_webapp(msg: types.Message):
 
 # 7. Старт онбординга (ФИНАЛЬНАЯ ВЕРСИЯ)
 @dp.message_handler(commands=["start"], state="*", chat_type=types.ChatType.PRIVATE)
-async def cmd_start(msg: types.Message, state: FSMContext):
+@rate_limit(0.2, burst=3)
+async def cmd_start(msg: types.Message, state: FSMContext, user=None, subscription=None):
     await state.finish()  # Всегда сбрасываем состояние при /start
 
-    # Сначала получаем пользователя из БД
-    db = next(get_db())
-    try:
-        user = get_or_create_user(
-            db, # Передаем сессию, чтобы избежать повторного открытия
-            telegram_id=msg.from_user.id,
-            username=msg.from_user.username,
-            first_name=msg.from_user.first_name,
-            last_name=msg.from_user.last_name
-        )
-        
-        # Проверяем подписку по user.id
-        subscription = get_active_subscription(db, user.id)
-        is_admin = (user.role == 'admin')
-
-    finally:
-        db.close()
+    # Пользователь и подписка уже загружены middleware (user_context.py); создаём только нового.
+    # Оплативший виден сразу: вебхук активации сбрасывает его запись в user_cache
+    if user is None:
+        user, subscription = await register_user(msg.from_user)
 
     # --- ГЛАВНАЯ ЛОГИКА: ПРОВЕРКА ДОСТУПА ---
-    if subscription or is_admin:
+    if subscription or is_admin(user, msg.from_user.id):
         # СЦЕНАРИЙ 1: У пользователя уже есть доступ
         kb = InlineKeyboardMarkup().add(
             InlineKeyboardButton("📲 Apri la piattaforma", web_app=WebAppInfo(url=APP_URL))
@@ -220,6 +194,7 @@ async def cmd_start(msg: types.Message, state: FSMContext):
     else:
         # СЦЕНАРИЙ 2: Доступа нет, запускаем полный онбординг
         await Onboarding.format.set()
+        track(msg.from_user.id, "start")
         
         # Сначала отправляем основную клавиатуру
         await msg.answer("💡 <i>Per una navigazione rapida, usa i pulsanti nel pannello in basso:</i>",
@@ -233,21 +208,11 @@ async def cmd_start(msg: types.Message, state: FSMContext):
             reply_markup=format_kb
         )
 
-# Переопределяем get_or_create_user, чтобы он принимал сессию
-def get_or_create_user(db, telegram_id: int, username: str = None, first_name: str = None, last_name: str = None):
-    user = get_user_by_telegram_id(db, telegram_id)
-    if not user:
-        from config import ADMIN_IDS
-        from database import UserRole
-        role = UserRole.admin if str(telegram_id) in [str(x) for x in ADMIN_IDS] else UserRole.student
-        user = create_user(db, telegram_id=telegram_id, username=username, first_name=first_name, last_name=last_name, role=role)
-    return user
-        
 # 8. Обработка формата
-@dp.callback_query_handler(lambda c: c.data.startswith("format:"), state=Onboarding.format)
-async def process_format(c: types.CallbackQuery, state: FSMContext):
-    chosen_format = c.data.split(":", 1)[1]
+@callbacks.route("format", state=Onboarding.format)
+async def process_format(c: types.CallbackQuery, state: FSMContext, chosen_format: str):
     await state.update_data(format=chosen_format)
+    track(c.from_user.id, "format", chosen_format)
     await Onboarding.next()  # level
 
     level_kb = create_inline_keyboard([
@@ -263,10 +228,10 @@ async def process_format(c: types.CallbackQuery, state: FSMContext):
     await c.answer()
 
 # 9. Уровень
-@dp.callback_query_handler(lambda c: c.data.startswith("level:"), state=Onboarding.level)
-async def process_level(c: types.CallbackQuery, state: FSMContext):
-    chosen_level = c.data.split(":", 1)[1]
+@callbacks.route("level", state=Onboarding.level)
+async def process_level(c: types.CallbackQuery, state: FSMContext, chosen_level: str):
     await state.update_data(level=chosen_level)
+    track(c.from_user.id, "level", chosen_level)
     await Onboarding.next()  # time
 
     time_kb = create_inline_keyboard([
@@ -282,10 +247,10 @@ async def process_level(c: types.CallbackQuery, state: FSMContext):
     await c.answer()
 
 # 10. Время
-@dp.callback_query_handler(lambda c: c.data.startswith("time:"), state=Onboarding.time)
-async def process_time(c: types.CallbackQuery, state: FSMContext):
-    chosen_time = c.data.split(":", 1)[1]
+@callbacks.route("time", state=Onboarding.time)
+async def process_time(c: types.CallbackQuery, state: FSMContext, chosen_time: str):
     await state.update_data(time=chosen_time)
+    track(c.from_user.id, "time", chosen_time)
     await Onboarding.next()  # goal
 
     goal_kb = create_inline_keyboard([
@@ -301,10 +266,10 @@ async def process_time(c: types.CallbackQuery, state: FSMContext):
     await c.answer()
 
 # 11. Цель
-@dp.callback_query_handler(lambda c: c.data.startswith("goal:"), state=Onboarding.goal)
-async def process_goal(c: types.CallbackQuery, state: FSMContext):
-    chosen_goal = c.data.split(":", 1)[1]
+@callbacks.route("goal", state=Onboarding.goal)
+async def process_goal(c: types.CallbackQuery, state: FSMContext, chosen_goal: str):
     await state.update_data(goal=chosen_goal)
+    track(c.from_user.id, "goal", chosen_goal)
     await Onboarding.next()  # promo_choice
 
     promo_kb = create_inline_keyboard([
@@ -321,16 +286,16 @@ async def process_goal(c: types.CallbackQuery, state: FSMContext):
     await c.answer()
 
 # 12. Промо выбор
-@dp.callback_query_handler(lambda c: c.data.startswith("promo:"), state=Onboarding.promo_choice)
-async def process_promo_choice(c: types.CallbackQuery, state: FSMContext):
-    chosen_promo = c.data.split(":", 1)[1]
+@callbacks.route("promo", state=Onboarding.promo_choice)
+async def process_promo_choice(c: types.CallbackQuery, state: FSMContext, chosen_promo: str):
     await state.update_data(promo_choice=chosen_promo)
+    track(c.from_user.id, "promo", chosen_promo)
     await Onboarding.next()  # final_choice
 
     if chosen_promo == "trial_lesson":
         await send_video_or_placeholder(
             c.message,
-            VIDEO_PRESENTATION_FILE_ID,
+            media.PRESENTATION_VIDEO,
             "Ti invio un breve video con una lezione di prova...\n\nGuardalo e fammi sapere cosa ne pensi!",
             "Lezione di prova – presentazione del corso"
         )
@@ -357,13 +322,7 @@ async def process_promo_choice(c: types.CallbackQuery, state: FSMContext):
         )
     elif chosen_promo == "course_reviews":
         await c.message.answer("⭐ <b>Recensioni reali delle nostre studentesse:</b>")
-        for i, (key, file_id) in enumerate(VIDEO_REVIEWS.items(), 1):
-            await send_video_or_placeholder(
-                c.message,
-                file_id,
-                f"Recensione {i}",
-                f"Recensione della studentessa n.{i}"
-            )
+        await send_review_videos(c.message)
 
     final_kb = create_inline_keyboard([
         ("😊 Ci sto!", "join"),
@@ -377,17 +336,12 @@ async def process_promo_choice(c: types.CallbackQuery, state: FSMContext):
     await c.answer()
 
 # 13. Финальный выбор
-@dp.callback_query_handler(lambda c: c.data.startswith("final:"), state=Onboarding.final_choice)
-async def process_final_choice(c: types.CallbackQuery, state: FSMContext):
-    chosen_final = c.data.split(":", 1)[1]
-
-    user_data = await state.get_data()
-
+def save_onboarding(telegram_id: int, user_data: dict):
     db = next(get_db())
     try:
         update_user_onboarding(
             db,
-            c.from_user.id,
+            telegram_id,
             user_data.get('format'),
             user_data.get('level'),
             user_data.get('time'),
@@ -396,6 +350,13 @@ async def process_final_choice(c: types.CallbackQuery, state: FSMContext):
     finally:
         db.close()
 
+@callbacks.route("final", state=Onboarding.final_choice)
+async def process_final_choice(c: types.CallbackQuery, state: FSMContext, chosen_final: str):
+    user_data = await state.get_data()
+    track(c.from_user.id, "final", chosen_final)
+
+    await run_blocking(save_onboarding, c.from_user.id, user_data, timeout=None)
+
     if chosen_final == "join":
         await c.message.answer(
             f"🎉 <b>Fantastico! Benvenuta al corso!</b>\n\n"
@@ -423,103 +384,58 @@ async def process_final_choice(c: types.CallbackQuery, state: FSMContext):
         await c.answer()
 
 # 14. Обработка выбора способа оплаты (ИСПРАВЛЕННАЯ ВЕРСИЯ)
-@dp.callback_query_handler(lambda c: c.data.startswith("payment_method:"), state=Onboarding.payment_method)
-async def process_payment_method(c: types.CallbackQuery, state: FSMContext):
-    chosen_method = c.data.split(":", 1)[1]
+@callbacks.route("payment_method", state=Onboarding.payment_method)
+@rate_limit(0.1, burst=2)
+async def process_payment_method(c: types.CallbackQuery, state: FSMContext, chosen_method: str, user=None):
     await state.update_data(payment_method=chosen_method)
+    track(c.from_user.id, "payment_method", chosen_method)
 
-    # Открываем сессию БД ОДИН РАЗ в начале
-    db = next(get_db())
-    try:
-        # 1. Находим пользователя по telegram_id, чтобы получить его внутренний user.id
-        user = get_user_by_telegram_id(db, c.from_user.id)
-        if not user:
-            await c.message.answer("Si è verificato un errore. Riprova con /start.")
-            await c.answer()
-            return
-
-        # 2. В зависимости от выбора, создаем платеж, передавая user.id
-        if chosen_method == "stripe":
-            # Передаем user.id в сервис для сохранения в метаданных
-            result = StripeService.create_subscription_session(user.id)
-
-            if result.get('success'):
-                # Создаем запись в нашей БД, привязывая ее к user.id
-                create_subscription(
-                    db,
-                    user_id=user.id,
-                    payment_system="stripe",
-                    subscription_id=result['session_id'], 
-                    order_id=result['session_id'],
-                    amount=SUBSCRIPTION_PRICE,
-                    customer_id=result.get('customer_id')
-                )
-
-                payment_link_kb = InlineKeyboardMarkup(row_width=1).add(
-                    InlineKeyboardButton("💳 Procedi al pagamento", url=result['url'])
-                )
-                await c.message.answer(
-                    "Hai scelto Stripe. Segui il link per effettuare il pagamento:\n\n"
-                    "Dopo il pagamento riceverai automaticamente l'accesso.",
-                    reply_markup=payment_link_kb
-                )
-            else:
-                await c.message.answer(
-                    f"❌ Errore durante la creazione del pagamento: {result.get('error', 'sconosciuto')}\n\n"
-                    "Riprova oppure scegli un altro metodo di pagamento."
-                )
-
-        elif chosen_method == "paypal":
-            # Передаем user.id в сервис для сохранения в custom_id
-            result = PayPalService.create_subscription(user.id)
-
-            if result.get('success'):
-                # Создаем запись в нашей БД, привязывая ее к user.id
-                create_subscription(
-                    db,
-                    user_id=user.id,
-                    payment_system="paypal",
-                    subscription_id=result['subscription_id'],
-                    order_id=result['subscription_id'],
-                    amount=SUBSCRIPTION_PRICE
-                )
-
-                payment_link_kb = InlineKeyboardMarkup(row_width=1).add(
-                    InlineKeyboardButton("🅿️ Procedi al pagamento", url=result['approval_url'])
-                )
-                await c.message.answer(
-                    "Hai scelto PayPal. Segui il link per effettuare il pagamento:\n\n"
-                    "Dopo il pagamento riceverai automaticamente l'accesso.",
-                    reply_markup=payment_link_kb
-                )
+    # 1. Внутренний user.id — из контекста апдейта (user_context.py), без своей сессии БД
+    if not user:
+        await c.message.answer("Si è verificato un errore. Riprova con /start.")
+        await c.answer()
+        return
+
+    # 2. Сессия у провайдера + pending-подписка (pay_links.open_payment; повторный выбор за
+    #    PAY_LINK_REUSE_MINUTES отдаёт ту же ссылку). Сетевые вызовы к Stripe/PayPal — в потоке,
+    #    чтобы не держать event loop (и чужие апдейты)
+    if chosen_method in ("stripe", "paypal"):
+        result = await run_blocking(open_payment, user.id, chosen_method, timeout=None)
+        if result.get('success'):
+            track(c.from_user.id, "payment_link", chosen_method)
+            if chosen_method == "stripe":
+                button, text = "💳 Procedi al pagamento", "Hai scelto Stripe. Segui il link per effettuare il pagamento:\n\n"
             else:
-                await c.message.answer(
-                    f"❌ Errore durante la creazione del pagamento: {result.get('error', 'sconosciuto')}\n\n"
-                    "Riprova oppure scegli un altro metodo di pagamento."
-                )
-    finally:        
-        db.close()
+                button, text = "🅿️ Procedi al pagamento", "Hai scelto PayPal. Segui il link per effettuare il pagamento:\n\n"
+            payment_link_kb = InlineKeyboardMarkup(row_width=1).add(
+                InlineKeyboardButton(button, url=result['url'])
+            )
+            await c.message.answer(
+                text + "Dopo il pagamento riceverai automaticamente l'accesso.",
+                reply_markup=payment_link_kb
+            )
+        else:
+            await c.message.answer(
+                f"❌ Errore durante la creazione del pagamento: {result.get('error', 'sconosciuto')}\n\n"
+                "Riprova oppure scegli un altro metodo di pagamento."
+            )
+        # после оплаты подписку перечитаем из БД, а не из кэша
+        user_cache.invalidate(c.from_user.id)
     await state.finish()
     await c.answer()
     
 # 15. Обработка кнопки "Начать заново"
 @dp.message_handler(text="🔄 Ricomincia da capo", state="*", chat_type=types.ChatType.PRIVATE)
-async def restart_onboarding(msg: types.Message, state: FSMContext):
-    await cmd_start(msg, state)
+async def restart_onboarding(msg: types.Message, state: FSMContext, user=None, subscription=None):
+    await cmd_start(msg, state, user=user, subscription=subscription)
 
 # 16. Обработка кнопки "Отзывы"
 @dp.message_handler(text="⭐ Recensioni", state="*", chat_type=types.ChatType.PRIVATE)
 async def show_reviews(msg: types.Message):
     await msg.answer("⭐ <b>Recensioni reali delle nostre studentesse:</b>")
     
-    if VIDEO_REVIEWS and isinstance(VIDEO_REVIEWS, dict):
-        for i, (key, file_id) in enumerate(VIDEO_REVIEWS.items(), 1):
-            await send_video_or_placeholder(
-                msg,
-                file_id,
-                f"Recensione {i}",
-                f"Recensione della studentessa n.{i}"
-            )
+    if media.media_keys(media.REVIEW_PREFIX):
+        await send_review_videos(msg)
     else:
         await msg.answer("<i>Al momento non ci sono recensioni video, ma appariranno presto!</i>")
 
@@ -538,46 +454,51 @@ async def show_consultation_info(msg: types.Message):
     )
 
 # 18. Обработка кнопки "Моя подписка"
-@dp.message_handler(text="💳 Il mio abbonamento", state="*")
-async def show_my_subscription(msg: types.Message, state: FSMContext):
-    db = next(get_db())
-    try:
-        user = get_user_by_telegram_id(db, msg.from_user.id)
-        if not user:
-            await msg.answer(
-                f"❌ Al momento non hai un abbonamento attivo.\n\n"
-                f"Puoi ottenere l'accesso alla nostra community privata per soli {SUBSCRIPTION_PRICE}€ al mese.\n\n"
-                "Scegli il metodo di pagamento:",
-                reply_markup=payment_method_keyboard()
-            )
-            await Onboarding.payment_method.set()
-            return
-
-        subscription = get_active_subscription(db, user.id)
-        if subscription:
-            start_date = subscription.created_at.strftime('%d.%m.%Y') if subscription.created_at else "—"
-            end_date = subscription.expires_at.strftime('%d.%m.%Y') if subscription.expires_at else "—"
-            order_id = getattr(subscription, "order_id", getattr(subscription, "payment_id", "—"))
-            
-            kb = get_platform_keyboard(msg.from_user.id)
-            
-            await msg.answer(
-                f"💳 <b>La tua sottoscrizione è attiva!</b>\n\n"
-                f"📅 Data di attivazione: <b>{start_date}</b>\n"
-                f"🔢 Numero ordine: <b>{order_id}</b>\n"
-                f"⏳ Valida fino al: <b>{end_date}</b>\n\n"
-                f"✅ Grazie per essere con noi!"
-            )
-        else:
-            await msg.answer(
-                f"❌ Al momento non hai un abbonamento attivo.\n\n"
-                f"Puoi ottenere l'accesso alla nostra community privata per soli {SUBSCRIPTION_PRICE}€ al mese.\n\n"
-                "Scegli il metodo di pagamento:",
-                reply_markup=payment_method_keyboard()
-            )
-            await Onboarding.payment_method.set()
-    finally:
-        db.close()
+@dp.message_handler(text="💳 Il mio abbonamento", state="*", chat_type=types.ChatType.PRIVATE)
+async def show_my_subscription(msg: types.Message, state: FSMContext, user=None, subscription=None):
+    # user/subscription — из контекста апдейта (user_context.py); нет пользователя — нет и подписки
+    if subscription:
+        start_date = subscription.created_at.strftime('%d.%m.%Y') if subscription.created_at else "—"
+        end_date = subscription.expires_at.strftime('%d.%m.%Y') if subscription.expires_at else "—"
+        order_id = subscription.order_id or "—"
+
+        await msg.answer(
+            f"💳 <b>La tua sottoscrizione è attiva!</b>\n\n"
+            f"📅 Data di attivazione: <b>{start_date}</b>\n"
+            f"🔢 Numero ordine: <b>{order_id}</b>\n"
+            f"⏳ Valida fino al: <b>{end_date}</b>\n\n"
+            f"✅ Grazie per essere con noi!",
+            reply_markup=get_platform_keyboard(subscription)
+        )
+    else:
+        await msg.answer(
+            f"❌ Al momento non hai un abbonamento attivo.\n\n"
+            f"Puoi ottenere l'accesso alla nostra community privata per soli {SUBSCRIPTION_PRICE}€ al mese.\n\n"
+            "Scegli il metodo di pagamento:",
+            reply_markup=payment_method_keyboard()
+        )
+        await Onboarding.payment_method.set()
+
+# 18.1. Админ: история запусков джобов (/jobs [N] [имя_джоба])
+@dp.message_handler(commands=["jobs"], state="*", chat_type=types.ChatType.PRIVATE)
+async def admin_jobs(msg: types.Message, user=None):
+    if not is_admin(user, msg.from_user.id):
+        return
+    args = msg.get_args().split()
+    limit = min(int(args[0]), 50) if args and args[0].isdigit() else 10
+    job_name = next((a for a in args if not a.isdigit()), None)
+    runs = await run_blocking(recent_runs, limit, job_name)
+    await msg.answer(format_runs(runs))
+
+# 18.2. Админ: воронка онбординга (/funnel [дней]) — из предпосчитанной onboarding_funnel
+@dp.message_handler(commands=["funnel"], state="*", chat_type=types.ChatType.PRIVATE)
+async def admin_funnel(msg: types.Message, user=None):
+    if not is_admin(user, msg.from_user.id):
+        return
+    arg = msg.get_args().strip()
+    days = min(int(arg), 90) if arg.isdigit() and int(arg) > 0 else 7
+    totals = await run_blocking(load_funnel, days)
+    await msg.answer(format_funnel(totals, days))
 
 # 19. Обработка любых других сообщений
 @dp.message_handler(state="*")
@@ -593,9 +514,14 @@ async def handle_other_messages(msg: types.Message, state: FSMContext):
     else:
         await msg.answer("Per favore, scegli una delle opzioni proposte usando i pulsanti qui sotto 👇")
 
-# Задачи бота
+# Задачи бота (на каждом процессе)
 async def startup_tasks():
-    asyncio.create_task(manage_group_access_loop())
+    await startup_http_session()
+    await run_blocking(media.load_media_registry)
+    # outbox безопасно разбирать из нескольких процессов (FOR UPDATE SKIP LOCKED)
+    asyncio.create_task(run_outbox_dispatcher())
+
+async def notify_admins_started(mode: str = "polling"):
     # ПИНГ админам
     try:
         admins = []
@@ -605,7 +531,7 @@ async def startup_tasks():
             admins = [x.strip() for x in ADMIN_IDS.split(",") if x.strip().isdigit()]
         for admin_id in admins:
             try:
-                await bot.send_message(int(admin_id), "🤖 Bot started: polling is up")
+                await bot.send_message(int(admin_id), f"🤖 Bot started: {mode} is up")
             except Exception as e:
                 logging.warning(f"Failed to notify admin {admin_id}: {e}")
     except Exception as e:
@@ -617,35 +543,93 @@ if sys.platform.startswith("win"):
     except Exception:
         pass
 
-async def start_bot():
-    await startup_tasks()
+async def handle_update(update: types.Update):
+    """Один апдейт из очереди updates — через middleware и хендлеры dp."""
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    await dp.updates_handler.notify(update)
+
+# Апдейты одного чата — по порядку, разных чатов — параллельно (update_queue.py).
+# Сообщения групп, кроме /app, отбрасываются до очереди — без FSM и фильтров хендлеров
+updates = UpdateQueue(handle_update, drop=is_group_noise)
+
+async def polling_leader_work():
+    """Только на процессе-лидере: polling Telegram и точное истечение подписок (expiry.py)."""
+    expiry_task = asyncio.create_task(run_expiry_engine())
     try:
-        logging.info("Deleting webhook (drop_pending_updates=True)…")
-        await bot.delete_webhook(drop_pending_updates=True)
-        logging.info("Webhook deleted. Starting polling…")
-    except Exception:
-        logging.exception("delete_webhook failed")
+        try:
+            logging.info(f"Deleting webhook (drop_pending_updates={TELEGRAM_DROP_PENDING_UPDATES})…")
+            await bot.delete_webhook(drop_pending_updates=TELEGRAM_DROP_PENDING_UPDATES)
+            logging.info("Webhook deleted. Starting polling…")
+        except Exception:
+            logging.exception("delete_webhook failed")
+
+        await notify_admins_started()
+        await poll_updates(bot, updates, TELEGRAM_ALLOWED_UPDATES)
+    finally:
+        expiry_task.cancel()
+
+async def process_webhook_update(data: dict) -> bool:
+    """Апдейт из webhook.telegram_update (уже в event loop бота). False — очередь полна."""
+    return updates.offer(types.Update(**data))
+
+async def webhook_leader_work():
+    """
+    Webhook-режим, только лидер: регистрирует webhook (очередь апдейтов у Telegram не
+    сбрасываем — всё, что пришло во время деплоя, доставится) и ведёт истечение подписок.
+    Сами апдейты принимает любой процесс (webhook.telegram_update).
+    """
+    url = f"{TELEGRAM_WEBHOOK_BASE}{TELEGRAM_WEBHOOK_PATH}"
+    await bot.set_webhook(
+        url,
+        secret_token=TELEGRAM_WEBHOOK_SECRET,
+        allowed_updates=TELEGRAM_ALLOWED_UPDATES,
+        drop_pending_updates=False,
+    )
+    logging.info(f"Webhook set: {url}")
+    await notify_admins_started("webhook")
+    await run_expiry_engine()
 
+async def start_bot():
+    await startup_tasks()
+    updates.start()
     try:
-        await dp.start_polling()
+        if BOT_MODE == "webhook":
+            if not (TELEGRAM_WEBHOOK_BASE and TELEGRAM_WEBHOOK_SECRET):
+                raise RuntimeError("BOT_MODE=webhook requires TELEGRAM_WEBHOOK_BASE (or PUBLIC_BASE_URL) and TELEGRAM_WEBHOOK_SECRET")
+            set_update_handler(asyncio.get_running_loop(), process_webhook_update)
+            await run_as_leader("bot_webhook", webhook_leader_work)
+        else:
+            await run_as_leader("bot_polling", polling_leader_work)
     except Exception:
-        logging.exception("Polling crashed with exception")
+        logging.exception("Bot crashed with exception")
         raise
     finally:
+        set_update_handler(None, None)
+        await updates.stop()
+        try:
+            # досбрасываем отложенные update_data в fsm_state
+            await dp.storage.close()
+        except Exception:
+            logging.exception("FSM storage flush failed")
+        # досбрасываем буфер событий воронки
+        await onboarding_events.close()
+        # пул blocking не закрываем: он общий со scheduler и Flask (см. blocking.py)
         try:
             await bot.session.close()
         except Exception:
             pass
+        await close_http_session()
     
 def run_bot_polling():
-    logging.info("Launching polling…")
+    logging.info(f"Launching bot ({BOT_MODE})…")
     asyncio.run(start_bot())
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
 
-    if FLASK_ENV == "dev":
-        # Локальный режим — только бот
+    if FLASK_ENV == "dev" and BOT_MODE != "webhook":
+        # Локальный режим — только бот (polling)
         run_bot_polling()
     else:
         # Продакшен — Flask + бот в потоке
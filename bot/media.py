@@ -0,0 +1,149 @@
+# media.py
+"""
+Реестр медиа: логический ключ -> Telegram file_id (таблица media_assets).
+
+- При старте load_media_registry() поднимает всё в память (main.startup_tasks).
+- Значения из env (VIDEO_PENDING_FILE_ID, VIDEO_PRESENTATION_FILE_ID, VIDEO_REVIEWS)
+  используются как запасной вариант для ключей, которых нет в БД.
+- Если file_id нет, но есть локальный файл (local_path или MEDIA_DIR/<key>.mp4),
+  TelegramService.send_video_asset загрузит его один раз и сохранит file_id сюда.
+- version() меняется при каждом изменении реестра — по нему TelegramService.send_video_album
+  понимает, что собранные альбомы (sendMediaGroup) пора пересобрать.
+"""
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+
+from database import SessionLocal, MediaAsset
+from config import VIDEO_PENDING_FILE_ID, VIDEO_PRESENTATION_FILE_ID, VIDEO_REVIEWS
+
+logger = logging.getLogger(__name__)
+
+MEDIA_DIR = os.getenv("MEDIA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "media"))
+
+# Ключи, которые использует бот
+PENDING_VIDEO = "pending"
+PRESENTATION_VIDEO = "presentation"
+REVIEW_PREFIX = "review_"
+
+_file_ids: dict[str, str] = {}
+_local_paths: dict[str, str] = {}
+_loaded = False
+_version = 0
+_lock = threading.Lock()
+
+
+def _env_defaults() -> dict[str, str]:
+    """file_id из переменных окружения. VIDEO_REVIEWS — JSON-объект или список через запятую."""
+    defaults = {}
+    if VIDEO_PENDING_FILE_ID:
+        defaults[PENDING_VIDEO] = VIDEO_PENDING_FILE_ID.strip()
+    if VIDEO_PRESENTATION_FILE_ID:
+        defaults[PRESENTATION_VIDEO] = VIDEO_PRESENTATION_FILE_ID.strip()
+
+    raw = (VIDEO_REVIEWS or "").strip()
+    if raw:
+        try:
+            reviews = json.loads(raw)
+        except ValueError:
+            reviews = None
+        if isinstance(reviews, dict):
+            # ключи как есть: {"review_10": ...} остаётся десятым отзывом
+            for key, file_id in reviews.items():
+                if isinstance(file_id, str) and file_id.strip():
+                    key = str(key)
+                    defaults[key if key.startswith(REVIEW_PREFIX) else f"{REVIEW_PREFIX}{key}"] = file_id.strip()
+            return defaults
+        if isinstance(reviews, str):
+            raw = reviews                      # "id_a,id_b" в кавычках
+        if not isinstance(reviews, list):
+            # не JSON или JSON-скаляр ("abc", 123) — это file_id через запятую
+            reviews = [x for x in raw.split(",") if x.strip()]
+        for i, file_id in enumerate(reviews, 1):
+            if isinstance(file_id, str) and file_id.strip():
+                defaults[f"{REVIEW_PREFIX}{i}"] = file_id.strip()
+    return defaults
+
+
+def load_media_registry():
+    """Загружает media_assets в память (env — только для ключей, которых нет в БД)."""
+    global _loaded, _version
+    file_ids = _env_defaults()
+    local_paths = {}
+    db = SessionLocal()
+    try:
+        for asset in db.query(MediaAsset).all():
+            if asset.file_id:
+                file_ids[asset.key] = asset.file_id
+            if asset.local_path:
+                local_paths[asset.key] = asset.local_path
+    except Exception as e:
+        logger.error(f"Failed to load media registry: {e}")
+    finally:
+        db.close()
+
+    with _lock:
+        _file_ids.clear()
+        _file_ids.update(file_ids)
+        _local_paths.clear()
+        _local_paths.update(local_paths)
+        _loaded = True
+        _version += 1
+    logger.info(f"Media registry loaded: {len(file_ids)} file_id(s)")
+
+
+def _ensure_loaded():
+    if not _loaded:
+        load_media_registry()
+
+
+def get_file_id(key: str) -> str | None:
+    _ensure_loaded()
+    return _file_ids.get(key)
+
+
+def version() -> int:
+    _ensure_loaded()
+    return _version
+
+
+def get_local_path(key: str) -> str | None:
+    """Путь для первой загрузки: из БД или MEDIA_DIR/<key>.mp4, если файл существует."""
+    _ensure_loaded()
+    path = _local_paths.get(key) or os.path.join(MEDIA_DIR, f"{key}.mp4")
+    return path if os.path.isfile(path) else None
+
+
+def media_keys(prefix: str) -> list[str]:
+    """Ключи с префиксом в естественном порядке (review_2 раньше review_10)."""
+    _ensure_loaded()
+    keys = {k for k in list(_file_ids) + list(_local_paths) if k.startswith(prefix)}
+
+    def order(k):
+        tail = k[len(prefix):]
+        return (0, int(tail), "") if tail.isdigit() else (1, 0, tail)
+    return sorted(keys, key=order)
+
+
+def register_file_id(key: str, file_id: str):
+    """Сохраняет file_id после загрузки (БД + память), чтобы больше не грузить байты."""
+    global _version
+    db = SessionLocal()
+    try:
+        asset = db.query(MediaAsset).filter(MediaAsset.key == key).first()
+        if not asset:
+            asset = MediaAsset(key=key)
+            db.add(asset)
+        asset.file_id = file_id
+        asset.updated_at = datetime.utcnow()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to store file_id for media '{key}': {e}")
+    finally:
+        db.close()
+    with _lock:
+        _file_ids[key] = file_id
+        _version += 1
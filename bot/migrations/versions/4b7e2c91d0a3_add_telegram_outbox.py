@@ -0,0 +1,40 @@
+"""add telegram outbox
+
+Revision ID: 4b7e2c91d0a3
+Revises: fddb43b3dcf6
+Create Date: 2026-10-19 09:12:40.118204
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '4b7e2c91d0a3'
+down_revision: Union[str, Sequence[str], None] = 'fddb43b3dcf6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'telegram_outbox',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('chat_id', sa.BigInteger(), nullable=False),
+        sa.Column('method', sa.String(), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_until', sa.DateTime(), nullable=True),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index(op.f('ix_telegram_outbox_chat_id'), 'telegram_outbox', ['chat_id'], unique=False)
+    op.create_index('ix_telegram_outbox_status_next_attempt', 'telegram_outbox', ['status', 'next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_telegram_outbox_status_next_attempt', table_name='telegram_outbox')
+    op.drop_index(op.f('ix_telegram_outbox_chat_id'), table_name='telegram_outbox')
+    op.drop_table('telegram_outbox')
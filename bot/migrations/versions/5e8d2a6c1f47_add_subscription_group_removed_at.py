@@ -0,0 +1,23 @@
+"""add subscription group_removed_at
+
+Revision ID: 5e8d2a6c1f47
+Revises: 9c1f5a7e3b24
+Create Date: 2026-10-19 12:41:05.118304
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '5e8d2a6c1f47'
+down_revision: Union[str, Sequence[str], None] = '9c1f5a7e3b24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('subscriptions', sa.Column('group_removed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('subscriptions', 'group_removed_at')
@@ -0,0 +1,32 @@
+"""add media assets
+
+Revision ID: 9c1f5a7e3b24
+Revises: 4b7e2c91d0a3
+Create Date: 2026-10-19 11:03:17.482911
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '9c1f5a7e3b24'
+down_revision: Union[str, Sequence[str], None] = '4b7e2c91d0a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'media_assets',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('file_id', sa.String(), nullable=True),
+        sa.Column('local_path', sa.String(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index(op.f('ix_media_assets_key'), 'media_assets', ['key'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_media_assets_key'), table_name='media_assets')
+    op.drop_table('media_assets')
@@ -0,0 +1,33 @@
+"""add job state
+
+Revision ID: a3f6c8e1d925
+Revises: 5e8d2a6c1f47
+Create Date: 2026-10-19 13:27:44.603158
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f6c8e1d925'
+down_revision: Union[str, Sequence[str], None] = '5e8d2a6c1f47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'job_state',
+        sa.Column('name', sa.String(), primary_key=True),
+        sa.Column('last_started_at', sa.DateTime(), nullable=True),
+        sa.Column('last_finished_at', sa.DateTime(), nullable=True),
+        sa.Column('last_status', sa.String(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('last_duration', sa.Float(), nullable=True),
+        sa.Column('last_result', sa.JSON(), nullable=True),
+        sa.Column('locked_until', sa.DateTime(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('job_state')
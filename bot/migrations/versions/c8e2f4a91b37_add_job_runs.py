@@ -0,0 +1,41 @@
+"""add job runs
+
+Revision ID: c8e2f4a91b37
+Revises: a3f6c8e1d925
+Create Date: 2026-10-19 15:02:11.482906
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8e2f4a91b37'
+down_revision: Union[str, Sequence[str], None] = 'a3f6c8e1d925'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'job_runs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('job_name', sa.String(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('duration', sa.Float(), nullable=True),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('candidates', sa.Integer(), nullable=True),
+        sa.Column('ok', sa.Integer(), nullable=True),
+        sa.Column('failed', sa.Integer(), nullable=True),
+        sa.Column('api_calls', sa.Integer(), nullable=False),
+        sa.Column('p95_ms', sa.Float(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+    )
+    op.create_index(op.f('ix_job_runs_started_at'), 'job_runs', ['started_at'], unique=False)
+    op.create_index('ix_job_runs_job_name_started_at', 'job_runs', ['job_name', 'started_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_job_runs_job_name_started_at', table_name='job_runs')
+    op.drop_index(op.f('ix_job_runs_started_at'), table_name='job_runs')
+    op.drop_table('job_runs')
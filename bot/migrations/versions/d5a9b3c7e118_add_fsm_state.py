@@ -0,0 +1,32 @@
+"""add fsm state
+
+Revision ID: d5a9b3c7e118
+Revises: c8e2f4a91b37
+Create Date: 2026-10-19 16:40:27.905318
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a9b3c7e118'
+down_revision: Union[str, Sequence[str], None] = 'c8e2f4a91b37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'fsm_state',
+        sa.Column('chat_id', sa.BigInteger(), primary_key=True),
+        sa.Column('user_id', sa.BigInteger(), primary_key=True),
+        sa.Column('state', sa.String(), nullable=True),
+        sa.Column('data', sa.JSON(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index(op.f('ix_fsm_state_updated_at'), 'fsm_state', ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_fsm_state_updated_at'), table_name='fsm_state')
+    op.drop_table('fsm_state')
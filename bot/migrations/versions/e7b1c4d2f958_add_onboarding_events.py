@@ -0,0 +1,44 @@
+"""add onboarding events and funnel
+
+Revision ID: e7b1c4d2f958
+Revises: d5a9b3c7e118
+Create Date: 2026-10-19 18:05:12.441907
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7b1c4d2f958'
+down_revision: Union[str, Sequence[str], None] = 'd5a9b3c7e118'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'onboarding_events',
+        sa.Column('id', sa.BigInteger(), primary_key=True),
+        sa.Column('telegram_id', sa.BigInteger(), nullable=False),
+        sa.Column('step', sa.String(), nullable=False),
+        sa.Column('value', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index(op.f('ix_onboarding_events_telegram_id'), 'onboarding_events', ['telegram_id'], unique=False)
+    op.create_index('ix_onboarding_events_step_created_at', 'onboarding_events', ['step', 'created_at'], unique=False)
+
+    op.create_table(
+        'onboarding_funnel',
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('step', sa.String(), primary_key=True),
+        sa.Column('users', sa.Integer(), nullable=False),
+        sa.Column('events', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('onboarding_funnel')
+    op.drop_index('ix_onboarding_events_step_created_at', table_name='onboarding_events')
+    op.drop_index(op.f('ix_onboarding_events_telegram_id'), table_name='onboarding_events')
+    op.drop_table('onboarding_events')
@@ -0,0 +1,199 @@
+# onboarding_events.py
+"""
+Воронка онбординга: start → format → level → time → goal → promo → final →
+payment_method → payment_link.
+
+- track(telegram_id, step, value) из хендлера — только добавление в буфер в памяти,
+  ни одного обращения к БД на пути апдейта.
+- Буфер сбрасывается в onboarding_events одним многострочным INSERT (executemany
+  SQLAlchemy 2 собирает пачку в INSERT ... VALUES (...), (...)) каждые
+  ONBOARDING_FLUSH_SECONDS секунд или сразу, как набралось ONBOARDING_FLUSH_EVENTS.
+  БД недоступна — события остаются в буфере (не больше ONBOARDING_BUFFER_MAX, старые
+  выбрасываются). close() досбрасывает остаток при остановке бота.
+- refresh_funnel() (джоб onboarding_funnel в scheduler.py) пересчитывает onboarding_funnel
+  за последние дни: по дню и шагу — разные пользователи и число событий. /funnel у админа
+  читает только эту таблицу.
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta, time as dt_time
+
+from sqlalchemy import select, insert, func, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from database import SessionLocal, OnboardingEvent, OnboardingFunnel
+from blocking import run_blocking
+
+logger = logging.getLogger(__name__)
+
+ONBOARDING_FLUSH_EVENTS = int(os.getenv("ONBOARDING_FLUSH_EVENTS", "200"))
+ONBOARDING_FLUSH_SECONDS = float(os.getenv("ONBOARDING_FLUSH_SECONDS", "5"))
+ONBOARDING_BUFFER_MAX = int(os.getenv("ONBOARDING_BUFFER_MAX", "10000"))
+FUNNEL_REFRESH_DAYS = int(os.getenv("FUNNEL_REFRESH_DAYS", "2"))   # события старше уже посчитаны
+
+FUNNEL_STEPS = ("start", "format", "level", "time", "goal", "promo", "final", "payment_method", "payment_link")
+
+
+# =========================
+# Доступ к БД (блокирующие)
+# =========================
+def insert_events(rows: list[dict]):
+    db = SessionLocal()
+    try:
+        db.execute(insert(OnboardingEvent), rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def refresh_funnel(days: int = FUNNEL_REFRESH_DAYS) -> int:
+    """Пересчитывает onboarding_funnel за последние days дней (включая сегодня). Возвращает число строк."""
+    now = datetime.utcnow()
+    since = datetime.combine((now - timedelta(days=days - 1)).date(), dt_time.min)
+    day = func.date(OnboardingEvent.created_at)
+    rows = select(
+        day, OnboardingEvent.step,
+        func.count(func.distinct(OnboardingEvent.telegram_id)), func.count(), literal(now),
+    ).where(OnboardingEvent.created_at >= since).group_by(day, OnboardingEvent.step)
+
+    stmt = pg_insert(OnboardingFunnel).from_select(["day", "step", "users", "events", "updated_at"], rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["day", "step"],
+        set_={"users": stmt.excluded.users, "events": stmt.excluded.events, "updated_at": stmt.excluded.updated_at},
+    )
+    db = SessionLocal()
+    try:
+        result = db.execute(stmt)
+        db.commit()
+        return result.rowcount
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def load_funnel(days: int = 7) -> dict[str, tuple[int, int]]:
+    """step -> (пользователи, события) за последние days дней, из предпосчитанной таблицы."""
+    since = (datetime.utcnow() - timedelta(days=days - 1)).date()
+    db = SessionLocal()
+    try:
+        rows = db.query(
+            OnboardingFunnel.step, func.sum(OnboardingFunnel.users), func.sum(OnboardingFunnel.events)
+        ).filter(OnboardingFunnel.day >= since).group_by(OnboardingFunnel.step).all()
+    finally:
+        db.close()
+    return {step: (int(users or 0), int(events or 0)) for step, users, events in rows}
+
+
+def format_funnel(totals: dict[str, tuple[int, int]], days: int) -> str:
+    """
+    Текст для /funnel: пользователи на шаге, % от start и % от предыдущего шага.
+    Пользователи — сумма уникальных за каждый день (кто шёл два дня, посчитан дважды).
+    """
+    if not totals:
+        return f"Воронка за {days} дн.: событий пока нет"
+    lines = [f"<b>Воронка онбординга за {days} дн.</b>"]
+    first = totals.get(FUNNEL_STEPS[0], (0, 0))[0]
+    prev = None
+    for step in FUNNEL_STEPS:
+        users = totals.get(step, (0, 0))[0]
+        line = f"{step}: {users}"
+        if first:
+            line += f" ({users * 100 / first:.0f}%"
+            line += f", шаг {users * 100 / prev:.0f}%)" if prev else ")"
+        lines.append(line)
+        prev = users
+    return "\n".join(lines)
+
+
+# =========================
+# Буфер
+# =========================
+class EventBuffer:
+    def __init__(self, flush_events: int = ONBOARDING_FLUSH_EVENTS, flush_seconds: float = ONBOARDING_FLUSH_SECONDS,
+                 max_size: int = ONBOARDING_BUFFER_MAX):
+        self.flush_events = flush_events
+        self.flush_seconds = flush_seconds
+        self.max_size = max_size
+        self._rows: list[dict] = []
+        # Примитивы asyncio создаём в том loop, где буфер реально используется
+        self._loop = None
+        self._wake = None
+        self._lock = None
+        self._flusher = None
+        self._stats = {"tracked": 0, "written": 0, "dropped": 0, "flushes": 0, "failed_flushes": 0}
+
+    def _ensure_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._wake = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._flusher = None
+
+    def _trim(self):
+        overflow = len(self._rows) - self.max_size
+        if overflow > 0:
+            del self._rows[:overflow]
+            self._stats["dropped"] += overflow
+
+    def track(self, telegram_id: int, step: str, value=None):
+        """Только в память (вызывать из event loop); в БД уйдёт со следующим сбросом."""
+        self._ensure_loop()
+        self._rows.append({
+            "telegram_id": telegram_id,
+            "step": step,
+            "value": str(value)[:64] if value is not None else None,
+            "created_at": datetime.utcnow(),
+        })
+        self._stats["tracked"] += 1
+        self._trim()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+        if len(self._rows) >= self.flush_events:
+            self._wake.set()
+
+    async def _flush_loop(self):
+        while self._rows:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            # не получилось — события остались в буфере, повтор через flush_seconds
+            await self.flush()
+
+    async def flush(self):
+        self._ensure_loop()
+        async with self._lock:
+            rows, self._rows = self._rows, []
+            if not rows:
+                return
+            try:
+                await run_blocking(insert_events, rows, timeout=None)
+                self._stats["written"] += len(rows)
+                self._stats["flushes"] += 1
+            except Exception as e:
+                # не потеряли: вернутся в начало буфера и уйдут со следующим сбросом
+                self._rows[:0] = rows
+                self._trim()
+                self._stats["failed_flushes"] += 1
+                logger.error(f"[onboarding_events] flush of {len(rows)} events failed: {e}")
+
+    async def close(self):
+        if self._loop is asyncio.get_running_loop():
+            await self.flush()
+            if self._flusher and not self._flusher.done():
+                self._flusher.cancel()
+
+    def stats(self) -> dict:
+        return dict(self._stats, buffered=len(self._rows))
+
+
+events = EventBuffer()
+track = events.track
@@ -0,0 +1,174 @@
+# outbox.py
+"""
+Диспетчер telegram_outbox.
+
+Продюсеры (tasks.py и др.) пишут строки через database.enqueue_telegram в той же транзакции,
+что и своё изменение состояния. Здесь мы забираем их пачками (FOR UPDATE SKIP LOCKED —
+можно запускать несколько диспетчеров), отправляем через send_engine (строки одного чата —
+по очереди в порядке id, разных чатов — параллельно) и отмечаем результат:
+  - успех            -> status='sent' (UPDATE ... WHERE status='sending' — отметка ровно один раз);
+  - временная ошибка -> status='pending', next_attempt_at = now + экспоненциальный backoff;
+  - 400/403 или исчерпаны попытки -> status='dead'.
+Строки, «зависшие» в 'sending' после падения процесса, забираются снова по истечении аренды.
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, or_, and_
+
+from database import SessionLocal, TelegramOutbox
+from blocking import run_blocking
+from telegram_service import TelegramService
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "5"))      # секунды: 5, 10, 20, 40...
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "3600"))
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "120"))    # аренда строки на время отправки
+
+# Ошибки, которые повтором не исправить (чат не найден, бот заблокирован и т.п.)
+_PERMANENT_STATUSES = {400, 403}
+
+
+def backoff_seconds(attempts: int) -> float:
+    return min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+
+
+def claim_batch(limit: int = OUTBOX_BATCH_SIZE) -> list[dict]:
+    """Забирает пачку готовых к отправке строк и переводит их в 'sending' с арендой."""
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        due = (
+            select(TelegramOutbox.id)
+            .where(or_(
+                and_(TelegramOutbox.status == "pending", TelegramOutbox.next_attempt_at <= now),
+                and_(TelegramOutbox.status == "sending", TelegramOutbox.locked_until < now),
+            ))
+            .order_by(TelegramOutbox.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        rows = db.execute(
+            update(TelegramOutbox)
+            .where(TelegramOutbox.id.in_(due.scalar_subquery()))
+            .values(
+                status="sending",
+                locked_until=now + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+                attempts=TelegramOutbox.attempts + 1,
+            )
+            .returning(TelegramOutbox.id, TelegramOutbox.method, TelegramOutbox.payload, TelegramOutbox.attempts)
+        ).all()
+        db.commit()
+        return [dict(r._mapping) for r in rows]
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def mark_results(sent_ids: list[int], failures: list[tuple[int, int, str, bool]]):
+    """
+    sent_ids — успешно отправленные; failures — (id, attempts, error, permanent).
+    Все отметки — одной транзакцией и только для строк, которые всё ещё 'sending'.
+    """
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        if sent_ids:
+            db.execute(
+                update(TelegramOutbox)
+                .where(TelegramOutbox.id.in_(sent_ids), TelegramOutbox.status == "sending")
+                .values(status="sent", sent_at=now, locked_until=None, last_error=None)
+            )
+        for row_id, attempts, error, permanent in failures:
+            dead = permanent or attempts >= OUTBOX_MAX_ATTEMPTS
+            db.execute(
+                update(TelegramOutbox)
+                .where(TelegramOutbox.id == row_id, TelegramOutbox.status == "sending")
+                .values(
+                    status="dead" if dead else "pending",
+                    next_attempt_at=now + timedelta(seconds=backoff_seconds(attempts)),
+                    locked_until=None,
+                    last_error=(error or "")[:1000],
+                )
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def _send_row(ts: TelegramService, row: dict):
+    """Возвращает (ok, error, permanent)."""
+    status, data = await ts.send_with_status(row["method"], row["payload"])
+    if status == 200:
+        return True, None, False
+    description = data.get("description") if isinstance(data, dict) else None
+    return False, f"{status}: {description or 'send failed'}", status in _PERMANENT_STATUSES
+
+
+async def _send_chat(ts: TelegramService, rows: list[dict]) -> list:
+    """Строки одного чата — по очереди: сообщения приходят в том порядке, в каком их записали."""
+    return [await _send_row(ts, row) for row in rows]
+
+
+async def drain_once(limit: int = OUTBOX_BATCH_SIZE) -> int:
+    """
+    Одна пачка: claim -> отправка (под send_engine) -> отметки. Возвращает размер пачки.
+    Разные чаты отправляются параллельно, строки одного чата — последовательно в порядке id.
+    """
+    rows = await run_blocking(claim_batch, limit, timeout=None)
+    if not rows:
+        return 0
+
+    chats: dict = {}
+    for row in sorted(rows, key=lambda r: r["id"]):
+        chats.setdefault(row["payload"].get("chat_id"), []).append(row)
+    ts = TelegramService()
+    per_chat = await asyncio.gather(*(_send_chat(ts, chat_rows) for chat_rows in chats.values()))
+
+    sent_ids, failures = [], []
+    ordered = [row for chat_rows in chats.values() for row in chat_rows]
+    results = [result for chat_results in per_chat for result in chat_results]
+    for row, (ok, error, permanent) in zip(ordered, results):
+        if ok:
+            sent_ids.append(row["id"])
+        else:
+            failures.append((row["id"], row["attempts"], error, permanent))
+            logger.warning(f"[outbox] #{row['id']} {row['method']} failed (attempt {row['attempts']}): {error}")
+
+    await run_blocking(mark_results, sent_ids, failures, timeout=None)
+    return len(rows)
+
+
+async def drain_outbox(max_batches: int = 1000) -> int:
+    """Отправляет всё, что готово сейчас (для разовых запусков cron). Возвращает число обработанных строк."""
+    total = 0
+    for _ in range(max_batches):
+        n = await drain_once()
+        total += n
+        if n < OUTBOX_BATCH_SIZE:
+            break
+    return total
+
+
+async def run_outbox_dispatcher(poll_seconds: float = OUTBOX_POLL_SECONDS):
+    """Бесконечный цикл диспетчера (запускается в event loop бота)."""
+    logger.info("Outbox dispatcher started")
+    while True:
+        try:
+            n = await drain_once()
+        except Exception as e:
+            logger.error(f"Error in outbox dispatcher: {e}", exc_info=True)
+            n = 0
+        if n < OUTBOX_BATCH_SIZE:
+            await asyncio.sleep(poll_seconds)
@@ -0,0 +1,161 @@
+# pay_links.py
+"""
+Ленивые ссылки оплаты.
+
+В сообщениях cron вместо готовых Stripe Checkout / PayPal approval ссылок уходит дешёвая
+подписанная ссылка PUBLIC_BASE_URL/pay/<token> (token = user_id + провайдер, itsdangerous).
+Сессию у провайдера и pending-подписку создаём только когда пользователь реально открыл
+ссылку (webhook.py: /pay/<token>) — большинство ссылок так и не открывают.
+
+Повторные нажатия (кнопка в боте, /pay/<token> из нескольких сообщений) в течение
+PAY_LINK_REUSE_MINUTES отдают уже созданную ссылку того же провайдера: одна сессия и одна
+pending-подписка вместо пачки. Кэш в памяти процесса; после активации подписки —
+forget_payment(user_id). Дедупликация работает только в пределах одного процесса (Procfile:
+gunicorn -w 1): при нескольких воркерах каждый создаст свою сессию.
+"""
+import time
+import logging
+import threading
+
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+from payment_config import (
+    PUBLIC_BASE_URL, PAY_LINK_SECRET, PAY_LINK_MAX_AGE_DAYS, PAY_LINK_REUSE_MINUTES, SUBSCRIPTION_PRICE,
+)
+from payment_service import StripeService, PayPalService
+from database import SessionLocal, create_subscription
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = {"stripe": "s", "paypal": "p"}
+_PROVIDER_BY_CODE = {code: name for name, code in PROVIDERS.items()}
+
+_serializer = URLSafeTimedSerializer(PAY_LINK_SECRET, salt="pay-link")
+
+# (user_id, provider) -> (monotonic время создания, url). open_payment зовут и из потоков
+# run_blocking, и из Flask — поэтому threading. Пока ссылка для ключа создаётся, в _pending
+# лежит его Event: повторные нажатия того же пользователя ждут его, а не создают вторую
+# сессию; другие ключи не ждут ничего, кроме короткого _recent_lock.
+_recent: dict[tuple[int, str], tuple[float, str]] = {}
+_pending: dict[tuple[int, str], threading.Event] = {}
+_recent_lock = threading.Lock()
+
+
+class PayLinkError(Exception):
+    """Ссылка подделана, устарела или указывает на неизвестного провайдера."""
+    def __init__(self, message: str, expired: bool = False):
+        super().__init__(message)
+        self.expired = expired
+
+
+def lazy_links_enabled() -> bool:
+    return bool(PUBLIC_BASE_URL)
+
+
+def make_pay_token(user_id: int, provider: str) -> str:
+    return _serializer.dumps({"u": int(user_id), "p": PROVIDERS[provider]})
+
+
+def make_pay_link(user_id: int, provider: str) -> str | None:
+    """Ссылка /pay/<token>; None, если PUBLIC_BASE_URL не задан."""
+    if not PUBLIC_BASE_URL:
+        return None
+    return f"{PUBLIC_BASE_URL}/pay/{make_pay_token(user_id, provider)}"
+
+
+def load_pay_token(token: str, max_age_days: int | None = None) -> tuple[int, str]:
+    """token -> (user_id, provider). PayLinkError, если подпись неверна или ссылка устарела."""
+    if max_age_days is None:
+        max_age_days = PAY_LINK_MAX_AGE_DAYS
+    try:
+        data = _serializer.loads(token, max_age=max_age_days * 86400)
+    except SignatureExpired:
+        raise PayLinkError("pay link expired", expired=True)
+    except BadSignature:
+        raise PayLinkError("bad pay link signature")
+    provider = _PROVIDER_BY_CODE.get(data.get("p")) if isinstance(data, dict) else None
+    if not provider or not isinstance(data.get("u"), int):
+        raise PayLinkError("malformed pay link")
+    return data["u"], provider
+
+
+def _remember_url(key: tuple[int, str], url: str, max_age: float):
+    now = time.monotonic()
+    with _recent_lock:
+        for k in [k for k, (created, _) in _recent.items() if now - created >= max_age]:
+            del _recent[k]
+        _recent[key] = (now, url)
+
+
+def forget_payment(user_id: int):
+    """Подписка оплачена — следующая оплата (продление) должна получить новую сессию."""
+    with _recent_lock:
+        for provider in PROVIDERS:
+            _recent.pop((user_id, provider), None)
+
+
+def open_payment(user_id: int, provider: str, reuse_minutes: int | None = None) -> dict:
+    """
+    Создаёт сессию у провайдера и pending-подписку (как при выборе оплаты в боте).
+    Ссылка, созданная для того же пользователя и провайдера за последние reuse_minutes
+    (PAY_LINK_REUSE_MINUTES), переиспользуется.
+    Возвращает {"success": True, "url": ...} или {"success": False, "error": ...}.
+    """
+    if reuse_minutes is None:
+        reuse_minutes = PAY_LINK_REUSE_MINUTES
+    if reuse_minutes <= 0:
+        return _create_payment(user_id, provider)
+
+    key, max_age = (user_id, provider), reuse_minutes * 60
+    while True:
+        with _recent_lock:
+            entry = _recent.get(key)
+            if entry and time.monotonic() - entry[0] < max_age:
+                logger.info(f"Pay link reused: user_id={user_id}, provider={provider}")
+                return {"success": True, "url": entry[1], "reused": True}
+            creating = _pending.get(key)
+            if creating is None:
+                creating = _pending[key] = threading.Event()
+                break
+        # ссылку для этого ключа уже создают — ждём; не вышло у них — попробуем сами
+        creating.wait()
+
+    try:
+        result = _create_payment(user_id, provider)
+        if result.get("success"):
+            _remember_url(key, result["url"], max_age)
+        return result
+    finally:
+        with _recent_lock:
+            _pending.pop(key, None)
+        creating.set()
+
+
+def _create_payment(user_id: int, provider: str) -> dict:
+    if provider == "stripe":
+        result = StripeService.create_subscription_session(user_id)
+        order_id, url = result.get("session_id"), result.get("url")
+    else:
+        result = PayPalService.create_subscription(user_id)
+        order_id, url = result.get("subscription_id"), result.get("approval_url")
+    if not result.get("success"):
+        return {"success": False, "error": result.get("error", "unknown")}
+
+    db = SessionLocal()
+    try:
+        sub = create_subscription(
+            db,
+            user_id=user_id,
+            payment_system=provider,
+            subscription_id=order_id,
+            order_id=order_id,
+            amount=SUBSCRIPTION_PRICE,
+            customer_id=result.get("customer_id"),
+        )
+    finally:
+        db.close()
+    if not sub:
+        return {"success": False, "error": "user not found"}
+
+    logger.info(f"Pay link opened: user_id={user_id}, provider={provider}, order_id={order_id}")
+    return {"success": True, "url": url}
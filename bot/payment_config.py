@@ -58,3 +58,15 @@ STRIPE_PRICE_ID = os.getenv("STRIPE_PRICE_ID")  # может быть None
 # ---------------------------
 SUBSCRIPTION_PRICE = _float("SUBSCRIPTION_PRICE", 10.00)
 CLOSED_GROUP_LINK  = _must("CLOSED_GROUP_LINK")
+
+# ---------------------------
+# Подписанные ссылки оплаты (/pay/<token>, см. pay_links.py)
+# ---------------------------
+# Публичный адрес этого Flask-приложения. Не задан — cron создаёт сессии оплаты сразу, как раньше.
+PUBLIC_BASE_URL = (os.getenv("PUBLIC_BASE_URL") or "").rstrip("/")
+PAY_LINK_SECRET = os.getenv("PAY_LINK_SECRET") or os.getenv("JWT_SECRET", "devsecret")
+PAY_LINK_MAX_AGE_DAYS = int(os.getenv("PAY_LINK_MAX_AGE_DAYS", "14"))
+# Повторный выбор того же способа оплаты в течение N минут отдаёт уже созданную ссылку
+# (без новой сессии у провайдера и новой pending-подписки). 0 — выключено.
+# Кэш в памяти процесса: с несколькими воркерами gunicorn каждый дедуплицирует только свои нажатия.
+PAY_LINK_REUSE_MINUTES = int(os.getenv("PAY_LINK_REUSE_MINUTES", "10"))
@@ -0,0 +1,316 @@
+# scheduler.py
+"""
+Внутренний планировщик фоновых джобов (вместо цикла в server.py).
+
+- У каждого джоба своё расписание: интервал ("15m", "1h", "1d", "90s") или cron-выражение
+  из 5 полей ("0 9 * * *", время — UTC). Переопределяется env: JOB_SCHEDULE_<NAME>.
+- jitter — случайная добавка к каждому запуску, чтобы джобы не стартовали секунда в секунду.
+- max_runtime — джоб отменяется по таймауту.
+- Перекрытия нет: пока джоб идёт, следующий запуск пропускается; между процессами —
+  аренда job_state.locked_until.
+- Время последнего запуска хранится в job_state: после рестарта пропущенный запуск
+  выполняется сразу (один раз), а не ждёт полный интервал.
+Все джобы работают в одном долгоживущем event loop (run_scheduler).
+"""
+import os
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import update, or_
+from sqlalchemy.dialects.postgresql import insert
+
+from config import GROUP_ID
+from database import SessionLocal, JobState
+from blocking import run_blocking
+
+logger = logging.getLogger(__name__)
+
+CRON_ENABLED = os.getenv("CRON_ENABLED", "true").lower() in ("1", "true", "yes")
+SCHEDULER_MAX_SLEEP = float(os.getenv("SCHEDULER_MAX_SLEEP", "60"))   # как часто перепроверять расписание, секунды
+GROUP_RECONCILE_REMOVE = os.getenv("GROUP_RECONCILE_REMOVE", "0") == "1"
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+# =========================
+# Расписания
+# =========================
+def _parse_cron_field(field: str, lo: int, hi: int) -> set[int]:
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+            if step < 1:
+                raise ValueError(f"bad cron step: {field}")
+        if part == "*":
+            start, end = lo, hi
+        elif "-" in part:
+            a, b = part.split("-", 1)
+            start, end = int(a), int(b)
+        else:
+            start = int(part)
+            end = hi if step > 1 else start
+        if start < lo or end > hi or start > end:
+            raise ValueError(f"cron field out of range: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """Cron из 5 полей: минута, час, день месяца, месяц, день недели (0/7 — воскресенье)."""
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression must have 5 fields: {expr!r}")
+        self.expr = expr
+        self.minutes = _parse_cron_field(fields[0], 0, 59)
+        self.hours = _parse_cron_field(fields[1], 0, 23)
+        self.days = _parse_cron_field(fields[2], 1, 31)
+        self.months = _parse_cron_field(fields[3], 1, 12)
+        self.weekdays = {d % 7 for d in _parse_cron_field(fields[4], 0, 7)}
+        # Как в cron: если заданы и день месяца, и день недели — достаточно любого
+        self._any_day = fields[2] != "*" and fields[4] != "*"
+
+    def _day_matches(self, t: datetime) -> bool:
+        dom = t.day in self.days
+        dow = (t.weekday() + 1) % 7 in self.weekdays
+        return (dom or dow) if self._any_day else (dom and dow)
+
+    def next_after(self, after: datetime) -> datetime:
+        t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = after + timedelta(days=366 * 5)
+        while t <= limit:
+            if t.month not in self.months or not self._day_matches(t):
+                t = (t + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if t.hour not in self.hours:
+                t = (t + timedelta(hours=1)).replace(minute=0)
+                continue
+            if t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+                continue
+            return t
+        raise ValueError(f"cron expression never fires: {self.expr!r}")
+
+
+def parse_schedule(value: str):
+    """'15m' / '1h' / '2d' / '90s' -> timedelta, иначе cron-выражение -> CronSchedule."""
+    value = value.strip()
+    if value[:-1].isdigit() and value[-1:].lower() in _UNITS:
+        return timedelta(seconds=int(value[:-1]) * _UNITS[value[-1].lower()])
+    return CronSchedule(value)
+
+
+class Job:
+    def __init__(self, name: str, func, schedule: str, jitter: float = 0, max_runtime: float = 3600):
+        """func — корутина-функция без аргументов; её результат (dict) сохраняется в job_state."""
+        self.name = name
+        self.func = func
+        self.schedule = parse_schedule(os.getenv(f"JOB_SCHEDULE_{name.upper()}", schedule))
+        self.jitter = jitter
+        self.max_runtime = max_runtime
+
+    def next_run(self, after: datetime) -> datetime:
+        if isinstance(self.schedule, timedelta):
+            base = after + self.schedule
+        else:
+            base = self.schedule.next_after(after)
+        return base + timedelta(seconds=random.uniform(0, self.jitter)) if self.jitter else base
+
+    def first_run(self, last_started_at: datetime | None, now: datetime) -> datetime:
+        """
+        Первый запуск после старта процесса. Если по расписанию запуск уже был должен
+        (пропустили, пока лежали) — сразу; интервальный джоб без истории — тоже сразу.
+        """
+        if last_started_at is None:
+            return now if isinstance(self.schedule, timedelta) else self.next_run(now)
+        due = self.next_run(last_started_at)
+        return now if due <= now else due
+
+
+# =========================
+# Состояние в Postgres
+# =========================
+def load_job_states() -> dict[str, datetime | None]:
+    db = SessionLocal()
+    try:
+        return {name: started for name, started in db.query(JobState.name, JobState.last_started_at).all()}
+    finally:
+        db.close()
+
+
+def claim_job(name: str, max_runtime: float) -> bool:
+    """Берёт аренду на джоб. False — он уже выполняется (в этом или другом процессе)."""
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        db.execute(insert(JobState).values(name=name).on_conflict_do_nothing(index_elements=["name"]))
+        claimed = db.execute(
+            update(JobState)
+            .where(JobState.name == name, or_(JobState.locked_until == None, JobState.locked_until < now))
+            .values(locked_until=now + timedelta(seconds=max_runtime + 60), last_started_at=now)
+            .returning(JobState.name)
+        ).first()
+        db.commit()
+        return claimed is not None
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def finish_job(name: str, status: str, duration: float, result=None, error: str | None = None):
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(JobState).where(JobState.name == name).values(
+                last_finished_at=datetime.utcnow(),
+                last_status=status,
+                last_duration=round(duration, 3),
+                last_result=result if isinstance(result, dict) else None,
+                last_error=(error or "")[:2000] or None,
+                locked_until=None,
+            )
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+# =========================
+# Планировщик
+# =========================
+class Scheduler:
+    def __init__(self, jobs: list[Job], on_failure=None):
+        """on_failure(job_name, status, error) — корутина-уведомление (например, админу)."""
+        self.jobs = {job.name: job for job in jobs}
+        self.on_failure = on_failure
+        self.next_runs: dict[str, datetime] = {}
+        self._running: dict[str, asyncio.Task] = {}
+        self._stopped = asyncio.Event()
+
+    async def run_job(self, job: Job) -> str:
+        """Один запуск: аренда -> выполнение с таймаутом -> запись результата. Возвращает статус."""
+        if not await run_blocking(claim_job, job.name, job.max_runtime, timeout=None):
+            logger.info(f"[scheduler] {job.name} is already running elsewhere, skipping")
+            return "skipped"
+
+        started = asyncio.get_running_loop().time()
+        status, result, error = "ok", None, None
+        try:
+            result = await asyncio.wait_for(job.func(), timeout=job.max_runtime)
+        except asyncio.TimeoutError:
+            status, error = "timeout", f"exceeded max_runtime={job.max_runtime}s"
+        except Exception as e:
+            status, error = "failed", f"{type(e).__name__}: {e}"
+            logger.exception(f"[scheduler] {job.name} failed")
+        duration = asyncio.get_running_loop().time() - started
+
+        logger.info(f"[scheduler] {job.name} finished: {status} in {duration:.1f}s {result or ''}")
+        try:
+            await run_blocking(finish_job, job.name, status, duration, result, error, timeout=None)
+        except Exception as e:
+            logger.error(f"[scheduler] failed to store state for {job.name}: {e}")
+
+        if status != "ok" and self.on_failure:
+            try:
+                await self.on_failure(job.name, status, error)
+            except Exception as e:
+                logger.error(f"[scheduler] failure notification error: {e}")
+        return status
+
+    def _start(self, job: Job, now: datetime):
+        running = self._running.get(job.name)
+        if running and not running.done():
+            logger.warning(f"[scheduler] {job.name} is still running, skipping this run")
+        else:
+            self._running[job.name] = asyncio.create_task(self.run_job(job))
+        self.next_runs[job.name] = job.next_run(now)
+
+    async def run(self):
+        try:
+            states = await run_blocking(load_job_states)
+        except Exception as e:
+            logger.error(f"[scheduler] failed to load job_state, starting from scratch: {e}")
+            states = {}
+
+        now = datetime.utcnow()
+        for job in self.jobs.values():
+            self.next_runs[job.name] = job.first_run(states.get(job.name), now)
+            logger.info(f"[scheduler] {job.name}: next run at {self.next_runs[job.name]:%Y-%m-%d %H:%M:%S} UTC")
+
+        while not self._stopped.is_set():
+            now = datetime.utcnow()
+            for name, when in list(self.next_runs.items()):
+                if when <= now:
+                    self._start(self.jobs[name], now)
+
+            sleep_for = min((when - datetime.utcnow()).total_seconds() for when in self.next_runs.values())
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=min(max(sleep_for, 0.05), SCHEDULER_MAX_SLEEP))
+            except asyncio.TimeoutError:
+                pass
+
+        for task in self._running.values():
+            task.cancel()
+
+    def stop(self):
+        self._stopped.set()
+
+
+# =========================
+# Джобы бота
+# =========================
+def default_jobs() -> list[Job]:
+    """Расписания по умолчанию: каждый джоб — так часто, как ему нужно."""
+    import tasks
+    import group_access
+    import fsm_storage
+    import onboarding_events
+
+    jobs = [
+        # pending пинаем не чаще PENDING_COOLDOWN_HOURS на пользователя — раз в час достаточно
+        Job("nudge_pending", tasks.nudge_pending_subscriptions, "1h", jitter=120, max_runtime=1800),
+        # предупреждение об окончании — раз в день утром (UTC)
+        Job("warn_expiring", tasks.warn_expiring_subscriptions, "0 9 * * *", jitter=300, max_runtime=1800),
+        # истекает вовремя expiry.py; полный проход — только страховка (и догоняет удаление из группы)
+        Job("deactivate_expired", tasks.deactivate_expired_subscriptions, "6h", jitter=300, max_runtime=900),
+    ]
+    # брошенные онбординги (fsm_state) — раз в сутки
+    async def fsm_cleanup():
+        return {"deleted": await run_blocking(fsm_storage.cleanup_fsm_states, timeout=None)}
+    jobs.append(Job("fsm_cleanup", fsm_cleanup, "0 4 * * *", jitter=600, max_runtime=600))
+    # воронка онбординга для /funnel — пересчёт последних дней из onboarding_events
+    async def onboarding_funnel():
+        return {"rows": await run_blocking(onboarding_events.refresh_funnel, timeout=None)}
+    jobs.append(Job("onboarding_funnel", onboarding_funnel, "15m", jitter=60, max_runtime=300))
+
+    if GROUP_ID:
+        async def reconcile():
+            report = await group_access.reconcile_group(GROUP_ID, remove=GROUP_RECONCILE_REMOVE)
+            return {k: len(v) if isinstance(v, list) else v for k, v in report.items()}
+        jobs.append(Job("group_reconcile", reconcile, "30 3 * * *", jitter=600, max_runtime=3600))
+    return jobs
+
+
+async def _notify_admin(job_name: str, status: str, error: str | None):
+    from tasks import ADMIN_FALLBACK_ID
+    from telegram_service import TelegramService
+
+    if ADMIN_FALLBACK_ID:
+        await TelegramService().send_message(ADMIN_FALLBACK_ID, f"⚠️ Job {job_name}: {status}\n{error or ''}")
+
+
+async def run_scheduler(jobs: list[Job] | None = None):
+    """Точка входа: один event loop на все джобы (см. server.py)."""
+    scheduler = Scheduler(jobs or default_jobs(), on_failure=_notify_admin)
+    logger.info(f"Scheduler started: {', '.join(scheduler.jobs)}")
+    await scheduler.run()
@@ -1,40 +1,35 @@
-import os
-import time
 import threading
 import logging
 import asyncio
 from webhook import app                 # Flask-приложение
 from main import run_bot_polling        # запуск aiogram
-from tasks import run_all_jobs          
+from scheduler import run_scheduler, CRON_ENABLED
+from telegram_service import with_http_session
+from leader import run_as_leader
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 def _start_bot():
+    # Поток стартует на каждом воркере. polling / setWebhook — только у лидера (см. main.start_bot);
+    # в BOT_MODE=webhook апдейты через webhook.telegram_update обрабатывает любой воркер
     logger.info("Starting bot thread…")
     threading.Thread(target=run_bot_polling, daemon=True).start()
 def _start_scheduler():
     """
-    Внутренний «крон». Запускает все джобы из tasks.py по интервалу. Управляется переменными окружения:
+    Внутренний «крон»: scheduler.py в отдельном потоке с одним постоянным event loop.
+    Работает только на процессе-лидере (leader.py), остальные ждут failover.
+    Расписания джобов — в scheduler.default_jobs(), переопределяются JOB_SCHEDULE_<NAME>.
       - CRON_ENABLED=true|false
-      - CRON_INTERVAL_MIN=60 (минуты для теста)
-      - CRON_INTERVAL_PROD=1d  (игнорируется здесь; оставлена для совместимости)
     """
-    enabled = os.getenv("CRON_ENABLED", "true").lower() in ("1", "true", "yes")
-    if not enabled:
+    if not CRON_ENABLED:
         logger.info("Scheduler disabled (CRON_ENABLED=false)")
         return
-    interval_min = int(os.getenv("CRON_INTERVAL_MIN", "1440"))  # по умолчанию раз в сутки
     def loop():
-        logger.info(f"Scheduler started, interval={interval_min}min")
-        while True:
-            try:
-                asyncio.run(run_all_jobs())
-            except Exception as e:
-                logger.exception(f"Scheduler run_all_jobs error: {e}")
-            time.sleep(interval_min * 1440)
-    threading.Thread(target=loop, daemon=True).start()
+        try:
+            asyncio.run(with_http_session(run_as_leader("scheduler", run_scheduler)))
+        except Exception as e:
+            logger.exception(f"Scheduler crashed: {e}")
+    threading.Thread(target=loop, name="scheduler", daemon=True).start()
 # поднимаем всё
 _start_bot()
 _start_scheduler()
-
-
@@ -1,13 +1,22 @@
 import os
+import time
 import asyncio
 import logging
 from datetime import datetime, timedelta
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, func
 
-from database import SessionLocal, Subscription
-from telegram_service import TelegramService
+from database import SessionLocal, Subscription, enqueue_telegram, expire_subscriptions, EXPIRE_BATCH_SIZE
+from blocking import run_blocking
+from telegram_service import (
+    TelegramService, with_http_session,
+    expiry_warning_payload, expired_goodbye_payload, video_payload,
+)
+from outbox import drain_outbox
+from group_access import remove_from_group, pending_removals, summarize_removal
 from payment_service import StripeService, PayPalService
-from config import VIDEO_PENDING_FILE_ID
+from pay_links import lazy_links_enabled, make_pay_link
+from job_runs import record_job, count_api_call, observe_latency
+import media
 
 # ---------- ЛОГИ ----------
 logging.basicConfig(
@@ -25,6 +34,9 @@ SEND_CANCEL_NOTICE = os.getenv("SEND_CANCEL_NOTICE", "1") == "1"
 ADMIN_IDS = [s.strip() for s in os.getenv("ADMIN_IDS", "").split(",") if s.strip()]
 ADMIN_FALLBACK_ID = int(ADMIN_IDS[0]) if ADMIN_IDS else None
 DRY_RUN = os.getenv("DRY_RUN", "0") == "1"
+# Сколько подписок обрабатываем параллельно. ~300 мс на отправку × 10 ≈ 30 msg/s — предел Telegram;
+# сверх этого запросы всё равно притормозит send_engine.
+CRON_CONCURRENCY = int(os.getenv("CRON_CONCURRENCY", "10"))
 
 
 def _safe_chat_id(tid: int | None) -> int | None:
@@ -33,19 +45,93 @@ def _safe_chat_id(tid: int | None) -> int | None:
     """
     return ADMIN_FALLBACK_ID if DRY_RUN and ADMIN_FALLBACK_ID else tid
 
+async def _fan_out(job: str, items: list, worker, limit: int = CRON_CONCURRENCY) -> dict:
+    """
+    Запускает worker(item) для каждого элемента, не больше limit одновременно.
+    Каждый worker сам ловит свои ошибки и сам коммитит своё состояние;
+    здесь только собираем итог для сводки админу (и время на элемент — в job_runs).
+    """
+    sem = asyncio.Semaphore(max(1, limit))
+
+    async def run_one(item):
+        async with sem:
+            started = time.perf_counter()
+            try:
+                return bool(await worker(item))
+            except Exception as e:
+                logger.error(f"[{job}] item {item} failed: {e}")
+                return False
+            finally:
+                observe_latency(time.perf_counter() - started)
+
+    results = await asyncio.gather(*(run_one(item) for item in items))
+    ok = sum(1 for r in results if r)
+    return {"candidates": len(items), "ok": ok, "failed": len(items) - ok}
+
+def _update_subscription(sub_id: int, only_if_status: str | None = None, messages: tuple = (), **values) -> bool:
+    """
+    Точечное обновление одной подписки в своей сессии. messages — (method, payload) для
+    telegram_outbox, пишутся в ТОЙ ЖЕ транзакции. False — строка уже не в нужном статусе.
+    """
+    db = SessionLocal()
+    try:
+        q = db.query(Subscription).filter(Subscription.id == sub_id)
+        if only_if_status:
+            q = q.filter(Subscription.status == only_if_status)
+        updated = q.update(values, synchronize_session=False)
+        if updated:
+            for method, payload in messages:
+                enqueue_telegram(db, payload, method=method)
+        db.commit()
+        return updated > 0
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def _payment_links(user_id: int, job: str) -> tuple[str | None, str | None]:
+    """
+    Создаёт ссылки Stripe/PayPal сразу (блокирующие вызовы — зовём из потока).
+    Используется, только если PUBLIC_BASE_URL не задан (см. _links_for).
+    """
+    stripe_url = paypal_url = None
+    try:
+        count_api_call()
+        s = StripeService.create_subscription_session(user_id)
+        if s.get("success"):
+            stripe_url = s.get("url")
+    except Exception as e:
+        logger.error(f"[{job}] stripe error for user_id={user_id}: {e}")
+
+    try:
+        count_api_call()
+        p = PayPalService.create_subscription(user_id)
+        if p.get("success"):
+            paypal_url = p.get("approval_url")
+    except Exception as e:
+        logger.error(f"[{job}] paypal error for user_id={user_id}: {e}")
+    return stripe_url, paypal_url
+
+async def _links_for(user_id: int, job: str) -> tuple[str | None, str | None]:
+    """
+    Ссылки оплаты для сообщения. С PUBLIC_BASE_URL — подписанные /pay/<token> без обращений
+    к Stripe/PayPal (сессия создаётся при открытии); без него — как раньше, сразу у провайдеров.
+    """
+    if lazy_links_enabled():
+        return make_pay_link(user_id, "stripe"), make_pay_link(user_id, "paypal")
+    return await run_blocking(_payment_links, user_id, job, timeout=None)
+
 # =========================
 # 1) ПИНАЕМ pending
 # =========================
-async def nudge_pending_subscriptions() -> int:
-    db = SessionLocal()
-    ts = TelegramService()
-    now = datetime.utcnow()
+def _pending_candidates(now: datetime) -> list:
     cutoff_age = now - timedelta(hours=PENDING_MIN_AGE_HOURS)
     cooldown_ago = now - timedelta(hours=PENDING_COOLDOWN_HOURS)
-    count = 0
 
+    db = SessionLocal()
     try:
-        pending = db.query(Subscription).filter(
+        return db.query(Subscription.id, Subscription.telegram_id, Subscription.user_id).filter(
             and_(
                 Subscription.status == "pending",
                 Subscription.created_at <= cutoff_age,
@@ -56,78 +142,63 @@ async def nudge_pending_subscriptions() -> int:
                 Subscription.telegram_id != None
             )
         ).all()
-
-        logger.info(f"[nudge_pending] candidates: {len(pending)}")
-
-        for sub in pending:
-            tid = sub.telegram_id
-            stripe_url = paypal_url = None
-
-            if not DRY_RUN:
-                try:
-                    s = StripeService.create_subscription_session(tid)
-                    if s.get("success"):
-                        stripe_url = s.get("url")
-                except Exception as e:
-                    logger.error(f"[nudge_pending] stripe error for {tid}: {e}")
-
-                try:
-                    p = PayPalService.create_subscription(tid)
-                    if p.get("success"):
-                        paypal_url = p.get("approval_url")
-                except Exception as e:
-                    logger.error(f"[nudge_pending] paypal error for {tid}: {e}")
-
-            # клавиатура
-            buttons = []
-            if stripe_url:
-                buttons.append([{"text": "💳 Paga con Stripe", "url": stripe_url}])
-            if paypal_url:
-                buttons.append([{"text": "🅿️ Paga con PayPal", "url": paypal_url}])
-            buttons.append([{"text": "📞 Consulenza", "url": "https://t.me/liudmylazhyltsova"}])
-            reply_markup = {"inline_keyboard": buttons}
-
-            caption = (
-                "✨ <b>Lezione di prova</b>\n\n"
-                "Guarda la presentazione e inizia quando vuoi.\n"
-                "Scegli il metodo di pagamento qui sotto 👇"
-            )
-
-            if DRY_RUN:
-                logger.info(f"[nudge_pending][DRY_RUN] would send video to {tid}")
-            else:
-                chat_id = _safe_chat_id(tid)
-                try:
-                    await ts.send_video(chat_id, VIDEO_PENDING_FILE_ID, caption, reply_markup)
-                except Exception as e:
-                    logger.error(f"[nudge_pending] send_video failed for {tid}: {e}")
-
-            sub.last_nudge_at = now
-            sub.nudges_count = (sub.nudges_count or 0) + 1
-            db.add(sub)
-            count += 1
-
-        db.commit()
-    except Exception as e:
-        logger.error(f"[nudge_pending] exception: {e}")
-        db.rollback()
     finally:
         db.close()
-    return count
+
+@record_job("nudge_pending")
+async def nudge_pending_subscriptions() -> dict:
+    now = datetime.utcnow()
+    pending = await run_blocking(_pending_candidates, now)
+
+    logger.info(f"[nudge_pending] candidates: {len(pending)}")
+
+    async def nudge_one(row) -> bool:
+        sub_id, tid, user_id = row
+        stripe_url = paypal_url = None
+
+        if not DRY_RUN:
+            stripe_url, paypal_url = await _links_for(user_id, "nudge_pending")
+
+        # клавиатура
+        buttons = []
+        if stripe_url:
+            buttons.append([{"text": "💳 Paga con Stripe", "url": stripe_url}])
+        if paypal_url:
+            buttons.append([{"text": "🅿️ Paga con PayPal", "url": paypal_url}])
+        buttons.append([{"text": "📞 Consulenza", "url": "https://t.me/liudmylazhyltsova"}])
+        reply_markup = {"inline_keyboard": buttons}
+
+        caption = (
+            "✨ <b>Lezione di prova</b>\n\n"
+            "Guarda la presentazione e inizia quando vuoi.\n"
+            "Scegli il metodo di pagamento qui sotto 👇"
+        )
+
+        messages = ()
+        if DRY_RUN:
+            logger.info(f"[nudge_pending][DRY_RUN] would send video to {tid}")
+        else:
+            messages = (video_payload(_safe_chat_id(tid), media.get_file_id(media.PENDING_VIDEO), caption, reply_markup),)
+
+        return await run_blocking(
+            _update_subscription, sub_id, messages=messages,
+            last_nudge_at=now,
+            nudges_count=func.coalesce(Subscription.nudges_count, 0) + 1,
+            timeout=None,
+        )
+
+    return await _fan_out("nudge_pending", pending, nudge_one)
 
 # =========================
 # 2) ПРЕДУПРЕЖДАЕМ active
 # =========================
-async def warn_expiring_subscriptions() -> int:
-    ts = TelegramService()
-    db = SessionLocal()
-    now = datetime.utcnow()
+def _expiring_candidates(now: datetime) -> list:
     warn_until = now + timedelta(days=WARN_DAYS_BEFORE)
     cooldown_ago = now - timedelta(hours=24)
-    count = 0
 
+    db = SessionLocal()
     try:
-        subs = db.query(Subscription).filter(
+        return db.query(Subscription.id, Subscription.telegram_id, Subscription.expires_at).filter(
             and_(
                 Subscription.status == "active",
                 Subscription.expires_at != None,
@@ -140,113 +211,122 @@ async def warn_expiring_subscriptions() -> int:
                 Subscription.telegram_id != None
             )
         ).all()
+    finally:
+        db.close()
 
-        logger.info(f"[warn_expiring] candidates: {len(subs)}")
+@record_job("warn_expiring")
+async def warn_expiring_subscriptions() -> dict:
+    now = datetime.utcnow()
+    subs = await run_blocking(_expiring_candidates, now)
 
-        for sub in subs:
-            days_left = max((sub.expires_at - now).days, 0)
-            if DRY_RUN:
-                logger.info(f"[warn_expiring][DRY_RUN] would warn {sub.telegram_id}, {days_left} days left")
-            else:
-                await ts.send_subscription_expiry_warning(_safe_chat_id(sub.telegram_id), days_left)
+    logger.info(f"[warn_expiring] candidates: {len(subs)}")
 
-            sub.last_warned_at = now
-            db.add(sub)
-            count += 1
+    async def warn_one(row) -> bool:
+        sub_id, tid, expires_at = row
+        days_left = max((expires_at - now).days, 0)
+        messages = ()
+        if DRY_RUN:
+            logger.info(f"[warn_expiring][DRY_RUN] would warn {tid}, {days_left} days left")
+        else:
+            messages = (("sendMessage", expiry_warning_payload(_safe_chat_id(tid), days_left)),)
 
-        db.commit()
-    except Exception as e:
-        logger.error(f"[warn_expiring] exception: {e}")
-        db.rollback()
-    finally:
-        db.close()
-    return count
+        return await run_blocking(_update_subscription, sub_id, messages=messages, last_warned_at=now, timeout=None)
+
+    return await _fan_out("warn_expiring", subs, warn_one)
 
 # =========================
 # 3) ДЕАКТИВИРУЕМ expired
 # =========================
-async def deactivate_expired_subscriptions() -> int:
+def _expire_chunk(now: datetime, goodbye: bool, ids=None) -> list:
+    """
+    Одна пачка истёкших подписок одним UPDATE ... RETURNING (см. expire_subscriptions).
+    goodbye — прощание пишется в outbox в той же транзакции: статус и сообщение либо
+    записаны оба, либо ни одно. С PUBLIC_BASE_URL — с подписанными ссылками оплаты; без
+    него — без ссылок (кнопки «Начать заново» / «Поддержка»): сессии у провайдеров внутри
+    транзакции не создаём.
+    """
+    lazy = lazy_links_enabled()
     db = SessionLocal()
-    now = datetime.utcnow()
-    ts = TelegramService()
-    count = 0
-
     try:
-        expired = db.query(Subscription).filter(
-            and_(
-                Subscription.status == "active",
-                Subscription.expires_at != None,
-                Subscription.expires_at < now
-            )
-        ).all()
-
-        logger.info(f"[deactivate_expired] candidates: {len(expired)}")
-
-        for sub in expired:
-            sub.status = "expired"
-            sub.has_group_access = False
-            sub.cancelled_at = now
-            db.add(sub)
-            count += 1
-
+        rows = expire_subscriptions(db, now, ids=ids)
+        if goodbye:
+            for _, tid, user_id in rows:
+                stripe_url = make_pay_link(user_id, "stripe") if lazy else None
+                paypal_url = make_pay_link(user_id, "paypal") if lazy else None
+                enqueue_telegram(db, expired_goodbye_payload(_safe_chat_id(tid), stripe_url, paypal_url))
         db.commit()
-
-        for sub in expired:
-            if not DRY_RUN:
-                # Удаляем из группы
-                try:
-                    await ts.kick_from_group(sub.telegram_id)
-                except Exception as e:
-                    logger.warning(f"[deactivate_expired] failed to kick {sub.telegram_id}: {e}")
-
-                # Генерим новые ссылки
-                stripe_url = paypal_url = None
-                try:
-                    s = StripeService.create_subscription_session(sub.telegram_id)
-                    if s.get("success"):
-                        stripe_url = s.get("url")
-                except Exception as e:
-                    logger.error(f"[goodbye] stripe error for {sub.telegram_id}: {e}")
-
-                try:
-                    p = PayPalService.create_subscription(sub.telegram_id)
-                    if p.get("success"):
-                        paypal_url = p.get("approval_url")
-                except Exception as e:
-                    logger.error(f"[goodbye] paypal error for {sub.telegram_id}: {e}")
-
-                # Goodbye-сообщение
-                try:
-                    await ts.send_subscription_expired_goodbye(
-                        _safe_chat_id(sub.telegram_id),
-                        stripe_url,
-                        paypal_url
-                    )
-                except Exception as e:
-                    logger.error(f"[goodbye] send failed for {sub.telegram_id}: {e}")
-
-        logger.info(f"[deactivate_expired] deactivated {count} subscriptions")
-    except Exception as e:
-        logger.error(f"[deactivate_expired_subscriptions] exception: {e}")
+        return rows
+    except Exception:
         db.rollback()
+        raise
     finally:
         db.close()
-    return count
+
+async def expire_due_subscriptions(ids=None) -> dict:
+    """
+    Истечение пачками по EXPIRE_BATCH_SIZE: статус меняется set-based запросом, без загрузки
+    строк и без UPDATE на каждую подписку. Goodbye — в outbox в той же транзакции, что и
+    смена статуса (см. _expire_chunk).
+    ids — только эти подписки (точное истечение из expiry.py); без ids — полный проход.
+    """
+    now = datetime.utcnow()
+    expired = []
+
+    while True:
+        rows = await run_blocking(_expire_chunk, now, not DRY_RUN, ids, timeout=None)
+        expired += rows
+        if len(rows) < EXPIRE_BATCH_SIZE:
+            break
+
+    result = {"candidates": len(expired), "ok": len(expired), "failed": 0}
+    logger.info(f"[deactivate_expired] expired {len(expired)} subscriptions")
+
+    # Удаляем из группы одной пачкой (ban -> unban, с ограничением параллельности);
+    # при полном проходе заодно догоняем тех, кого не удалось удалить в прошлые запуски
+    to_remove = []
+    if not DRY_RUN:
+        to_remove = [tid for _, tid, _ in expired if tid]
+        if ids is None:
+            to_remove += await run_blocking(pending_removals)
+    result["group"] = summarize_removal(await remove_from_group(to_remove)) if to_remove else None
+    return result
+
+@record_job("deactivate_expired")
+async def deactivate_expired_subscriptions() -> dict:
+    """Полный проход (страховка, см. scheduler.py); вовремя подписки истекает expiry.py."""
+    return await expire_due_subscriptions()
 
 # =========================
 # Объединённый запуск
 # =========================
+def _fmt(result: dict) -> str:
+    text = f"{result['ok']}/{result['candidates']} (failed: {result['failed']})"
+    if result.get("api_calls"):
+        text += f", api: {result['api_calls']}"
+    if result.get("p95_ms") is not None:
+        text += f", p95: {result['p95_ms']:.0f}ms"
+    return text
+
+def _fmt_group(summary: dict | None) -> str:
+    if not summary:
+        return "0"
+    return f"{summary['removed']} (skipped: {summary['skipped']}, failed: {summary['failed']})"
+
 async def run_all_jobs():
     start = datetime.utcnow()
     nudged = await nudge_pending_subscriptions()
     warned = await warn_expiring_subscriptions()
     expired = await deactivate_expired_subscriptions()
+    # Сообщения уже лежат в outbox; при разовом запуске отправляем их сразу
+    outbox_sent = await drain_outbox()
 
     summary = (
         f"✅ Cron finished\n"
-        f"- nudged pending: {nudged}\n"
-        f"- warned active: {warned}\n"
-        f"- deactivated expired: {expired}\n"
+        f"- nudged pending: {_fmt(nudged)}\n"
+        f"- warned active: {_fmt(warned)}\n"
+        f"- deactivated expired: {_fmt(expired)}\n"
+        f"- removed from group: {_fmt_group(expired.get('group'))}\n"
+        f"- outbox processed: {outbox_sent}\n"
         f"took: {(datetime.utcnow()-start).total_seconds():.1f}s"
     )
     logger.info(summary)
@@ -258,7 +338,7 @@ async def run_all_jobs():
             logger.error(f"notify admin failed: {e}")
 
 def run_all_sync():
-    asyncio.run(run_all_jobs())
+    asyncio.run(with_http_session(run_all_jobs()))
 
 if __name__ == "__main__":
     run_all_sync()
@@ -1,12 +1,19 @@
 # telegram_service.py 
 import os
+import time
 import asyncio
+import threading
+import weakref
 import aiohttp
+import json as json_lib
 from datetime import datetime, timedelta
 from database import SessionLocal, Subscription, get_db # Импортируем get_db
+from blocking import run_blocking
 from sqlalchemy import or_
-from config import BOT_TOKEN as CONF_BOT_TOKEN
+from config import BOT_TOKEN as CONF_BOT_TOKEN, TELEGRAM_API_BASE, GROUP_ID
 from payment_config import CLOSED_GROUP_LINK
+from job_runs import count_api_call
+import media
 import logging
 from functools import wraps # Импортируем wraps для декоратора
 
@@ -42,28 +49,376 @@ def _platform_keyboard():
         return {"inline_keyboard": [[{"text": "📲 Открыть платформу", "web_app": {"url": APP_URL}}]]}
     return {"inline_keyboard": [[{"text": "➡️ Войти в закрытую группу Expert Lash", "url": CLOSED_GROUP_LINK}]]}
 
+# --- Общая HTTP-сессия к Bot API: одна на event loop, с пулом keep-alive соединений ---
+TG_HTTP_LIMIT = int(os.getenv("TG_HTTP_LIMIT", "100"))                    # всего соединений в пуле
+TG_HTTP_LIMIT_PER_HOST = int(os.getenv("TG_HTTP_LIMIT_PER_HOST", "50"))   # к api.telegram.org
+TG_HTTP_DNS_TTL = int(os.getenv("TG_HTTP_DNS_TTL", "300"))                # кэш DNS, секунды
+TG_HTTP_KEEPALIVE = float(os.getenv("TG_HTTP_KEEPALIVE", "30"))           # держим соединение открытым, секунды
+TG_HTTP_TIMEOUT = float(os.getenv("TG_HTTP_TIMEOUT", "15"))
+
+_sessions = weakref.WeakKeyDictionary()  # event loop -> aiohttp.ClientSession
+_sessions_lock = threading.Lock()
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Возвращает (и при необходимости создаёт) сессию для текущего event loop."""
+    loop = asyncio.get_running_loop()
+    with _sessions_lock:
+        session = _sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=TG_HTTP_LIMIT,
+                limit_per_host=TG_HTTP_LIMIT_PER_HOST,
+                ttl_dns_cache=TG_HTTP_DNS_TTL,
+                keepalive_timeout=TG_HTTP_KEEPALIVE,
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=TG_HTTP_TIMEOUT),
+            )
+            _sessions[loop] = session
+        return session
+
+async def startup_http_session():
+    """Хук старта: заранее открываем сессию в текущем loop."""
+    get_http_session()
+
+async def close_http_session():
+    """Хук остановки: закрываем сессию текущего loop (вызывать до завершения loop)."""
+    with _sessions_lock:
+        session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+async def with_http_session(coro):
+    """Выполняет корутину и закрывает сессию loop'а — для одноразовых asyncio.run(...)."""
+    try:
+        return await coro
+    finally:
+        await close_http_session()
+
+# --- Фоновый event loop для уведомлений из синхронного кода (Flask) ---
+_background = {"loop": None}
+_background_lock = threading.Lock()
+
+def background_loop() -> asyncio.AbstractEventLoop:
+    """Один долгоживущий loop в daemon-потоке: соединения к Bot API переиспользуются между вызовами."""
+    with _background_lock:
+        loop = _background["loop"]
+        if loop is None or loop.is_closed():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="tg-background-loop", daemon=True).start()
+            _background["loop"] = loop
+        return loop
+
+# --- Лимиты Telegram: ~30 сообщений/с на бота и ~1 сообщение/с в один чат ---
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))        # запросов в секунду на весь процесс
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))             # сообщений в секунду в один чат
+TG_CHAT_BURST = float(os.getenv("TG_CHAT_BURST", "3"))           # короткая пачка в один чат (ответ + клавиатура)
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))           # повторов после 429, потом — drop
+TG_QUEUE_MAXSIZE = int(os.getenv("TG_QUEUE_MAXSIZE", "10000"))   # очередь fire-and-forget (на event loop)
+TG_QUEUE_WORKERS = int(os.getenv("TG_QUEUE_WORKERS", "8"))
+
+# Методы, которые считаются «сообщением в чат» и подпадают под лимит на чат
+_CHAT_LIMITED_METHODS = {
+    "sendMessage", "sendVideo", "sendPhoto", "sendDocument", "sendAnimation",
+    "sendMediaGroup", "copyMessage", "forwardMessage",
+}
+
+class TokenBucket:
+    """
+    Потокобезопасный token bucket. reserve() сразу списывает токен и возвращает,
+    сколько секунд нужно подождать — так резервации выстраиваются в очередь по времени
+    и работают одинаково из любого event loop / потока.
+    """
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def try_acquire(self) -> bool:
+        """Без очереди: есть токен — списываем и True; нет — False (для отказа, а не ожидания)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def pause(self, seconds: float):
+        """Блокирует bucket на seconds (используется для retry_after из 429)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def idle(self) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens >= self.capacity
+
+def _retry_after(data) -> float:
+    """Достаёт parameters.retry_after из ответа 429 (по умолчанию — 1 секунда)."""
+    try:
+        return float((data or {}).get("parameters", {}).get("retry_after", 1))
+    except (TypeError, ValueError, AttributeError):
+        return 1.0
+
+class SendEngine:
+    """
+    Движок отправки в Bot API с учётом лимитов Telegram:
+      - глобальный token bucket на процесс и отдельный bucket на каждый чат;
+      - 429 → читаем retry_after, «замораживаем» bucket чата и перепланируем запрос
+        (у методов без bucket'а чата — просто ждём retry_after); повторы 429 — только здесь;
+      - await send(...) — дождаться ответа; submit(...) — fire-and-forget через очередь.
+    Счётчики доступны через stats().
+    """
+    def __init__(self, global_rate: float = TG_GLOBAL_RATE, chat_rate: float = TG_CHAT_RATE,
+                 chat_burst: float = TG_CHAT_BURST, max_retries: int = TG_MAX_RETRIES,
+                 queue_maxsize: int = TG_QUEUE_MAXSIZE, workers: int = TG_QUEUE_WORKERS):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.queue_maxsize = queue_maxsize
+        self.workers = workers
+        self._chat_buckets: dict = {}
+        self._buckets_lock = threading.Lock()
+        self._queues = weakref.WeakKeyDictionary()  # event loop -> asyncio.Queue
+        self._queues_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "sent": 0, "errors": 0, "dropped": 0, "retried_429": 0,
+            "throttle_waits": 0, "throttle_wait_seconds": 0.0,
+        }
+
+    # ---------- метрики ----------
+    def _inc(self, key: str, value=1):
+        with self._stats_lock:
+            self._stats[key] += value
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            out = dict(self._stats)
+        with self._queues_lock:
+            out["queue_depth"] = sum(q.qsize() for q in self._queues.values())
+        out["chat_buckets"] = len(self._chat_buckets)
+        return out
+
+    # ---------- лимиты ----------
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        with self._buckets_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                if len(self._chat_buckets) > 10000:
+                    # чистим полностью восстановившиеся bucket'ы, чтобы словарь не рос бесконечно
+                    for key in [k for k, b in self._chat_buckets.items() if b.idle()]:
+                        del self._chat_buckets[key]
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+                self._chat_buckets[chat_id] = bucket
+            return bucket
+
+    async def _throttle(self, method: str, chat_id):
+        wait = 0.0
+        if chat_id is not None and method in _CHAT_LIMITED_METHODS:
+            wait += await self._wait(self._chat_bucket(chat_id).reserve())
+        wait += await self._wait(self.global_bucket.reserve())
+        if wait > 0:
+            self._inc("throttle_waits")
+            self._inc("throttle_wait_seconds", wait)
+
+    @staticmethod
+    async def _wait(seconds: float) -> float:
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+        return seconds
+
+    # ---------- отправка ----------
+    async def send(self, request, method: str, payload: dict):
+        """
+        request — корутина-функция (method, payload) -> (http_status, json|None).
+        Возвращает JSON ответа Telegram или None (ошибка / drop после повторов).
+        """
+        chat_id = payload.get("chat_id") if isinstance(payload, dict) else None
+        for attempt in range(self.max_retries + 1):
+            await self._throttle(method, chat_id)
+            count_api_call()
+            try:
+                status, data = await request(method, payload)
+            except Exception as e:
+                self._inc("errors")
+                logger.exception("Telegram API exception [%s]: %s", method, e)
+                return None
+
+            if status == 200 and data is not None:
+                self._inc("sent")
+                return data
+
+            if status == 429:
+                retry_after = _retry_after(data)
+                self._inc("retried_429")
+                logger.warning("Telegram 429 [%s] chat=%s: retry in %.1fs (attempt %s)", method, chat_id, retry_after, attempt + 1)
+                if chat_id is not None and method not in _CHAT_LIMITED_METHODS:
+                    # у метода нет bucket'а чата (banChatMember и т.п.) — ждём здесь, чужие чаты не тормозим
+                    await asyncio.sleep(retry_after)
+                    continue
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else self.global_bucket
+                bucket.pause(retry_after)
+                continue
+
+            self._inc("errors")
+            logger.error("Telegram API error [%s]: %s — %s", method, status, str(data)[:200])
+            return None
+
+        self._inc("dropped")
+        logger.error("Telegram [%s] chat=%s dropped after %s retries", method, chat_id, self.max_retries)
+        return None
+
+    def submit(self, request, method: str, payload: dict) -> bool:
+        """
+        Fire-and-forget: ставит запрос в очередь текущего event loop (или фонового, если
+        вызывают из синхронного кода). Возвращает False, если очередь переполнена.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = background_loop()
+            loop.call_soon_threadsafe(self._enqueue, loop, request, method, payload)
+            return True
+        return self._enqueue(loop, request, method, payload)
+
+    def _enqueue(self, loop, request, method: str, payload: dict) -> bool:
+        with self._queues_lock:
+            queue = self._queues.get(loop)
+            if queue is None:
+                queue = asyncio.Queue(maxsize=self.queue_maxsize)
+                self._queues[loop] = queue
+                for _ in range(self.workers):
+                    loop.create_task(self._worker(queue))
+        try:
+            queue.put_nowait((request, method, payload))
+            return True
+        except asyncio.QueueFull:
+            self._inc("dropped")
+            logger.error("Telegram send queue is full, dropping [%s]", method)
+            return False
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            request, method, payload = await queue.get()
+            try:
+                await self.send(request, method, payload)
+            except Exception as e:
+                logger.error(f"Send worker error [{method}]: {e}")
+            finally:
+                queue.task_done()
+
+send_engine = SendEngine()
+
+# Удаление из группы: повторы поверх send_engine (429 после всех его повторов, 5xx, сеть)
+TG_KICK_MAX_ATTEMPTS = int(os.getenv("TG_KICK_MAX_ATTEMPTS", "5"))
+TG_KICK_BACKOFF_MAX = float(os.getenv("TG_KICK_BACKOFF_MAX", "30"))
+# Ответы, которые повтором не исправить (нет прав, пользователь — админ и т.п.)
+_PERMANENT_STATUSES = {400, 403}
+
+TG_UPLOAD_TIMEOUT = float(os.getenv("TG_UPLOAD_TIMEOUT", "300"))
+_upload_locks = weakref.WeakKeyDictionary()  # event loop -> {ключ медиа: asyncio.Lock}
+_upload_locks_lock = threading.Lock()
+
+def _upload_lock(key: str) -> asyncio.Lock:
+    """Одна загрузка на ключ медиа в пределах event loop."""
+    loop = asyncio.get_running_loop()
+    with _upload_locks_lock:
+        locks = _upload_locks.get(loop)
+        if locks is None:
+            locks = _upload_locks[loop] = {}
+        lock = locks.get(key)
+        if lock is None:
+            lock = locks[key] = asyncio.Lock()
+        return lock
+
+def _forget_upload_lock(key: str):
+    """file_id сохранён — дальше ключ отправляется без загрузки, lock больше не нужен."""
+    with _upload_locks_lock:
+        (_upload_locks.get(asyncio.get_running_loop()) or {}).pop(key, None)
+
+# Альбомы (sendMediaGroup): до 10 видео за один вызов — один слот лимита вместо десяти
+MEDIA_GROUP_SIZE = 10
+_albums: dict = {}   # (prefix, caption) -> (media.version(), группы, ключи без file_id)
+
+def _album(prefix: str, caption: str) -> tuple[list, list]:
+    """
+    Группы InputMediaVideo по MEDIA_GROUP_SIZE из file_id реестра; собираются один раз
+    и живут до изменения реестра. Ключи без file_id (только локальный файл) — отдельно.
+    caption — шаблон с {n} (номер видео с 1).
+    """
+    version = media.version()
+    cached = _albums.get((prefix, caption))
+    if cached and cached[0] == version:
+        return cached[1], cached[2]
+    items, missing = [], []
+    for n, key in enumerate(media.media_keys(prefix), 1):
+        file_id = media.get_file_id(key)
+        if file_id:
+            items.append((n, {"type": "video", "media": file_id, "caption": caption.format(n=n)}))
+        else:
+            missing.append((n, key))
+    groups = [items[i:i + MEDIA_GROUP_SIZE] for i in range(0, len(items), MEDIA_GROUP_SIZE)]
+    _albums[(prefix, caption)] = (version, groups, missing)
+    return groups, missing
+
 class TelegramService:
-    # ... (методы __init__ и _post остаются без изменений, они написаны хорошо) ...
     def __init__(self):
         self.bot_token = os.getenv("BOT_TOKEN", CONF_BOT_TOKEN)
         if not self.bot_token:
             raise RuntimeError("BOT_TOKEN not set")
-        self.api_url = f"https://api.telegram.org/bot{self.bot_token}"
+        self.api_url = f"{TELEGRAM_API_BASE}/bot{self.bot_token}"
+
+    async def _request(self, method: str, payload: dict):
+        """Сырой HTTP-вызов Bot API через общую сессию: возвращает (status, json|None)."""
+        session = get_http_session()
+        async with session.post(f"{self.api_url}/{method}", json=payload) as resp:
+            text = await resp.text()
+            try:
+                return resp.status, json_lib.loads(text)
+            except ValueError:
+                logger.error("Telegram JSON decode failed [%s]: %s", method, text[:200])
+                return resp.status, None
+
+    async def send(self, method: str, payload: dict):
+        """Вызов Bot API с учётом лимитов (ждём ответ)."""
+        return await send_engine.send(self._request, method, payload)
+
+    async def send_with_status(self, method: str, payload: dict):
+        """Как send(), но возвращает (status, json) последнего ответа — чтобы решать, повторять ли."""
+        last = {}
+
+        async def request(m, p):
+            status, data = await self._request(m, p)
+            last["status"], last["data"] = status, data
+            return status, data
+
+        data = await send_engine.send(request, method, payload)
+        if data is not None:
+            return 200, data
+        return last.get("status"), last.get("data")
+
+    def send_nowait(self, method: str, payload: dict) -> bool:
+        """Fire-and-forget вызов Bot API с учётом лимитов."""
+        return send_engine.submit(self._request, method, payload)
 
     async def _post(self, method: str, json: dict ):
-        try:
-            timeout = aiohttp.ClientTimeout(total=15 )
-            async with aiohttp.ClientSession(timeout=timeout ) as session:
-                async with session.post(f"{self.api_url}/{method}", json=json) as resp:
-                    text = await resp.text()
-                    if resp.status == 200:
-                        try: return await resp.json()
-                        except Exception: logger.exception("Telegram JSON decode failed: %s", text[:200]); return None
-                    logger.error("Telegram API error [%s]: %s — %s", method, resp.status, text[:200])
-                    return None
-        except Exception as e:
-            logger.exception("Telegram API exception [%s]: %s", method, e)
-            return None
+        return await self.send(method, json)
 
     async def send_message(self, chat_id: int, text: str, reply_markup=None, parse_mode="HTML"):
         payload = {"chat_id": chat_id, "text": text, "parse_mode": parse_mode}
@@ -93,14 +448,7 @@ class TelegramService:
 
     async def send_subscription_cancelled_notification(self, telegram_id: int):
         try:
-            # Итальянский: "❌ <b>Il tuo abbonamento è stato annullato</b>\n\nL’accesso alla piattaforma è stato revocato.\n\nSe desideri riattivare l’abbonamento, usa il comando /start"
-            # Русский: "❌ <b>Ваша подписка была отменена</b>\n\nДоступ к платформе был отозван.\n\nЕсли вы хотите возобновить подписку, используйте команду /start"
-            text = (
-                "❌ <b>Ваша подписка была отменена</b>\n\n"
-                "Доступ к платформе был отозван.\n\n"
-                "Если вы хотите возобновить подписку, используйте команду /start"
-            )
-            await self.send_message(telegram_id, text)
+            await self._post("sendMessage", cancelled_notification_payload(telegram_id))
         except Exception as e:
             logger.error(f"Error sending subscription cancelled notification: {e}")
 
@@ -152,75 +500,195 @@ class TelegramService:
     async def ban_chat_member(self, chat_id: str, user_id: int): payload = {"chat_id": chat_id, "user_id": user_id}; res = await self._post("banChatMember", payload); return res if res else await self._post("kickChatMember", payload)
     async def unban_chat_member(self, chat_id: str, user_id: int): return await self._post("unbanChatMember", {"chat_id": chat_id, "user_id": user_id, "only_if_banned": True})
 
+    async def _call_with_retry(self, method: str, payload: dict, attempts: int = TG_KICK_MAX_ATTEMPTS):
+        """
+        Возвращает (ok, error). 5xx/сеть — backoff и повтор, 400/403 — сразу ошибка.
+        429 повторяет (с ожиданием retry_after) уже send_engine — если 429 дошёл сюда,
+        повторы движка исчерпаны, второй слой повторов сверху не нужен.
+        """
+        error = None
+        for attempt in range(1, attempts + 1):
+            status, data = await self.send_with_status(method, payload)
+            if status == 200:
+                return True, None
+            description = data.get("description") if isinstance(data, dict) else None
+            error = f"{status}: {description or 'request failed'}"
+            if status in _PERMANENT_STATUSES or status == 429 or attempt == attempts:
+                break
+            await asyncio.sleep(min(TG_KICK_BACKOFF_MAX, 2 ** attempt))
+        return False, error
+
+    async def kick_from_group(self, telegram_id: int, group_id: int | None = None) -> dict:
+        """
+        Удаляет пользователя из закрытой группы: banChatMember, затем unbanChatMember
+        (only_if_banned), чтобы после продления он мог вернуться по ссылке.
+        Повторный вызов безопасен. Возвращает {"ok", "stage", "error"}.
+        """
+        group_id = group_id or GROUP_ID
+        if not group_id:
+            return {"ok": False, "stage": None, "error": "GROUP_ID is not set"}
+
+        payload = {"chat_id": group_id, "user_id": telegram_id}
+        ok, error = await self._call_with_retry("banChatMember", payload)
+        if not ok:
+            return {"ok": False, "stage": "ban", "error": error}
+        ok, error = await self._call_with_retry("unbanChatMember", {**payload, "only_if_banned": True})
+        if not ok:
+            # Из группы уже удалён, но вернуться пока не сможет — следующий прогон повторит unban
+            return {"ok": False, "stage": "unban", "error": error}
+        return {"ok": True, "stage": None, "error": None}
+
     async def send_subscription_expiry_warning(self, telegram_id: int, days_left: int):
         try:
-            # Итальянский: "⏰ <b>Il tuo abbonamento scade tra {days_left} giorni.</b>\n\nAssicurati che il pagamento automatico sia attivo per non perdere l’accesso."
-            # Русский: "⏰ <b>Ваша подписка истекает через {days_left} дней.</b>\n\nУбедитесь, что автоматический платеж активен, чтобы не потерять доступ."
-            text = (
-                f"⏰ <b>Ваша подписка истекает через {days_left} дня(ей).</b>\n\n"
-                "Убедитесь, что автоматический платеж активен, чтобы не потерять доступ."
-            )
-            reply_markup = {
-                "inline_keyboard": [
-                    [{"text": "💳 Обновить способ оплаты", "callback_data": "update_payment_method"}],
-                    [{"text": "📞 Поддержка", "url": "https://t.me/liudmylazhyltsova"}]
-                ]
-            }
-            await self.send_message(telegram_id, text, reply_markup )
+            return await self._post("sendMessage", expiry_warning_payload(telegram_id, days_left))
         except Exception as e:
             logger.error(f"Error sending subscription expiry warning: {e}")
 
-    # ... (метод send_video остается без изменений) ...
     async def send_video(self, chat_id: int, file_id: str, caption: str, reply_markup=None, parse_mode="HTML"):
-        # ...
-        pass
+        method, payload = video_payload(chat_id, file_id, caption, reply_markup, parse_mode)
+        return await self._post(method, payload)
+
+    def _upload_request(self, field: str, path: str):
+        """request() для send_engine: multipart-загрузка файла (форма собирается заново на каждый повтор)."""
+        async def request(method: str, payload: dict):
+            form = aiohttp.FormData()
+            for k, v in payload.items():
+                form.add_field(k, json_lib.dumps(v) if isinstance(v, (dict, list)) else str(v))
+            with open(path, "rb") as fh:
+                form.add_field(field, fh, filename=os.path.basename(path))
+                session = get_http_session()
+                async with session.post(f"{self.api_url}/{method}", data=form,
+                                        timeout=aiohttp.ClientTimeout(total=TG_UPLOAD_TIMEOUT)) as resp:
+                    text = await resp.text()
+                    try:
+                        return resp.status, json_lib.loads(text)
+                    except ValueError:
+                        return resp.status, None
+        return request
+
+    async def send_video_asset(self, chat_id: int, key: str, caption: str, reply_markup=None, parse_mode="HTML"):
+        """
+        Отправляет видео по ключу из media_assets. Если file_id ещё нет — загружает локальный
+        файл ОДИН раз и запоминает file_id; дальше байты больше не отправляются.
+        Возвращает ответ Telegram или None (нет ни file_id, ни файла / ошибка).
+        """
+        file_id = media.get_file_id(key)
+        if file_id:
+            return await self.send_video(chat_id, file_id, caption, reply_markup, parse_mode)
+
+        async with _upload_lock(key):
+            file_id = media.get_file_id(key)  # пока ждали блокировку, файл мог загрузить другой запрос
+            if file_id:
+                return await self.send_video(chat_id, file_id, caption, reply_markup, parse_mode)
+
+            path = media.get_local_path(key)
+            if not path:
+                logger.warning(f"No file_id and no local file for media '{key}'")
+                return None
+
+            payload = {"chat_id": chat_id, "caption": caption, "parse_mode": parse_mode}
+            if reply_markup:
+                payload["reply_markup"] = reply_markup
+            result = await send_engine.send(self._upload_request("video", path), "sendVideo", payload)
+            uploaded_id = ((result or {}).get("result") or {}).get("video", {}).get("file_id")
+            if uploaded_id:
+                await run_blocking(media.register_file_id, key, uploaded_id, timeout=None)
+                _forget_upload_lock(key)
+                logger.info(f"Uploaded media '{key}' once, file_id stored")
+            return result
+
+    async def send_video_album(self, chat_id: int, prefix: str, caption: str, placeholder: str) -> int:
+        """
+        Все видео с префиксом ключа альбомами по MEDIA_GROUP_SIZE (caption/placeholder —
+        шаблоны с {n}). Альбом не ушёл — шлём его видео по одному, а не ушедшие — текстом
+        placeholder. Видео без file_id идут после альбомов через send_video_asset (загрузка
+        один раз; со следующего раза они уже в альбоме). Возвращает число отправленных видео.
+        """
+        groups, missing = _album(prefix, caption)
+        delivered = 0
+        for group in groups:
+            if len(group) == 1:
+                # альбом из одного видео Telegram не принимает
+                n, item = group[0]
+                result = await self.send_video(chat_id, item["media"], item["caption"])
+            else:
+                result = await self._post("sendMediaGroup", {"chat_id": chat_id, "media": [item for _, item in group]})
+            if result:
+                delivered += len(group)
+                continue
+            logger.warning(f"Album '{prefix}' ({len(group)} items) failed for chat {chat_id}, sending one by one")
+            for n, item in group:
+                if len(group) > 1 and await self.send_video(chat_id, item["media"], item["caption"]):
+                    delivered += 1
+                else:
+                    await self.send_message(chat_id, placeholder.format(n=n))
+
+        for n, key in missing:
+            if await self.send_video_asset(chat_id, key, caption.format(n=n)):
+                delivered += 1
+            else:
+                await self.send_message(chat_id, placeholder.format(n=n))
+        return delivered
 
     async def send_subscription_expired_goodbye(self, telegram_id: int, stripe_url: str | None = None, paypal_url: str | None = None):
-        # Итальянский: "🙏 <b>Grazie per essere stata con noi!</b>\n\nLa tua sottoscrizione è scaduta e l’accesso è stato revocato.\nPuoi tornare quando vuoi — usa i pulsanti sotto per rinnovare o ricominciare."
-        # Русский: "🙏 <b>Спасибо, что были с нами!</b>\n\nВаша подписка истекла, и доступ был отозван.\nВы можете вернуться в любое время — используйте кнопки ниже, чтобы продлить или начать заново."
-        text = (
-            "🙏 <b>Спасибо, что были с нами!</b>\n\n"
-            "Ваша подписка истекла, и доступ был отозван.\n"
-            "Вы можете вернуться в любое время — используйте кнопки ниже, чтобы продлить или начать заново."
-        )
-        buttons = []
-        # Итальянский: "🔁 Riattiva con Stripe" -> "🔁 Продлить через Stripe"
-        if stripe_url: buttons.append([{"text": "🔁 Продлить через Stripe", "url": stripe_url}])
-        # Итальянский: "🅿️ Riattiva con PayPal" -> "🅿️ Продлить через PayPal"
-        if paypal_url: buttons.append([{"text": "🅿️ Продлить через PayPal", "url": paypal_url}])
-        # Итальянский: "🔄 Ricomincia da capo" -> "🔄 Начать заново"
-        buttons.append([{"text": "🔄 Начать заново", "callback_data": "restart_onboarding"}])
-        # Итальянский: "📞 Supporto" -> "📞 Поддержка"
-        buttons.append([{"text": "📞 Поддержка", "url": "https://t.me/liudmylazhyltsova"}] )
-        await self.send_message(telegram_id, text, {"inline_keyboard": buttons})
+        return await self._post("sendMessage", expired_goodbye_payload(telegram_id, stripe_url, paypal_url))
 
-@with_db_session
-async def manage_group_access(db): # <-- Принимает сессию db
-    """Проверяет истекшие подписки и отзывает доступ."""
-    telegram_service = TelegramService()
-    expired_subs = db.query(Subscription).filter(
-        Subscription.expires_at < datetime.utcnow(),
-        Subscription.has_group_access.is_(True),
-        Subscription.status == "active"
-    ).all()
-    
-    for sub in expired_subs:
-        sub.has_group_access = False
-        sub.status = "expired"
-        db.add(sub)
-        await telegram_service.send_subscription_cancelled_notification(sub.telegram_id)
-
-    if expired_subs:
-        logger.info(f"Processed {len(expired_subs)} expired subscriptions")
-
-async def manage_group_access_loop(interval_seconds=3600):
-    """Бесконечный цикл для проверки истекших подписок."""
-    while True:
-        try:
-            await manage_group_access()
-        except Exception as e:
-            logger.error(f"Error in manage_group_access_loop: {e}", exc_info=True)
-        await asyncio.sleep(interval_seconds)
+# --- Готовые тела сообщений: их же кладём в telegram_outbox (см. database.enqueue_telegram) ---
+def expiry_warning_payload(telegram_id: int, days_left: int) -> dict:
+    # Итальянский: "⏰ <b>Il tuo abbonamento scade tra {days_left} giorni.</b>\n\nAssicurati che il pagamento automatico sia attivo per non perdere l’accesso."
+    # Русский: "⏰ <b>Ваша подписка истекает через {days_left} дней.</b>\n\nУбедитесь, что автоматический платеж активен, чтобы не потерять доступ."
+    text = (
+        f"⏰ <b>Ваша подписка истекает через {days_left} дня(ей).</b>\n\n"
+        "Убедитесь, что автоматический платеж активен, чтобы не потерять доступ."
+    )
+    reply_markup = {
+        "inline_keyboard": [
+            [{"text": "💳 Обновить способ оплаты", "callback_data": "update_payment_method"}],
+            [{"text": "📞 Поддержка", "url": "https://t.me/liudmylazhyltsova"}]
+        ]
+    }
+    return {"chat_id": telegram_id, "text": text, "parse_mode": "HTML", "reply_markup": reply_markup}
+
+def expired_goodbye_payload(telegram_id: int, stripe_url: str | None = None, paypal_url: str | None = None) -> dict:
+    # Итальянский: "🙏 <b>Grazie per essere stata con noi!</b>\n\nLa tua sottoscrizione è scaduta e l’accesso è stato revocato.\nPuoi tornare quando vuoi — usa i pulsanti sotto per rinnovare o ricominciare."
+    # Русский: "🙏 <b>Спасибо, что были с нами!</b>\n\nВаша подписка истекла, и доступ был отозван.\nВы можете вернуться в любое время — используйте кнопки ниже, чтобы продлить или начать заново."
+    text = (
+        "🙏 <b>Спасибо, что были с нами!</b>\n\n"
+        "Ваша подписка истекла, и доступ был отозван.\n"
+        "Вы можете вернуться в любое время — используйте кнопки ниже, чтобы продлить или начать заново."
+    )
+    buttons = []
+    # Итальянский: "🔁 Riattiva con Stripe" -> "🔁 Продлить через Stripe"
+    if stripe_url: buttons.append([{"text": "🔁 Продлить через Stripe", "url": stripe_url}])
+    # Итальянский: "🅿️ Riattiva con PayPal" -> "🅿️ Продлить через PayPal"
+    if paypal_url: buttons.append([{"text": "🅿️ Продлить через PayPal", "url": paypal_url}])
+    # Итальянский: "🔄 Ricomincia da capo" -> "🔄 Начать заново"
+    buttons.append([{"text": "🔄 Начать заново", "callback_data": "restart_onboarding"}])
+    # Итальянский: "📞 Supporto" -> "📞 Поддержка"
+    buttons.append([{"text": "📞 Поддержка", "url": "https://t.me/liudmylazhyltsova"}] )
+    return {"chat_id": telegram_id, "text": text, "parse_mode": "HTML", "reply_markup": {"inline_keyboard": buttons}}
+
+def cancelled_notification_payload(telegram_id: int) -> dict:
+    # Итальянский: "❌ <b>Il tuo abbonamento è stato annullato</b>\n\nL’accesso alla piattaforma è stato revocato.\n\nSe desideri riattivare l’abbonamento, usa il comando /start"
+    # Русский: "❌ <b>Ваша подписка была отменена</b>\n\nДоступ к платформе был отозван.\n\nЕсли вы хотите возобновить подписку, используйте команду /start"
+    text = (
+        "❌ <b>Ваша подписка была отменена</b>\n\n"
+        "Доступ к платформе был отозван.\n\n"
+        "Если вы хотите возобновить подписку, используйте команду /start"
+    )
+    return {"chat_id": telegram_id, "text": text, "parse_mode": "HTML"}
+
+def video_payload(chat_id: int, file_id: str | None, caption: str, reply_markup=None, parse_mode="HTML") -> tuple[str, dict]:
+    """(method, payload) для видео; без file_id — отправляем только текст подписи."""
+    if file_id:
+        payload = {"chat_id": chat_id, "video": file_id, "caption": caption, "parse_mode": parse_mode}
+        method = "sendVideo"
+    else:
+        payload = {"chat_id": chat_id, "text": caption, "parse_mode": parse_mode}
+        method = "sendMessage"
+    if reply_markup:
+        payload["reply_markup"] = reply_markup
+    return method, payload
 
 @with_db_session
 async def send_expiry_warnings(db): 
@@ -0,0 +1,164 @@
+# tests/bench_updates.py
+"""
+Сквозной бенчмарк обработки апдейтов: getUpdates -> Dispatcher -> хендлеры -> sendMessage.
+
+Поднимает локальный fake_telegram_api.py в том же процессе, направляет на него бота
+(TELEGRAM_API_BASE) и кладёт в очередь getUpdates N синтетических апдейтов. Бот работает
+в обычном режиме polling (poll_updates -> main.updates); апдейт считается обработанным,
+когда фейк получил все ответы бота.
+
+Сценарии:
+    text  — текст в личку без состояния (1 ответ, без БД)
+    start — /start нового пользователя (2 ответа, запись в БД)
+
+Запуск (нужна тестовая БД, как и для остальных тестов — main.py создаёт таблицы при импорте):
+    python tests/bench_updates.py --updates 1000
+    python tests/bench_updates.py --scenarios text --latency-ms 50 --rate-429 0.01
+"""
+import os
+import sys
+import math
+import time
+import asyncio
+import argparse
+
+# --- Настройка путей для импорта ---
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(ROOT_DIR, ".env"))
+except ImportError:
+    print("⚠️  dotenv не установлен, бенчмарк может не найти переменные окружения.")
+
+from fake_telegram_api import FakeTelegramAPI, make_message_update
+
+BENCH_TG_ID_BASE = 7_500_000_000   # диапазон telegram_id пользователей бенчмарка
+
+# сценарий -> (текст сообщения, ожидаемое число sendMessage на апдейт)
+SCENARIOS = {
+    "text": ("ciao", 1),
+    "start": ("/start", 2),
+}
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Перцентиль по методу nearest-rank."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(p / 100.0 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def cleanup_users():
+    from database import SessionLocal, User
+
+    db = SessionLocal()
+    try:
+        db.query(User).filter(User.telegram_id >= BENCH_TG_ID_BASE).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def run_scenario(fake: FakeTelegramAPI, scenario: str, n: int, user_base: int, timeout: float) -> dict:
+    """Кладёт n апдейтов разом и ждёт, пока бот ответит на все."""
+    text, per_update = SCENARIOS[scenario]
+    fake.calls.clear()
+    users = [user_base + i for i in range(n)]
+
+    pushed_at = time.time()
+    started = time.perf_counter()
+    fake.push_updates([make_message_update(uid, text) for uid in users])
+
+    expected = n * per_update
+    while len(fake.calls_for("sendMessage")) < expected and time.perf_counter() - started < timeout:
+        await asyncio.sleep(0.01)
+    wall = time.perf_counter() - started
+
+    # Латентность апдейта — от постановки в очередь до последнего ответа в этот чат
+    done_at: dict[int, float] = {}
+    responses: dict[int, int] = {}
+    for call in fake.calls_for("sendMessage"):
+        chat_id = int(call["params"]["chat_id"])
+        responses[chat_id] = responses.get(chat_id, 0) + 1
+        done_at[chat_id] = max(done_at.get(chat_id, 0.0), call["at"])
+    completed = [uid for uid in users if responses.get(uid, 0) >= per_update]
+    latencies_ms = [(done_at[uid] - pushed_at) * 1000 for uid in completed]
+
+    return {
+        "updates": n,
+        "completed": len(completed),
+        "updates_per_sec": round(len(completed) / wall, 2) if wall > 0 else 0.0,
+        "p50_ms": round(percentile(latencies_ms, 50), 2),
+        "p95_ms": round(percentile(latencies_ms, 95), 2),
+        "api_errors": sum(1 for c in fake.calls if c.get("status", 200) >= 400),
+    }
+
+
+async def run(args) -> dict:
+    fake = FakeTelegramAPI(args.latency_ms, args.jitter_ms, args.rate_429, seed=42)
+    base_url = await fake.start()
+    # Бот и TelegramService читают адрес API при импорте
+    os.environ["TELEGRAM_API_BASE"] = base_url
+    import main
+    from telegram_service import startup_http_session, close_http_session
+
+    from update_queue import poll_updates
+
+    await startup_http_session()
+    main.updates.start()
+    polling = asyncio.create_task(poll_updates(main.bot, main.updates, timeout=1, relax=args.relax))
+    report = {"latency_ms": args.latency_ms, "rate_429": args.rate_429, "results": {}}
+    try:
+        for idx, scenario in enumerate(args.scenarios):
+            user_base = BENCH_TG_ID_BASE + idx * 1_000_000
+            report["results"][scenario] = await run_scenario(fake, scenario, args.updates, user_base, args.timeout)
+    finally:
+        polling.cancel()
+        await asyncio.gather(polling, return_exceptions=True)
+        await main.updates.stop()
+        await main.bot.session.close()
+        await close_http_session()
+        await fake.stop()
+    return report
+
+
+def print_report(report: dict):
+    print(f"\nlatency={report['latency_ms']}ms, rate_429={report['rate_429']}")
+    print(f"{'scenario':10} {'updates':>8} {'done':>8} {'upd/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'api err':>8}")
+    for scenario, r in report["results"].items():
+        print(f"{scenario:10} {r['updates']:>8} {r['completed']:>8} {r['updates_per_sec']:>10} "
+              f"{r['p50_ms']:>10} {r['p95_ms']:>10} {r['api_errors']:>8}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="End-to-end update processing benchmark against a fake Bot API.")
+    parser.add_argument("--updates", type=int, default=500, help="Updates per scenario")
+    parser.add_argument("--scenarios", nargs="*", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--latency-ms", type=float, default=0, help="Fake API response latency")
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Share of 429 responses (0..1)")
+    parser.add_argument("--relax", type=float, default=0.0, help="Pause between getUpdates calls")
+    parser.add_argument("--timeout", type=float, default=120, help="Max seconds per scenario")
+    args = parser.parse_args(argv)
+
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if "start" in args.scenarios:
+            cleanup_users()
+
+    print_report(report)
+    incomplete = [s for s, r in report["results"].items() if r["completed"] < r["updates"]]
+    if incomplete:
+        print(f"\n❌ Не все апдейты обработаны: {', '.join(incomplete)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+# tests/bench_webhooks.py
+"""
+Нагрузочный бенчмарк вебхуков /webhook/stripe и /webhook/paypal.
+
+- Stripe-события подписываются настоящим STRIPE_WEBHOOK_SECRET (как это делает Stripe),
+  поэтому проходят через реальный verify_stripe_webhook.
+- Проверка PayPal подменяется локальным фейком (HMAC по телу), без похода в PayPal API.
+- Отправка сообщений в Telegram подменяется заглушкой, чтобы не трогать api.telegram.org.
+
+Запуск (нужна тестовая БД, как и для остальных тестов):
+    python tests/bench_webhooks.py --requests 500 --concurrency 8
+    python tests/bench_webhooks.py --save-baseline tests/bench_baseline.json
+    python tests/bench_webhooks.py --baseline tests/bench_baseline.json --tolerance 0.2
+"""
+import os
+import sys
+import json
+import time
+import hmac
+import hashlib
+import math
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+# --- Настройка путей для импорта ---
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(ROOT_DIR, ".env"))
+except ImportError:
+    print("⚠️  dotenv не установлен, бенчмарк может не найти переменные окружения.")
+
+BENCH_TG_ID_BASE = 7_000_000_000   # диапазон telegram_id, который занимают фикстуры бенчмарка
+FAKE_PAYPAL_SECRET = b"bench-paypal-secret"
+DEFAULT_BASELINE = os.path.join(ROOT_DIR, "tests", "bench_baseline.json")
+
+
+# =========================
+# Подписи
+# =========================
+def sign_stripe_payload(payload: bytes, secret: str, timestamp: int | None = None) -> str:
+    """
+    Формирует заголовок Stripe-Signature так же, как это делает Stripe:
+    t=<unix>,v1=HMAC_SHA256(secret, "<t>.<payload>").
+    """
+    ts = int(timestamp or time.time())
+    signed = f"{ts}.".encode() + payload
+    sig = hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+    return f"t={ts},v1={sig}"
+
+
+def sign_fake_paypal_payload(payload: bytes) -> dict:
+    """Заголовки для локального фейка проверки PayPal."""
+    return {
+        "PayPal-Transmission-Id": "bench",
+        "PayPal-Transmission-Sig": hmac.new(FAKE_PAYPAL_SECRET, payload, hashlib.sha256).hexdigest(),
+    }
+
+
+def fake_verify_paypal_webhook(headers, body) -> bool:
+    """Локальная замена verify_paypal_webhook: сверяет HMAC тела, без сетевых вызовов."""
+    if isinstance(body, str):
+        body = body.encode()
+    expected = hmac.new(FAKE_PAYPAL_SECRET, body or b"", hashlib.sha256).hexdigest()
+    received = headers.get("PayPal-Transmission-Sig") or ""
+    return hmac.compare_digest(expected, received)
+
+
+async def _fake_telegram_post(self, method: str, json: dict):
+    return {"ok": True, "result": {}}
+
+
+# =========================
+# Фикстуры в БД
+# =========================
+def create_fixtures(n: int) -> list[dict]:
+    """
+    Создаёт n пользователей с pending-подписками для Stripe и PayPal.
+    Каждое событие бенчмарка работает со своей записью, чтобы не мерить гонки за одну строку.
+    """
+    from database import SessionLocal, create_tables, User, Subscription
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        cleanup_fixtures(db)
+        fixtures = []
+        for i in range(n):
+            user = User(telegram_id=BENCH_TG_ID_BASE + i, username=f"bench_{i}")
+            db.add(user)
+            db.flush()
+            for system in ("stripe", "paypal"):
+                db.add(Subscription(
+                    user_id=user.id,
+                    telegram_id=user.telegram_id,
+                    payment_system=system,
+                    subscription_id=f"bench_{system}_sub_{i}",
+                    order_id=f"bench_{system}_order_{i}",
+                    amount=10.0,
+                    status="pending",
+                ))
+            fixtures.append({"i": i, "user_id": user.id})
+        db.commit()
+        return fixtures
+    finally:
+        db.close()
+
+
+def cleanup_fixtures(db=None):
+    from database import SessionLocal, User
+
+    own = db is None
+    db = db or SessionLocal()
+    try:
+        db.query(User).filter(User.telegram_id >= BENCH_TG_ID_BASE).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        if own:
+            db.close()
+
+
+# =========================
+# Сценарии (типы событий)
+# =========================
+def _stripe_event(event_type: str, obj: dict, i: int) -> dict:
+    return {"id": f"evt_bench_{i}", "object": "event", "type": event_type, "data": {"object": obj}}
+
+
+def build_requests(event_type: str, fixtures: list[dict], secret: str) -> list[tuple[str, bytes, dict]]:
+    """Возвращает список (url, body, headers) для одного типа события."""
+    out = []
+    for f in fixtures:
+        i, user_id = f["i"], f["user_id"]
+        if event_type == "stripe:checkout.session.completed":
+            obj = {
+                "id": f"bench_stripe_order_{i}", "object": "checkout.session",
+                "subscription": f"bench_stripe_sub_{i}", "metadata": {"user_id": str(user_id)},
+                "amount_total": 1000, "currency": "eur",
+            }
+            url, body = "/webhook/stripe", _stripe_event("checkout.session.completed", obj, i)
+        elif event_type == "stripe:customer.subscription.deleted":
+            url, body = "/webhook/stripe", _stripe_event("customer.subscription.deleted", {"id": f"bench_stripe_sub_{i}"}, i)
+        elif event_type == "stripe:invoice.payment_succeeded":
+            # Событие, которое мы не обрабатываем: меряет чистую стоимость подписи и разбора
+            url, body = "/webhook/stripe", _stripe_event("invoice.payment_succeeded", {"subscription": f"bench_stripe_sub_{i}"}, i)
+        elif event_type == "paypal:BILLING.SUBSCRIPTION.ACTIVATED":
+            url, body = "/webhook/paypal", {
+                "event_type": "BILLING.SUBSCRIPTION.ACTIVATED",
+                "resource": {"id": f"bench_paypal_order_{i}", "custom_id": str(user_id)},
+            }
+        elif event_type == "paypal:BILLING.SUBSCRIPTION.CANCELLED":
+            url, body = "/webhook/paypal", {
+                "event_type": "BILLING.SUBSCRIPTION.CANCELLED",
+                "resource": {"id": f"bench_paypal_sub_{i}"},
+            }
+        else:
+            raise ValueError(f"unknown event type: {event_type}")
+
+        raw = json.dumps(body).encode()
+        headers = {"Content-Type": "application/json"}
+        if url == "/webhook/stripe":
+            headers["Stripe-Signature"] = sign_stripe_payload(raw, secret)
+        else:
+            headers.update(sign_fake_paypal_payload(raw))
+        out.append((url, raw, headers))
+    return out
+
+
+# Порядок важен: сначала активация, потом отмена тех же записей
+EVENT_TYPES = [
+    "stripe:checkout.session.completed",
+    "stripe:invoice.payment_succeeded",
+    "stripe:customer.subscription.deleted",
+    "paypal:BILLING.SUBSCRIPTION.ACTIVATED",
+    "paypal:BILLING.SUBSCRIPTION.CANCELLED",
+]
+
+
+# =========================
+# Прогон и статистика
+# =========================
+def percentile(values: list[float], p: float) -> float:
+    """Перцентиль по методу nearest-rank."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(p / 100.0 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def run_phase(app, requests_: list, concurrency: int) -> dict:
+    """Гоняет запросы одного типа с фиксированной конкурентностью."""
+    local = threading.local()
+
+    def one(req):
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        url, body, headers = req
+        t0 = time.perf_counter()
+        resp = local.client.post(url, data=body, headers=headers)
+        return time.perf_counter() - t0, resp.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, requests_))
+    wall = time.perf_counter() - started
+
+    latencies_ms = [lat * 1000 for lat, _ in results]
+    errors = sum(1 for _, status in results if status >= 400)
+    return {
+        "requests": len(results),
+        "errors": errors,
+        "throughput_rps": round(len(results) / wall, 2) if wall > 0 else 0.0,
+        "p50_ms": round(percentile(latencies_ms, 50), 2),
+        "p95_ms": round(percentile(latencies_ms, 95), 2),
+        "p99_ms": round(percentile(latencies_ms, 99), 2),
+    }
+
+
+def compare_with_baseline(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Регрессия: throughput упал или p95/p99 выросли больше, чем на tolerance (доля).
+    """
+    problems = []
+    for event_type, cur in report["results"].items():
+        base = baseline.get("results", {}).get(event_type)
+        if not base:
+            continue
+        if base["throughput_rps"] and cur["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            problems.append(f"{event_type}: throughput {cur['throughput_rps']} < baseline {base['throughput_rps']}")
+        for key in ("p95_ms", "p99_ms"):
+            if base[key] and cur[key] > base[key] * (1 + tolerance):
+                problems.append(f"{event_type}: {key} {cur[key]} > baseline {base[key]}")
+        if cur["errors"] > base.get("errors", 0):
+            problems.append(f"{event_type}: errors {cur['errors']} > baseline {base.get('errors', 0)}")
+    return problems
+
+
+def print_report(report: dict):
+    print(f"\nconcurrency={report['concurrency']}, requests/type={report['requests_per_type']}")
+    print(f"{'event type':42} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'err':>5}")
+    for event_type, r in report["results"].items():
+        print(f"{event_type:42} {r['throughput_rps']:>9} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} {r['errors']:>5}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark Stripe/PayPal webhook ingestion.")
+    parser.add_argument("--requests", type=int, default=300, help="Requests per event type")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--events", nargs="*", default=EVENT_TYPES, help="Event types to run")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, help="Save results as baseline JSON")
+    parser.add_argument("--baseline", nargs="?", const=DEFAULT_BASELINE, help="Compare with baseline JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    from payment_config import STRIPE_WEBHOOK_SECRET
+    import webhook
+
+    fixtures = create_fixtures(args.requests)
+    report = {"concurrency": args.concurrency, "requests_per_type": args.requests, "results": {}}
+    try:
+        with patch("webhook.verify_paypal_webhook", fake_verify_paypal_webhook), \
+             patch("telegram_service.TelegramService._post", _fake_telegram_post):
+            for event_type in args.events:
+                reqs = build_requests(event_type, fixtures, STRIPE_WEBHOOK_SECRET)
+                report["results"][event_type] = run_phase(webhook.app, reqs, args.concurrency)
+    finally:
+        cleanup_fixtures()
+
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"\n💾 Baseline сохранён: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        problems = compare_with_baseline(report, baseline, args.tolerance)
+        if problems:
+            print("\n❌ Обнаружена регрессия:")
+            for p in problems:
+                print(f"  - {p}")
+            return 1
+        print(f"\n✅ Регрессий нет (допуск {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -142,3 +142,18 @@ def test_paypal_webhook_cancelled(mock_send_notification, mock_verify, client, d
     db_session.refresh(sub)
     assert sub.status == "cancelled"
     mock_send_notification.assert_called_once()
+
+# === Подписанные фикстуры бенчмарка ===
+
+def test_bench_stripe_signature_is_accepted():
+    """Тест [Stripe]: подпись из bench_webhooks проходит настоящую проверку verify_stripe_webhook."""
+    from bench_webhooks import sign_stripe_payload
+    from payment_config import STRIPE_WEBHOOK_SECRET
+    from payment_service import verify_stripe_webhook
+
+    raw = json.dumps(stripe_invoice_paid).encode()
+    event = verify_stripe_webhook(raw, sign_stripe_payload(raw, STRIPE_WEBHOOK_SECRET))
+    assert event is not None
+    assert event["type"] == "invoice.payment_succeeded"
+
+    assert verify_stripe_webhook(raw, sign_stripe_payload(raw, "whsec_wrong")) is None
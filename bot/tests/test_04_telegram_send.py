@@ -0,0 +1,95 @@
+# tests/test_04_telegram_send.py
+import asyncio
+import time
+
+from telegram_service import TokenBucket, SendEngine
+
+CHAT_ID = 123456789
+
+
+def test_token_bucket_spends_burst_then_waits():
+    """Unit-тест: после исчерпания ёмкости bucket требует ждать 1/rate на каждый токен."""
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    wait = bucket.reserve()
+    assert 0.05 < wait <= 0.1
+
+
+def test_token_bucket_pause():
+    """Unit-тест: pause(retry_after) блокирует bucket минимум на retry_after секунд."""
+    bucket = TokenBucket(rate=1, capacity=5)
+    bucket.pause(2)
+    assert bucket.reserve() >= 2.0
+
+
+def test_send_engine_retries_after_429():
+    """Unit-тест: на 429 движок ждёт retry_after и повторяет запрос."""
+    calls = []
+
+    async def fake_request(method, payload):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            return 429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 0.2}}
+        return 200, {"ok": True, "result": {"message_id": 1}}
+
+    engine = SendEngine(global_rate=1000, chat_rate=1000, chat_burst=10, max_retries=2)
+    result = asyncio.run(engine.send(fake_request, "sendMessage", {"chat_id": CHAT_ID, "text": "hi"}))
+
+    assert result["ok"] is True
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.19
+    stats = engine.stats()
+    assert stats["retried_429"] == 1
+    assert stats["sent"] == 1
+
+
+def test_send_engine_drops_after_max_retries():
+    """Unit-тест: после max_retries повторов сообщение считается dropped."""
+    async def always_429(method, payload):
+        return 429, {"ok": False, "parameters": {"retry_after": 0.01}}
+
+    engine = SendEngine(global_rate=1000, chat_rate=1000, chat_burst=10, max_retries=1)
+    result = asyncio.run(engine.send(always_429, "sendMessage", {"chat_id": CHAT_ID, "text": "hi"}))
+
+    assert result is None
+    assert engine.stats()["dropped"] == 1
+
+
+def test_send_engine_per_chat_limit():
+    """Unit-тест: в один чат уходит не больше chat_rate сообщений в секунду сверх burst."""
+    async def ok(method, payload):
+        return 200, {"ok": True}
+
+    async def run():
+        engine = SendEngine(global_rate=1000, chat_rate=10, chat_burst=1)
+        started = time.monotonic()
+        await asyncio.gather(*(engine.send(ok, "sendMessage", {"chat_id": CHAT_ID}) for _ in range(4)))
+        return time.monotonic() - started, engine.stats()
+
+    elapsed, stats = asyncio.run(run())
+    assert elapsed >= 0.29          # 1 сразу + 3 по 0.1 с
+    assert stats["throttle_waits"] == 3
+
+
+def test_send_engine_submit_fire_and_forget():
+    """Unit-тест: submit() ставит запрос в очередь, воркер его отправляет."""
+    sent = []
+
+    async def ok(method, payload):
+        sent.append(payload["chat_id"])
+        return 200, {"ok": True}
+
+    async def run():
+        engine = SendEngine(global_rate=1000, chat_rate=1000, chat_burst=10, workers=2)
+        assert engine.submit(ok, "sendMessage", {"chat_id": 1}) is True
+        assert engine.submit(ok, "sendMessage", {"chat_id": 2}) is True
+        for _ in range(50):
+            if len(sent) == 2:
+                break
+            await asyncio.sleep(0.01)
+        return engine.stats()
+
+    stats = asyncio.run(run())
+    assert sorted(sent) == [1, 2]
+    assert stats["queue_depth"] == 0
@@ -0,0 +1,25 @@
+# tests/test_05_tasks.py
+import asyncio
+
+from tasks import _fan_out
+
+
+def test_fan_out_respects_limit_and_collects_results():
+    """Unit-тест: не больше limit задач одновременно, ошибки одной задачи не ломают остальные."""
+    running = 0
+    peak = 0
+
+    async def worker(i):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        if i == 3:
+            raise RuntimeError("boom")
+        return i % 2 == 0
+
+    result = asyncio.run(_fan_out("test", list(range(10)), worker, limit=3))
+
+    assert peak == 3
+    assert result == {"candidates": 10, "ok": 5, "failed": 5}
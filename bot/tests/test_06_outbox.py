@@ -0,0 +1,78 @@
+# tests/test_06_outbox.py
+import asyncio
+from unittest.mock import patch
+
+from database import TelegramOutbox, enqueue_telegram
+import outbox
+
+TEST_TG_ID = 123456789
+
+
+def _enqueue(db_session, text="hi"):
+    row = enqueue_telegram(db_session, {"chat_id": TEST_TG_ID, "text": text})
+    db_session.commit()
+    return row.id
+
+
+def test_outbox_marks_sent_exactly_once(db_session):
+    """Тест: успешная отправка переводит строку в 'sent', повторный drain её не трогает."""
+    row_id = _enqueue(db_session)
+
+    async def ok(ts, row):
+        return True, None, False
+
+    with patch("outbox._send_row", ok):
+        assert asyncio.run(outbox.drain_once()) == 1
+        assert asyncio.run(outbox.drain_once()) == 0
+
+    db_session.expire_all()
+    row = db_session.get(TelegramOutbox, row_id)
+    assert row.status == "sent"
+    assert row.attempts == 1
+    assert row.sent_at is not None
+
+
+def test_outbox_backoff_and_dead_letter(db_session):
+    """Тест: временная ошибка -> pending с backoff; постоянная (403) -> dead."""
+    retry_id = _enqueue(db_session, "retry")
+    dead_id = _enqueue(db_session, "dead")
+
+    async def fail(ts, row):
+        permanent = row["payload"]["text"] == "dead"
+        return False, "403: bot was blocked" if permanent else "500: oops", permanent
+
+    with patch("outbox._send_row", fail):
+        assert asyncio.run(outbox.drain_once()) == 2
+
+    db_session.expire_all()
+    retry = db_session.get(TelegramOutbox, retry_id)
+    dead = db_session.get(TelegramOutbox, dead_id)
+    assert retry.status == "pending"
+    assert retry.next_attempt_at > retry.created_at
+    assert dead.status == "dead"
+    assert "403" in dead.last_error
+
+
+def test_outbox_keeps_order_within_chat():
+    """Unit-тест: строки одного чата уходят по очереди в порядке id, разные чаты — параллельно."""
+    rows = [
+        {"id": 3, "method": "sendMessage", "payload": {"chat_id": 1, "text": "second"}, "attempts": 1},
+        {"id": 2, "method": "sendMessage", "payload": {"chat_id": 2, "text": "other"}, "attempts": 1},
+        {"id": 1, "method": "sendMessage", "payload": {"chat_id": 1, "text": "first"}, "attempts": 1},
+    ]
+    events, marked = [], []
+
+    async def slow(ts, row):
+        events.append(("start", row["id"]))
+        await asyncio.sleep(0.01)
+        events.append(("end", row["id"]))
+        return True, None, False
+
+    with patch("outbox.claim_batch", return_value=rows), \
+            patch("outbox.mark_results", side_effect=lambda sent, failed: marked.append((sent, failed))), \
+            patch("outbox._send_row", slow):
+        assert asyncio.run(outbox.drain_once()) == 3
+
+    assert events.index(("end", 1)) < events.index(("start", 3))
+    assert events.index(("start", 2)) < events.index(("end", 1))
+    assert sorted(marked[0][0]) == [1, 2, 3] and marked[0][1] == []
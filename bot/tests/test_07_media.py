@@ -0,0 +1,107 @@
+# tests/test_07_media.py
+from unittest.mock import patch
+
+import media
+
+
+def test_env_defaults_parse_reviews_list_and_json():
+    """Unit-тест: VIDEO_REVIEWS понимается и как список через запятую, и как JSON-объект."""
+    with patch("media.VIDEO_REVIEWS", "id_a, id_b"), patch("media.VIDEO_PENDING_FILE_ID", "id_p"):
+        defaults = media._env_defaults()
+    assert defaults["review_1"] == "id_a"
+    assert defaults["review_2"] == "id_b"
+    assert defaults[media.PENDING_VIDEO] == "id_p"
+
+    with patch("media.VIDEO_REVIEWS", '{"review_1": "x", "review_2": "y"}'):
+        defaults = media._env_defaults()
+    assert defaults["review_1"] == "x"
+    assert defaults["review_2"] == "y"
+
+
+def test_env_defaults_keep_json_keys_and_scalars():
+    """Unit-тест: ключи JSON не перенумеровываются; JSON-скаляр — это file_id, а не ошибка."""
+    with patch("media.VIDEO_REVIEWS", '{"review_1": "a", "review_2": "b", "review_10": "c"}'):
+        defaults = media._env_defaults()
+    assert (defaults["review_1"], defaults["review_2"], defaults["review_10"]) == ("a", "b", "c")
+    assert "review_3" not in defaults
+
+    with patch("media.VIDEO_REVIEWS", '"id_only"'):
+        assert media._env_defaults()["review_1"] == "id_only"
+    with patch("media.VIDEO_REVIEWS", "123"):
+        assert media._env_defaults()["review_1"] == "123"
+
+
+def test_media_keys_natural_order():
+    """Unit-тест: review_2 идёт раньше review_10."""
+    file_ids = {f"review_{i}": f"id{i}" for i in (10, 2, 1)}
+    with patch.object(media, "_loaded", True), patch.dict(media._file_ids, file_ids, clear=True):
+        assert media.media_keys(media.REVIEW_PREFIX) == ["review_1", "review_2", "review_10"]
+
+
+def _send_reviews(file_ids, fail_methods=()):
+    import asyncio
+    import telegram_service
+    from telegram_service import TelegramService
+
+    calls = []
+
+    async def fake_post(self, method, payload):
+        calls.append((method, payload))
+        if method in fail_methods:
+            return None
+        return {"ok": True, "result": {}}
+
+    with patch.object(media, "_loaded", True), patch.dict(media._file_ids, file_ids, clear=True), \
+            patch.dict(media._local_paths, {}, clear=True), patch.dict(telegram_service._albums, clear=True), \
+            patch.object(TelegramService, "_post", fake_post):
+        sent = asyncio.run(TelegramService().send_video_album(1, media.REVIEW_PREFIX, "Recensione {n}", "n.{n}"))
+    return sent, calls
+
+
+def test_reviews_go_as_media_groups_of_ten():
+    """Unit-тест: 12 отзывов — два вызова sendMediaGroup (10 + 2) вместо двенадцати sendVideo."""
+    sent, calls = _send_reviews({f"review_{i}": f"id{i}" for i in range(1, 13)})
+    assert sent == 12
+    assert [(m, len(p["media"])) for m, p in calls] == [("sendMediaGroup", 10), ("sendMediaGroup", 2)]
+    assert calls[1][1]["media"][1] == {"type": "video", "media": "id12", "caption": "Recensione 12"}
+
+
+def test_failed_media_group_falls_back_per_item_then_text():
+    """Тест: альбом не ушёл — видео по одному; не ушедшее видео заменяется текстом."""
+    sent, calls = _send_reviews({"review_1": "id1", "review_2": "id2"}, fail_methods=("sendMediaGroup", "sendVideo"))
+    assert sent == 0
+    assert [m for m, _ in calls] == ["sendMediaGroup", "sendVideo", "sendMessage", "sendVideo", "sendMessage"]
+    assert calls[-1][1]["text"] == "n.2"
+
+
+def test_concurrent_sends_upload_once_and_drop_lock(tmp_path):
+    """Тест: три одновременных отправки без file_id — одна загрузка; lock ключа после неё не хранится."""
+    import asyncio
+    import telegram_service
+    from telegram_service import TelegramService
+
+    path = tmp_path / "intro.mp4"
+    path.write_bytes(b"video")
+    calls = []
+
+    async def fake_send(request, method, payload):
+        calls.append(payload.get("video"))   # у загрузки файл в форме, а не в payload
+        await asyncio.sleep(0.01)
+        return {"ok": True, "result": {"video": {"file_id": "uploaded"}}}
+
+    def register(key, file_id):
+        media._file_ids[key] = file_id
+
+    async def scenario():
+        service = TelegramService()
+        await asyncio.gather(*(service.send_video_asset(chat, "intro", "") for chat in (1, 2, 3)))
+        return dict(telegram_service._upload_locks.get(asyncio.get_running_loop()) or {})
+
+    with patch.object(media, "_loaded", True), patch.dict(media._file_ids, {}, clear=True), \
+            patch.dict(media._local_paths, {"intro": str(path)}, clear=True), \
+            patch.object(media, "register_file_id", register), \
+            patch.object(telegram_service.send_engine, "send", fake_send):
+        left = asyncio.run(scenario())
+
+    assert sorted(calls, key=str) == [None, "uploaded", "uploaded"]   # одна загрузка, две отправки по file_id
+    assert left == {}
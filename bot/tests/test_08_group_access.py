@@ -0,0 +1,143 @@
+# tests/test_08_group_access.py
+import asyncio
+
+from group_access import build_diff, fetch_membership, member_status
+
+GROUP_ID = -1001234567890
+
+
+def test_member_status_parsing():
+    """Unit-тест: restricted считается участником только при is_member=True, ошибка — None."""
+    assert member_status({"ok": True, "result": {"status": "member"}}) == "member"
+    assert member_status({"ok": True, "result": {"status": "restricted", "is_member": True}}) == "member"
+    assert member_status({"ok": True, "result": {"status": "restricted", "is_member": False}}) == "left"
+    assert member_status(None) is None
+
+
+def test_build_diff():
+    """Unit-тест: diff делит пользователей на лишних в группе, не вошедших и неизвестных."""
+    access = {1: True, 2: True, 3: False, 4: False, 5: True, 6: False}
+    statuses = {1: "member", 2: "left", 3: "member", 4: "kicked", 5: None, 6: "administrator"}
+
+    diff = build_diff(access, statuses)
+
+    assert diff["members_without_access"] == [3]   # админа (6) не трогаем
+    assert diff["subscribers_not_joined"] == [2]
+    assert diff["joined"] == [1]
+    assert diff["unknown"] == [5]
+    assert diff["checked"] == 6
+
+
+def test_fetch_membership_is_concurrent_and_bounded():
+    """Unit-тест: getChatMember идут параллельно, но не больше limit одновременно."""
+    running = 0
+    peak = 0
+
+    class FakeService:
+        async def get_chat_member(self, chat_id, user_id):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            if user_id == 7:
+                raise RuntimeError("network")
+            return {"ok": True, "result": {"status": "member" if user_id % 2 else "left"}}
+
+    statuses = asyncio.run(fetch_membership(FakeService(), GROUP_ID, list(range(20)), limit=5))
+
+    assert peak == 5
+    assert statuses[1] == "member"
+    assert statuses[2] == "left"
+    assert statuses[7] is None
+
+
+def _service_for(fake_base_url):
+    from telegram_service import TelegramService
+    ts = TelegramService()
+    ts.api_url = f"{fake_base_url}/bot123:test"
+    return ts
+
+
+def test_kick_from_group_bans_then_unbans():
+    """Тест: kick_from_group банит и сразу разбанивает (можно вернуться), повтор безопасен."""
+    from fake_telegram_api import FakeTelegramAPI
+    from telegram_service import with_http_session
+
+    async def run():
+        fake = FakeTelegramAPI()
+        ts = _service_for(await fake.start())
+        fake.set_member(GROUP_ID, 42)
+        try:
+            first = await ts.kick_from_group(42, GROUP_ID)
+            second = await ts.kick_from_group(42, GROUP_ID)
+            methods = [c["method"] for c in fake.calls]
+            return first, second, methods, fake._members[(GROUP_ID, 42)]
+        finally:
+            await fake.stop()
+
+    first, second, methods, status = asyncio.run(with_http_session(run()))
+
+    assert first["ok"] and second["ok"]
+    assert methods == ["banChatMember", "unbanChatMember"] * 2
+    assert status == "left"
+
+
+def test_kick_from_group_waits_retry_after():
+    """Тест: на 429 ждём retry_after и повторяем; на 400 — сразу ошибка без повторов."""
+    from fake_telegram_api import FakeTelegramAPI, _ApiError
+    from telegram_service import with_http_session, send_engine
+
+    def ban_owner(params):
+        raise _ApiError(400, "Bad Request: can't remove chat owner")
+
+    async def run():
+        fake = FakeTelegramAPI(rate_429=1.0, retry_after=0)
+        ts = _service_for(await fake.start())
+        try:
+            throttled = await ts.kick_from_group(42, GROUP_ID)
+            attempts = len(fake.calls_for("banChatMember"))
+            fake.rate_429 = 0.0
+            fake._methods["banchatmember"] = ban_owner
+            fake.calls.clear()
+            owner = await ts.kick_from_group(1, GROUP_ID)
+            return throttled, attempts, owner, len(fake.calls)
+        finally:
+            await fake.stop()
+
+    throttled, attempts, owner, owner_calls = asyncio.run(with_http_session(run()))
+
+    assert throttled == {"ok": False, "stage": "ban", "error": throttled["error"]}
+    assert throttled["error"].startswith("429")
+    # повторяет только send_engine: TG_MAX_RETRIES + 1 вызовов, а не ещё раз по TG_KICK_MAX_ATTEMPTS
+    assert attempts == send_engine.max_retries + 1
+    assert owner["ok"] is False and owner["error"].startswith("400")
+    assert owner_calls == 1
+
+
+def test_remove_from_group_records_results():
+    """Unit-тест: пачка с дублями, пропусками и ошибками даёт результат по каждому пользователю."""
+    from unittest.mock import patch
+    import group_access
+
+    recorded = []
+
+    class FakeService:
+        async def kick_from_group(self, telegram_id, group_id=None):
+            await asyncio.sleep(0.01)
+            if telegram_id == 3:
+                return {"ok": False, "stage": "ban", "error": "400: user is an administrator"}
+            return {"ok": True, "stage": None, "error": None}
+
+    def plan(ids, force):
+        return [tid for tid in ids if tid != 4], {4: "has_access"}
+
+    with patch("group_access._removal_plan", plan), \
+         patch("group_access._record_removed", recorded.extend):
+        results = asyncio.run(group_access.remove_from_group([1, 2, 2, 3, 4], GROUP_ID, ts=FakeService()))
+
+    assert results[1] == results[2] == {"result": "removed"}
+    assert results[3]["result"] == "failed" and results[3]["stage"] == "ban"
+    assert results[4] == {"result": "skipped", "reason": "has_access"}
+    assert sorted(recorded) == [1, 2]
+    assert group_access.summarize_removal(results) == {"removed": 2, "skipped": 1, "failed": 1}
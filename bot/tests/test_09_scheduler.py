@@ -0,0 +1,78 @@
+# tests/test_09_scheduler.py
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from scheduler import CronSchedule, Job, Scheduler, parse_schedule
+
+
+async def _noop():
+    return {"ok": 1}
+
+
+def test_parse_schedule_intervals_and_cron():
+    """Unit-тест: '15m'/'1d' — интервалы, остальное — cron-выражение."""
+    assert parse_schedule("15m") == timedelta(minutes=15)
+    assert parse_schedule("1d") == timedelta(days=1)
+    assert isinstance(parse_schedule("0 9 * * *"), CronSchedule)
+
+
+def test_cron_next_after():
+    """Unit-тест: ближайшее время срабатывания cron (день, шаги, дни недели)."""
+    daily = CronSchedule("0 9 * * *")
+    assert daily.next_after(datetime(2025, 1, 1, 8, 30)) == datetime(2025, 1, 1, 9, 0)
+    assert daily.next_after(datetime(2025, 1, 1, 9, 0)) == datetime(2025, 1, 2, 9, 0)
+
+    every_15 = CronSchedule("*/15 * * * *")
+    assert every_15.next_after(datetime(2025, 1, 1, 10, 7)) == datetime(2025, 1, 1, 10, 15)
+
+    mondays = CronSchedule("30 3 * * 1")          # 2025-01-01 — среда
+    assert mondays.next_after(datetime(2025, 1, 1)) == datetime(2025, 1, 6, 3, 30)
+
+
+def test_first_run_catches_up_missed_run():
+    """Unit-тест: после рестарта пропущенный запуск выполняется сразу, непропущенный — по расписанию."""
+    now = datetime(2025, 1, 2, 12, 0)
+    hourly = Job("hourly", _noop, "1h")
+    assert hourly.first_run(None, now) == now
+    assert hourly.first_run(now - timedelta(hours=3), now) == now
+    assert hourly.first_run(now - timedelta(minutes=20), now) == now + timedelta(minutes=40)
+
+    daily = Job("daily", _noop, "0 9 * * *")
+    assert daily.first_run(None, now) == datetime(2025, 1, 3, 9, 0)
+    assert daily.first_run(datetime(2025, 1, 1, 9, 0), now) == now      # сегодняшний 09:00 пропущен
+    assert daily.first_run(datetime(2025, 1, 2, 9, 0), now) == datetime(2025, 1, 3, 9, 0)
+
+
+def test_schedule_env_override():
+    """Unit-тест: JOB_SCHEDULE_<NAME> переопределяет расписание по умолчанию."""
+    with patch.dict("os.environ", {"JOB_SCHEDULE_NUDGE": "5m"}):
+        assert Job("nudge", _noop, "1h").schedule == timedelta(minutes=5)
+
+
+def test_run_job_timeout_and_overlap():
+    """Unit-тест: таймаут по max_runtime фиксируется, пока джоб идёт — повторный запуск не стартует."""
+    finished = []
+    calls = 0
+
+    async def slow():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.3)
+
+    job = Job("slow", slow, "1s", max_runtime=0.1)
+
+    async def run():
+        scheduler = Scheduler([job])
+        now = datetime.utcnow()
+        scheduler._start(job, now)
+        scheduler._start(job, now)           # перекрытие — пропускается
+        return await scheduler._running["slow"]
+
+    with patch("scheduler.claim_job", lambda name, max_runtime: True), \
+         patch("scheduler.finish_job", lambda name, status, *a, **kw: finished.append(status)):
+        status = asyncio.run(run())
+
+    assert status == "timeout"
+    assert finished == ["timeout"]
+    assert calls == 1
@@ -0,0 +1,149 @@
+# tests/test_10_leader.py
+import time
+import asyncio
+import threading
+from unittest.mock import patch
+
+import blocking
+import leader
+from leader import run_as_leader, lock_key
+
+
+class FakeLock:
+    """Блокировка в памяти: acquire_results — ответы try_acquire по очереди, held — ответ heartbeat."""
+    def __init__(self, acquire_results, held=True):
+        self.acquire_results = list(acquire_results)
+        self.held = held
+        self.events = []
+
+    def try_acquire(self):
+        result = self.acquire_results.pop(0) if self.acquire_results else True
+        self.events.append(("acquire", result))
+        return result
+
+    def still_held(self):
+        return self.held
+
+    def release(self):
+        self.events.append(("release",))
+
+    def close(self):
+        self.events.append(("close",))
+
+    def abandon(self):
+        self.events.append(("abandon",))
+
+
+def test_lock_key_is_stable():
+    """Unit-тест: ключ блокировки одинаков во всех процессах и различается по ролям."""
+    assert lock_key("scheduler") == lock_key("scheduler")
+    assert lock_key("scheduler") != lock_key("bot_polling")
+
+
+def test_follower_waits_then_runs_work():
+    """Unit-тест: пока блокировку держит другой процесс — ждём; получили — выполняем работу и отпускаем."""
+    lock = FakeLock([False, False, True])
+
+    async def work():
+        return "done"
+
+    with patch.object(leader, "LEADER_ELECTION", True):
+        result = asyncio.run(run_as_leader("test", work, heartbeat=0.05, retry=0.01, lock=lock))
+
+    assert result == "done"
+    assert lock.events == [("acquire", False), ("acquire", False), ("acquire", True), ("release",)]
+
+
+def test_lost_leadership_cancels_work_and_fails_over():
+    """Unit-тест: heartbeat не подтвердил блокировку — работа отменяется, процесс снова кандидат."""
+    lock = FakeLock([True, True], held=False)
+    runs = []
+
+    async def work():
+        runs.append(len(runs))
+        if len(runs) == 1:
+            await asyncio.sleep(10)      # «вечная» работа первого срока — её должны отменить
+        return "second term"
+
+    with patch.object(leader, "LEADER_ELECTION", True):
+        result = asyncio.run(run_as_leader("test", work, heartbeat=0.05, retry=0.01, lock=lock))
+
+    assert result == "second term"
+    assert runs == [0, 1]
+    assert ("close",) in lock.events
+    assert leader.leadership_status()["test"] is False
+
+
+def test_heartbeat_does_not_queue_behind_blocking_pool(monkeypatch):
+    """Тест: пул blocking забит медленными вызовами — heartbeat всё равно укладывается в LEADER_DB_TIMEOUT."""
+    monkeypatch.setattr(blocking, "BLOCKING_WORKERS", 1)
+    monkeypatch.setattr(leader, "LEADER_DB_TIMEOUT", 0.2)
+    blocking.shutdown_executor()
+    lock = FakeLock([True])
+    terms = []
+
+    async def work():
+        terms.append(len(terms))
+        if len(terms) > 1:
+            return "lost"                # лидерство отняли — второй срок сразу завершаем
+        busy = [asyncio.create_task(blocking.run_blocking(time.sleep, 0.3, timeout=None)) for _ in range(3)]
+        await asyncio.sleep(0.35)        # несколько heartbeat'ов, пока пул занят
+        await asyncio.gather(*busy)
+        return "kept"
+
+    try:
+        with patch.object(leader, "LEADER_ELECTION", True):
+            result = asyncio.run(run_as_leader("test", work, heartbeat=0.05, retry=0.01, lock=lock))
+    finally:
+        blocking.shutdown_executor()
+
+    assert result == "kept"
+    assert lock.events == [("acquire", True), ("release",)]
+
+
+class SlowConnection:
+    """Соединение, у которого pg_try_advisory_lock отвечает (успехом) только после gate."""
+    def __init__(self, gate):
+        self.gate = gate
+        self.invalidated = False
+
+    def execute(self, *args, **kwargs):
+        self.gate.wait(2)
+        return type("Result", (), {"scalar": lambda _: True})()
+
+    def commit(self):
+        pass
+
+    def invalidate(self):
+        self.invalidated = True
+
+    def close(self):
+        pass
+
+
+def test_acquire_abandoned_by_timeout_closes_its_connection(monkeypatch):
+    """Тест: блокировку взяли уже после таймаута — соединение закрывается, а не остаётся лидеру-призраку."""
+    monkeypatch.setattr(leader, "LEADER_DB_TIMEOUT", 0.05)
+    gate = threading.Event()
+    conns = [SlowConnection(gate), SlowConnection(gate)]
+    monkeypatch.setattr(leader, "engine", type("Engine", (), {"connect": lambda _: conns.pop(0)})())
+    first, second = conns
+    lock = leader.LeaderLock("test")
+
+    async def scenario():
+        try:
+            await leader._db_call(lock, lock.try_acquire)
+        except asyncio.TimeoutError:
+            pass
+        else:
+            raise AssertionError("expected timeout")
+        gate.set()                                  # брошенный запрос всё-таки взял блокировку
+        for _ in range(100):
+            if first.invalidated:
+                break
+            await asyncio.sleep(0.01)
+        return await leader._db_call(lock, lock.try_acquire)
+
+    assert asyncio.run(scenario()) is True
+    assert first.invalidated                        # брошенный вызов закрыл своё соединение
+    assert lock._conn is second and not second.invalidated
@@ -0,0 +1,46 @@
+# tests/test_11_pay_links.py
+from unittest.mock import patch
+
+import pytest
+
+import pay_links
+from pay_links import make_pay_token, load_pay_token, PayLinkError
+
+
+def test_pay_token_roundtrip_and_tampering():
+    """Unit-тест: токен восстанавливает user_id и провайдера, подделка отклоняется."""
+    token = make_pay_token(42, "paypal")
+    assert load_pay_token(token) == (42, "paypal")
+
+    with pytest.raises(PayLinkError) as exc:
+        load_pay_token(token[:-2] + ("AA" if not token.endswith("AA") else "BB"))
+    assert exc.value.expired is False
+
+
+def test_pay_link_requires_public_base_url():
+    """Unit-тест: без PUBLIC_BASE_URL ленивые ссылки выключены."""
+    with patch.object(pay_links, "PUBLIC_BASE_URL", ""):
+        assert pay_links.make_pay_link(1, "stripe") is None
+    with patch.object(pay_links, "PUBLIC_BASE_URL", "https://bot.example.com"):
+        assert pay_links.make_pay_link(1, "stripe").startswith("https://bot.example.com/pay/")
+
+
+def test_pay_route_creates_session_only_on_open(client):
+    """Тест: /pay/<token> создаёт платёж при открытии и редиректит к провайдеру."""
+    token = make_pay_token(7, "stripe")
+    with patch("webhook.open_payment", return_value={"success": True, "url": "https://checkout.stripe.com/c/x"}) as op:
+        resp = client.get(f"/pay/{token}")
+
+    assert resp.status_code == 302
+    assert resp.headers["Location"] == "https://checkout.stripe.com/c/x"
+    op.assert_called_once_with(7, "stripe")
+
+
+def test_pay_route_rejects_bad_and_expired_tokens(client):
+    """Тест: неверная подпись — 400, устаревшая ссылка — 410, провайдер не вызывается."""
+    token = make_pay_token(7, "paypal")
+    with patch("webhook.open_payment") as op:
+        assert client.get("/pay/not-a-token").status_code == 400
+        with patch.object(pay_links, "PAY_LINK_MAX_AGE_DAYS", -1):
+            assert client.get(f"/pay/{token}").status_code == 410
+    op.assert_not_called()
@@ -0,0 +1,113 @@
+# tests/test_12_expiry.py
+import json
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+from sqlalchemy.dialects import postgresql
+
+import tasks
+from database import expire_subscriptions
+from expiry import ExpiryEngine
+
+
+def test_expire_subscriptions_is_single_set_based_statement():
+    """Unit-тест: пачка истекает одним WITH ... FOR UPDATE SKIP LOCKED / UPDATE ... RETURNING."""
+    db = MagicMock()
+    expire_subscriptions(db, limit=100)
+
+    assert db.execute.call_count == 1
+    sql = str(db.execute.call_args[0][0].compile(dialect=postgresql.dialect()))
+    assert sql.startswith("WITH due AS")
+    assert "FOR UPDATE SKIP LOCKED" in sql
+    assert "LIMIT" in sql
+    assert "UPDATE subscriptions SET" in sql
+    assert "RETURNING subscriptions.id, subscriptions.telegram_id, subscriptions.user_id" in sql
+    db.commit.assert_not_called()
+
+
+def test_deactivate_expired_loops_until_short_batch():
+    """Unit-тест: пачки забираются, пока не придёт неполная; истёкшие уходят на удаление из группы."""
+    batches = [[(1, 11, 101), (2, 12, 102)], [(3, 13, 103)]]
+    removed = []
+
+    async def fake_remove(ids):
+        removed.extend(ids)
+        return {tid: {"result": "removed"} for tid in ids}
+
+    with patch("tasks.EXPIRE_BATCH_SIZE", 2), patch("tasks.DRY_RUN", False), \
+         patch("tasks.lazy_links_enabled", return_value=True), \
+         patch("tasks._expire_chunk", side_effect=lambda now, lazy, ids: batches.pop(0)) as chunk, \
+         patch("tasks.pending_removals", return_value=[]), \
+         patch("tasks.remove_from_group", side_effect=fake_remove):
+        result = asyncio.run(tasks.expire_due_subscriptions())
+
+    assert chunk.call_count == 2
+    assert result["candidates"] == 3 and result["ok"] == 3 and result["failed"] == 0
+    assert removed == [11, 12, 13]
+    assert result["group"] == {"removed": 3, "skipped": 0, "failed": 0}
+
+
+def test_goodbye_is_enqueued_in_expiry_transaction_without_lazy_links():
+    """Unit-тест: без PUBLIC_BASE_URL goodbye всё равно пишется до commit (без ссылок провайдеров)."""
+    db = MagicMock()
+    events = []
+    db.commit.side_effect = lambda: events.append("commit")
+
+    with patch("tasks.SessionLocal", return_value=db), \
+         patch("tasks.lazy_links_enabled", return_value=False), \
+         patch("tasks.expire_subscriptions", return_value=[(1, 11, 101), (2, 12, 102)]), \
+         patch("tasks.enqueue_telegram", side_effect=lambda db, payload: events.append(payload)), \
+         patch("tasks._payment_links") as provider_links:
+        rows = tasks._expire_chunk(datetime(2026, 1, 1), True)
+
+    assert len(rows) == 2
+    assert [e if e == "commit" else e["chat_id"] for e in events] == [11, 12, "commit"]
+    buttons = [b for row in events[0]["reply_markup"]["inline_keyboard"] for b in row]
+    assert not any("url" in b and "t.me" not in b["url"] for b in buttons)
+    provider_links.assert_not_called()
+
+
+def test_engine_heap_skips_stale_entries_and_horizon():
+    """Unit-тест: продление/отмена делают старую запись кучи недействительной; за горизонтом — не держим."""
+    now = datetime(2026, 1, 1, 12, 0)
+    engine = ExpiryEngine(horizon_hours=24, listen=False)
+    engine.schedule(1, now + timedelta(minutes=5), now)
+    engine.schedule(2, now + timedelta(minutes=1), now)
+    engine.schedule(3, now + timedelta(days=3), now)
+    assert len(engine) == 2
+
+    # продление 2 (уведомление) и отмена 1
+    engine.handle_change(json.dumps({"id": 2, "status": "active", "expires_at": (now + timedelta(minutes=10)).isoformat()}))
+    engine.handle_change(json.dumps({"id": 1, "status": "cancelled", "expires_at": None}))
+    engine.handle_change("not json")
+
+    assert engine.pop_due(now + timedelta(minutes=6)) == []
+    assert engine.next_at() == now + timedelta(minutes=10)
+    assert engine.pop_due(now + timedelta(minutes=10)) == [2]
+    assert len(engine) == 0
+
+
+def test_engine_fires_at_expiry_time():
+    """Тест: движок спит до ближайшего expires_at и истекает ровно эти подписки."""
+    fired = []
+
+    async def expire(ids):
+        fired.append((ids, datetime.utcnow()))
+        return {"candidates": len(ids)}
+
+    async def scenario():
+        now = datetime.utcnow()
+        soon = now + timedelta(milliseconds=200)
+        rows = [(1, now - timedelta(minutes=1)), (2, soon), (3, now + timedelta(hours=2))]
+        engine = ExpiryEngine(expire=expire, listen=False)
+        with patch("expiry.load_upcoming", return_value=rows):
+            task = asyncio.create_task(engine.run())
+            await asyncio.sleep(0.5)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        return soon
+
+    soon = asyncio.run(scenario())
+    assert [ids for ids, _ in fired] == [[1], [2]]
+    assert fired[1][1] >= soon
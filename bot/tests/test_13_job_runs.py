@@ -0,0 +1,72 @@
+# tests/test_13_job_runs.py
+import asyncio
+from types import SimpleNamespace
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+
+from tasks import _fan_out
+from job_runs import record_job, count_api_call, JobMetrics, format_runs
+
+
+def test_record_job_counts_api_calls_across_tasks_and_threads():
+    """Unit-тест: api_calls считаются и в задачах _fan_out, и в to_thread; p95 — по элементам."""
+    saved = []
+
+    def blocking_call():
+        count_api_call()
+
+    async def worker(i):
+        count_api_call()
+        await asyncio.to_thread(blocking_call)
+        await asyncio.sleep(0.001 * i)
+        return True
+
+    @record_job("demo")
+    async def job():
+        return await _fan_out("demo", list(range(20)), worker, limit=5)
+
+    with patch("job_runs.save_run", side_effect=lambda *a: saved.append(a)):
+        result = asyncio.run(job())
+
+    assert result["candidates"] == 20 and result["ok"] == 20
+    assert result["api_calls"] == 40
+    assert result["p95_ms"] >= 15
+    job_name, _, _, status, _, metrics, error = saved[0]
+    assert (job_name, status, error) == ("demo", "ok", None)
+    assert metrics.api_calls == 40 and len(metrics.latencies) == 20
+
+
+def test_record_job_stores_failure_and_is_isolated():
+    """Unit-тест: упавший джоб пишется как failed; вне джоба счётчик никуда не пишет."""
+    saved = []
+
+    @record_job("broken")
+    async def job():
+        count_api_call()
+        raise RuntimeError("boom")
+
+    with patch("job_runs.save_run", side_effect=lambda *a: saved.append(a)):
+        with pytest.raises(RuntimeError):
+            asyncio.run(job())
+    count_api_call()   # вне джоба — без ошибок
+
+    _, _, _, status, _, metrics, error = saved[0]
+    assert status == "failed" and "boom" in error
+    assert metrics.api_calls == 1
+
+
+def test_p95_and_format_runs():
+    """Unit-тест: p95 nearest-rank и текст для /jobs."""
+    metrics = JobMetrics()
+    for ms in range(1, 101):
+        metrics.observe(ms / 1000)
+    assert metrics.p95_ms() == 95.0
+    assert JobMetrics().p95_ms() is None
+
+    run = SimpleNamespace(status="ok", job_name="warn_expiring", started_at=datetime(2026, 1, 2, 9, 0),
+                          duration=3.25, ok=9, candidates=10, failed=1, api_calls=12, p95_ms=310.4)
+    text = format_runs([run])
+    assert "warn_expiring" in text and "9/10 (failed: 1)" in text and "p95: 310ms" in text
+    assert format_runs([]) == "Запусков джобов пока нет."
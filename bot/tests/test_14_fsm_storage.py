@@ -0,0 +1,141 @@
+# tests/test_14_fsm_storage.py
+import time
+import asyncio
+from unittest.mock import patch
+
+from fsm_storage import PostgresStorage, split_rows
+
+
+class FakeDB:
+    """Таблица fsm_state в памяти + счётчики обращений."""
+    def __init__(self):
+        self.rows = {}
+        self.loads = 0
+        self.saves = []
+
+    def load(self, chat_id, user_id):
+        self.loads += 1
+        state, data = self.rows.get((chat_id, user_id), (None, {}))
+        return state, dict(data)
+
+    def save(self, rows):
+        self.saves.append(len(rows))
+        for key, state, data in rows:
+            if state is None and not data:
+                self.rows.pop(key, None)
+            else:
+                self.rows[key] = (state, data)
+
+
+def _patched(fake):
+    return patch("fsm_storage.load_fsm_state", side_effect=fake.load), \
+        patch("fsm_storage.save_fsm_states", side_effect=fake.save)
+
+
+def test_update_data_is_batched_and_state_is_written_through():
+    """Unit-тест: ответы копятся и уходят одной пачкой; set_state пишется сразу; чтения — из кэша."""
+    fake = FakeDB()
+    load, save = _patched(fake)
+
+    async def scenario():
+        storage = PostgresStorage(flush_interval=0.05, flush_batch=1000)
+        await storage.set_state(chat=1, user=1, state="Onboarding:format")
+        assert fake.rows[(1, 1)] == ("Onboarding:format", {})
+
+        for uid in range(1, 51):
+            await storage.update_data(chat=uid, user=uid, data={"format": "online"}, level="base")
+        assert len(fake.saves) == 1                      # пока ничего не сброшено
+        assert await storage.get_data(chat=7, user=7) == {"format": "online", "level": "base"}
+
+        await asyncio.sleep(0.15)
+        assert fake.saves[1] == 50                       # один upsert на все ключи
+        assert fake.rows[(7, 7)] == (None, {"format": "online", "level": "base"})
+        assert await storage.get_state(chat=1, user=1) == "Onboarding:format"
+        assert fake.loads == 50                          # по одному чтению на ключ
+        await storage.close()
+
+    with load, save:
+        asyncio.run(scenario())
+
+
+def test_state_survives_new_storage_and_reset_deletes_row():
+    """Тест: новый экземпляр (рестарт) видит состояние; reset_state удаляет запись; close досбрасывает."""
+    fake = FakeDB()
+    load, save = _patched(fake)
+
+    async def scenario():
+        first = PostgresStorage(flush_interval=60)
+        await first.set_state(chat=5, user=5, state="Onboarding:goal")
+        await first.update_data(chat=5, user=5, goal="work")
+        await first.close()
+
+        second = PostgresStorage()
+        assert await second.get_state(chat=5, user=5) == "Onboarding:goal"
+        assert await second.get_data(chat=5, user=5) == {"goal": "work"}
+        await second.reset_state(chat=5, user=5)
+        assert (5, 5) not in fake.rows
+        assert await second.get_state(chat=5, user=5, default="none") == "none"
+
+    with load, save:
+        asyncio.run(scenario())
+
+
+def test_webhook_mode_workers_share_state_through_db():
+    """Тест: без кэша и write-behind два воркера видят шаги друг друга и не затирают ответы."""
+    fake = FakeDB()
+    load, save = _patched(fake)
+
+    async def scenario():
+        first = PostgresStorage(cache_seconds=0, write_behind=False)
+        second = PostgresStorage(cache_seconds=0, write_behind=False)
+        await first.set_state(chat=3, user=3, state="Onboarding:format")
+        await first.update_data(chat=3, user=3, format="online")
+        assert fake.rows[(3, 3)] == ("Onboarding:format", {"format": "online"})   # записано сразу
+
+        assert await second.get_state(chat=3, user=3) == "Onboarding:format"
+        await second.update_data(chat=3, user=3, level="base")
+        await second.set_state(chat=3, user=3, state="Onboarding:time")
+
+        assert await first.get_state(chat=3, user=3) == "Onboarding:time"
+        assert await first.get_data(chat=3, user=3) == {"format": "online", "level": "base"}
+        assert not first._cache and not second._cache
+
+    with load, save:
+        asyncio.run(scenario())
+
+
+def test_writes_of_different_chats_do_not_wait_for_each_other():
+    """Тест: медленный commit одного чата не задерживает запись другого; замки ключей не копятся."""
+    fake = FakeDB()
+    load, _ = _patched(fake)
+    finished = []
+
+    def save(rows):
+        if rows[0][0] == (1, 1):
+            time.sleep(0.3)                  # «медленный commit» первого чата
+        fake.save(rows)
+        finished.append(rows[0][0])
+
+    async def scenario():
+        storage = PostgresStorage(cache_seconds=0, write_behind=False)
+        started = time.perf_counter()
+        slow = asyncio.create_task(storage.set_state(chat=1, user=1, state="Onboarding:format"))
+        await asyncio.sleep(0.01)
+        await storage.set_state(chat=2, user=2, state="Onboarding:format")
+        fast_done = time.perf_counter() - started
+        await slow
+        assert not storage._key_locks
+        return fast_done
+
+    with load, patch("fsm_storage.save_fsm_states", side_effect=save):
+        fast_done = asyncio.run(scenario())
+
+    assert fast_done < 0.2
+    assert finished == [(2, 2), (1, 1)]
+
+
+def test_split_rows_deletes_empty_sessions():
+    """Unit-тест: пустое состояние не храним — удаляем строку."""
+    upserts, deletes = split_rows([((1, 1), None, {}), ((2, 2), "S", {}), ((3, 3), None, {"a": 1})])
+    assert deletes == [(1, 1)]
+    assert [(u["chat_id"], u["state"], u["data"]) for u in upserts] == [(2, "S", {}), (3, None, {"a": 1})]
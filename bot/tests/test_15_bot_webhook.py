@@ -0,0 +1,75 @@
+# tests/test_15_bot_webhook.py
+import asyncio
+import threading
+from unittest.mock import patch
+
+import webhook
+
+SECRET = "s3cr3t-token"
+UPDATE = {"update_id": 1001, "message": {"message_id": 1, "date": 0, "chat": {"id": 42, "type": "private"}, "text": "ciao"}}
+
+
+def _headers(secret=SECRET):
+    return {"X-Telegram-Bot-Api-Secret-Token": secret}
+
+
+def test_telegram_update_requires_secret_and_ready_bot(client):
+    """Тест: без верного секрета — 403; бот ещё не зарегистрировал обработчик — 503."""
+    with patch("webhook.TELEGRAM_WEBHOOK_SECRET", SECRET):
+        assert client.post(webhook.TELEGRAM_WEBHOOK_PATH, json=UPDATE).status_code == 403
+        assert client.post(webhook.TELEGRAM_WEBHOOK_PATH, json=UPDATE, headers=_headers("wrong")).status_code == 403
+
+        webhook.set_update_handler(None, None)
+        assert client.post(webhook.TELEGRAM_WEBHOOK_PATH, json=UPDATE, headers=_headers()).status_code == 503
+
+    with patch("webhook.TELEGRAM_WEBHOOK_SECRET", ""):
+        # секрет не задан — маршрут закрыт полностью
+        assert client.post(webhook.TELEGRAM_WEBHOOK_PATH, json=UPDATE, headers=_headers("")).status_code == 403
+
+
+def test_telegram_update_is_handed_to_bot_loop(client):
+    """Тест: апдейт уходит в event loop бота, ответ 200 сразу; мусор — 400."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    received = []
+    done = threading.Event()
+
+    async def handler(data):
+        received.append((data, threading.current_thread() is thread))
+        done.set()
+
+    try:
+        with patch("webhook.TELEGRAM_WEBHOOK_SECRET", SECRET):
+            webhook.set_update_handler(loop, handler)
+            assert client.post(webhook.TELEGRAM_WEBHOOK_PATH, json={"foo": 1}, headers=_headers()).status_code == 400
+            resp = client.post(webhook.TELEGRAM_WEBHOOK_PATH, json=UPDATE, headers=_headers())
+            assert resp.status_code == 200
+            assert done.wait(2)
+    finally:
+        webhook.set_update_handler(None, None)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(2)
+        loop.close()
+
+    assert received == [(UPDATE, True)]
+
+
+def test_telegram_update_full_queue_returns_503(client):
+    """Тест: очередь бота полна (обработчик вернул False) — 503, Telegram повторит доставку."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def handler(data):
+        return False
+
+    try:
+        with patch("webhook.TELEGRAM_WEBHOOK_SECRET", SECRET):
+            webhook.set_update_handler(loop, handler)
+            assert client.post(webhook.TELEGRAM_WEBHOOK_PATH, json=UPDATE, headers=_headers()).status_code == 503
+    finally:
+        webhook.set_update_handler(None, None)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(2)
+        loop.close()
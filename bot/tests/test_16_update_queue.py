@@ -0,0 +1,118 @@
+# tests/test_16_update_queue.py
+import asyncio
+from types import SimpleNamespace
+
+from update_queue import UpdateQueue, chat_key, is_group_noise
+
+
+def make_update(update_id: int, chat_id: int):
+    message = SimpleNamespace(chat=SimpleNamespace(id=chat_id))
+    return SimpleNamespace(update_id=update_id, message=message, edited_message=None,
+                           channel_post=None, edited_channel_post=None, callback_query=None)
+
+
+def test_chat_key_for_callback_without_message():
+    """Unit-тест: у callback без сообщения ключ — пользователь; у прочих апдейтов — update_id."""
+    update = make_update(1, 5)
+    update.message = None
+    update.callback_query = SimpleNamespace(message=None, from_user=SimpleNamespace(id=77))
+    assert chat_key(update) == 77
+    update.callback_query = None
+    assert chat_key(update) == 1
+
+
+def test_per_chat_order_and_slow_chat_does_not_block_others():
+    """Тест: внутри чата — строго по порядку и по одному; медленный чат не задерживает остальных."""
+    log = []
+    in_flight = {}
+
+    async def process(update):
+        chat = update.message.chat.id
+        in_flight[chat] = in_flight.get(chat, 0) + 1
+        assert in_flight[chat] == 1, "два апдейта одного чата одновременно"
+        await asyncio.sleep(0.3 if chat == 1 else 0.001)   # чат 1 — «медленный Stripe»
+        log.append((chat, update.update_id, asyncio.get_running_loop().time()))
+        in_flight[chat] -= 1
+
+    async def scenario():
+        queue = UpdateQueue(process, workers=2, max_pending=100)
+        queue.start()
+        started = asyncio.get_running_loop().time()
+        uid = 0
+        for _ in range(3):
+            for chat in (1, 2, 3, 4):
+                uid += 1
+                await queue.submit(make_update(uid, chat))
+        await queue.stop(timeout=5)
+        return started, queue.stats()
+
+    started, stats = asyncio.run(scenario())
+
+    for chat in (1, 2, 3, 4):
+        ids = [uid for c, uid, _ in log if c == chat]
+        assert ids == sorted(ids) and len(ids) == 3
+    # быстрые чаты закончили, пока медленный обрабатывал первый апдейт
+    fast_done = max(t for c, _, t in log if c != 1)
+    assert fast_done - started < 0.3
+    assert stats["processed"] == 12 and stats["failed"] == 0 and stats["pending"] == 0
+
+
+def test_bounded_queue_backpressure_and_rejection():
+    """Unit-тест: полная очередь — offer() отказывает, submit() ждёт, пока освободится место."""
+    release = None
+
+    async def process(update):
+        await release.wait()
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        queue = UpdateQueue(process, workers=1, max_pending=2)
+        queue.start()
+        assert queue.offer(make_update(1, 1)) and queue.offer(make_update(2, 2))
+        assert queue.offer(make_update(3, 3)) is False
+
+        waiter = asyncio.create_task(queue.submit(make_update(4, 4)))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        release.set()
+        await asyncio.wait_for(waiter, 1)
+        await queue.stop(timeout=1)
+        return queue.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["rejected"] == 1 and stats["backpressure_waits"] == 1
+    assert stats["processed"] == 3
+
+
+def test_group_noise_dropped_before_queue():
+    """Тест: болтовня в группе не попадает в очередь; /app в группе и личка — попадают."""
+    def message(update_id, chat_type, text):
+        update = make_update(update_id, update_id)
+        update.message.chat.type = chat_type
+        update.message.text = text
+        return update
+
+    assert is_group_noise(message(1, "supergroup", "ciao a tutte"))
+    assert is_group_noise(message(2, "group", None))                 # фото, стикер, вход в группу
+    assert is_group_noise(message(3, "supergroup", "/start"))
+    assert not is_group_noise(message(4, "supergroup", "/APP@ExpertLashBot"))
+    assert not is_group_noise(message(5, "private", "ciao"))
+
+    processed = []
+
+    async def process(update):
+        processed.append(update.update_id)
+
+    async def scenario():
+        queue = UpdateQueue(process, workers=1, max_pending=1, drop=is_group_noise)
+        queue.start()
+        assert queue.offer(message(1, "supergroup", "ciao a tutte"))    # места не занимает
+        await queue.submit(message(2, "group", "buongiorno"))
+        await queue.submit(message(4, "supergroup", "/app"))
+        await queue.stop(timeout=1)
+        return queue.stats()
+
+    stats = asyncio.run(scenario())
+    assert processed == [4]
+    assert stats["dropped"] == 2 and stats["received"] == 1 and stats["rejected"] == 0
@@ -0,0 +1,91 @@
+# tests/test_17_user_context.py
+import asyncio
+from types import SimpleNamespace
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+
+from database import UserRole
+from user_context import UserContextCache, UserContextMiddleware, is_admin
+
+USER = SimpleNamespace(id=7, telegram_id=700, role=UserRole.student)
+SUB = SimpleNamespace(id=1, status="active", order_id="ord-1")
+
+
+class FakeLoader:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, telegram_id):
+        self.calls.append(telegram_id)
+        return (USER, SUB) if telegram_id == 700 else (None, None)
+
+
+def make_message(telegram_id: int, chat_type: str = "private"):
+    return types.Message(**{
+        "message_id": 1, "date": 0, "text": "💳 Il mio abbonamento",
+        "from": {"id": telegram_id, "is_bot": False, "first_name": "Anna"},
+        "chat": {"id": telegram_id, "type": chat_type},
+    })
+
+
+def test_cache_hits_ttl_and_invalidate():
+    """Unit-тест: повторные апдейты — из кэша; invalidate и истёкший TTL — новое чтение."""
+    loader = FakeLoader()
+
+    async def scenario():
+        cache = UserContextCache(ttl=0.1, loader=loader)
+        assert await cache.get(700) == (USER, SUB)
+        assert await cache.get(700) == (USER, SUB)
+        assert await cache.get(1) == (None, None)     # нет пользователя — тоже кэшируем
+        assert loader.calls == [700, 1]
+
+        cache.invalidate(700)
+        await cache.get(700)
+        await asyncio.sleep(0.15)
+        await cache.get(700)
+        return cache.stats()
+
+    stats = asyncio.run(scenario())
+    assert loader.calls == [700, 1, 700, 700]
+    assert stats["hits"] == 1 and stats["misses"] == 4
+
+
+def test_middleware_loads_only_for_handlers_that_ask():
+    """Тест: контекст — только хендлерам с аргументом user/subscription и только в личке."""
+    loader = FakeLoader()
+
+    async def wants(msg, state, user=None, subscription=None):
+        pass
+
+    async def onboarding_step(msg, state):
+        pass
+
+    async def scenario():
+        middleware = UserContextMiddleware(UserContextCache(loader=loader))
+        results = []
+        for handler, message in ((onboarding_step, make_message(700)),
+                                 (wants, make_message(700, "supergroup")),
+                                 (wants, make_message(700)),
+                                 (wants, make_message(700))):
+            data = {}
+            token = current_handler.set(handler)
+            try:
+                await middleware.on_process_message(message, data)
+            finally:
+                current_handler.reset(token)
+            results.append(data)
+        return results
+
+    results = asyncio.run(scenario())
+    assert results[:2] == [{}, {}]
+    assert results[2] == results[3] == {"user": USER, "subscription": SUB}
+    assert loader.calls == [700]
+
+
+def test_is_admin_by_role_or_admin_ids(monkeypatch):
+    """Unit-тест: роль сравнивается с UserRole (не со строкой); без пользователя — по ADMIN_IDS."""
+    monkeypatch.setattr("user_context.ADMIN_IDS", [900])
+    assert is_admin(SimpleNamespace(telegram_id=1, role=UserRole.admin))
+    assert not is_admin(USER)
+    assert is_admin(None, 900)
@@ -0,0 +1,58 @@
+# tests/test_18_blocking.py
+import time
+import asyncio
+import threading
+import contextvars
+
+import pytest
+
+import blocking
+from blocking import run_blocking, blocking_stats
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def test_runs_in_pool_with_context_and_stats():
+    """Unit-тест: вызов идёт в потоке пула, видит contextvars; время и ошибки — по имени вызова."""
+    def whoami(x):
+        return threading.current_thread().name, request_id.get(), x * 2
+
+    def boom():
+        raise ValueError("db down")
+
+    async def scenario():
+        request_id.set("upd-42")
+        result = await run_blocking(whoami, 21, name="test.whoami")
+        with pytest.raises(ValueError):
+            await run_blocking(boom, name="test.boom")
+        return result
+
+    thread_name, ctx_value, value = asyncio.run(scenario())
+    assert thread_name.startswith("blocking") and ctx_value == "upd-42" and value == 42
+
+    stats = blocking_stats()
+    assert stats["test.whoami"]["calls"] == 1 and stats["test.whoami"]["errors"] == 0
+    assert stats["test.boom"]["errors"] == 1
+
+
+def test_timeout_and_queue_wait(monkeypatch):
+    """Тест: таймаут не держит event loop; при занятом пуле копится ожидание в очереди."""
+    monkeypatch.setattr(blocking, "BLOCKING_WORKERS", 1)
+    blocking.shutdown_executor()
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await run_blocking(time.sleep, 0.3, name="test.slow", timeout=0.05)
+        # единственный поток ещё занят «зависшим» вызовом — следующий ждёт в очереди пула
+        await run_blocking(lambda: None, name="test.queued")
+
+    try:
+        started = time.perf_counter()
+        asyncio.run(scenario())
+        assert time.perf_counter() - started >= 0.25
+    finally:
+        blocking.shutdown_executor()
+
+    stats = blocking_stats()
+    assert stats["test.slow"]["timeouts"] == 1
+    assert stats["test.queued"]["max_wait_seconds"] >= 0.2
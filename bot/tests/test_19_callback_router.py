@@ -0,0 +1,85 @@
+# tests/test_19_callback_router.py
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+
+from callback_router import CallbackRouter, CALLBACK_LATENCY_BUCKETS_MS
+
+
+class Flow(StatesGroup):
+    first = State()
+    second = State()
+
+
+def make_callback(data: str):
+    answered = []
+
+    async def answer(*args, **kwargs):
+        answered.append(True)
+
+    return SimpleNamespace(data=data, from_user=SimpleNamespace(id=5), answer=answer, answered=answered)
+
+
+def test_dispatch_by_prefix_and_state():
+    """Тест: value разобран один раз; кнопка не своего шага и неизвестный префикс — только answer()."""
+    router = CallbackRouter()
+    calls = []
+
+    @router.route("first", state=Flow.first)
+    async def on_first(c, state, value):
+        calls.append(("first", value))
+
+    @router.route("any")
+    async def on_any(c, state, value):
+        calls.append(("any", value))
+
+    async def scenario():
+        state = FSMContext(MemoryStorage(), chat=5, user=5)
+        await state.set_state(Flow.first)
+        await router.dispatch(make_callback("first:a:b"), state)
+        await router.dispatch(make_callback("any:x"), state)
+
+        await state.set_state(Flow.second)
+        stale, unknown = make_callback("first:old"), make_callback("nope:1")
+        await router.dispatch(stale, state)
+        await router.dispatch(unknown, state)
+        return stale, unknown
+
+    stale, unknown = asyncio.run(scenario())
+    assert calls == [("first", "a:b"), ("any", "x")]
+    assert stale.answered and unknown.answered
+
+    stats = router.stats()
+    assert stats["stale"] == 1 and stats["unknown"] == 1
+    assert stats["routes"]["first"]["calls"] == 1
+
+
+def test_latency_histogram_and_errors():
+    """Unit-тест: время хендлера — в гистограмму по префиксу; ошибки считаются и пробрасываются."""
+    router = CallbackRouter()
+
+    @router.route("slow")
+    async def slow(c, state, value):
+        await asyncio.sleep(0.03)
+        if value == "fail":
+            raise RuntimeError("boom")
+
+    async def scenario():
+        state = FSMContext(MemoryStorage(), chat=5, user=5)
+        await router.dispatch(make_callback("slow:ok"), state)
+        with pytest.raises(RuntimeError):
+            await router.dispatch(make_callback("slow:fail"), state)
+
+    asyncio.run(scenario())
+    stats = router.stats()["routes"]["slow"]
+    assert stats["calls"] == 2 and stats["errors"] == 1
+    assert sum(stats["histogram"].values()) == 2
+    assert stats["histogram"][f"<={CALLBACK_LATENCY_BUCKETS_MS[0]}ms"] == 0
+    assert stats["max_ms"] >= 30
+
+    with pytest.raises(ValueError):
+        router.route("slow")(slow)
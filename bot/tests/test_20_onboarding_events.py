@@ -0,0 +1,59 @@
+# tests/test_20_onboarding_events.py
+import asyncio
+from unittest.mock import patch
+
+from onboarding_events import EventBuffer, format_funnel
+
+
+def test_track_is_buffered_and_flushed_in_batches():
+    """Unit-тест: track() в БД не ходит; события уходят пачками — по размеру или по таймеру."""
+    batches = []
+
+    async def scenario():
+        buffer = EventBuffer(flush_events=3, flush_seconds=0.1)
+        buffer.track(1, "start")
+        buffer.track(1, "format", "video")
+        assert batches == []                      # на пути хендлера — только память
+        buffer.track(2, "start")
+        await asyncio.sleep(0.02)
+        assert [len(b) for b in batches] == [3]   # набралось flush_events — сброс сразу
+
+        buffer.track(2, "format", "webinar")
+        await asyncio.sleep(0.2)
+        assert [len(b) for b in batches] == [3, 1]
+        await buffer.close()
+        return buffer.stats()
+
+    with patch("onboarding_events.insert_events", side_effect=batches.append):
+        stats = asyncio.run(scenario())
+    assert batches[0][1]["step"] == "format" and batches[0][1]["value"] == "video"
+    assert stats["written"] == 4 and stats["buffered"] == 0
+
+
+def test_failed_flush_keeps_events_and_caps_buffer():
+    """Тест: БД недоступна — события остаются в буфере (старые вытесняются сверх max_size)."""
+    async def scenario():
+        buffer = EventBuffer(flush_events=100, flush_seconds=60, max_size=3)
+        for uid in range(5):
+            buffer.track(uid, "start")
+        with patch("onboarding_events.insert_events", side_effect=RuntimeError("db down")):
+            await buffer.flush()
+        stats = buffer.stats()
+        written = []
+        with patch("onboarding_events.insert_events", side_effect=written.append):
+            await buffer.close()
+        return stats, written
+
+    stats, written = asyncio.run(scenario())
+    assert stats["buffered"] == 3 and stats["dropped"] == 2 and stats["failed_flushes"] == 1
+    assert [row["telegram_id"] for row in written[0]] == [2, 3, 4]
+
+
+def test_format_funnel_conversion():
+    """Unit-тест: у шага — % от start и % от предыдущего шага."""
+    text = format_funnel({"start": (100, 100), "format": (80, 90), "level": (40, 40)}, 7)
+    assert "start: 100 (100%)" in text
+    assert "format: 80 (80%, шаг 80%)" in text
+    assert "level: 40 (40%, шаг 50%)" in text
+    assert "time: 0 (0%, шаг 0%)" in text
+    assert "событий пока нет" in format_funnel({}, 7)
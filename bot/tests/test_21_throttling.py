@@ -0,0 +1,193 @@
+# tests/test_21_throttling.py
+import asyncio
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from aiogram import types
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.handler import CancelHandler, current_handler
+
+import pay_links
+from callback_router import CallbackRouter
+from throttling import Throttler, ThrottlingMiddleware, rate_limit, THROTTLED_TEXT
+
+
+def make_message(user_id=7, chat_type=types.ChatType.PRIVATE):
+    replies = []
+
+    async def answer(text, *args, **kwargs):
+        replies.append(text)
+
+    return SimpleNamespace(chat=SimpleNamespace(type=chat_type), from_user=SimpleNamespace(id=user_id),
+                           answer=answer, replies=replies)
+
+
+def test_user_burst_is_cut_with_single_notice():
+    """Тест: сверх burst апдейты отбрасываются до хендлера, вежливый ответ — один на волну."""
+    middleware = ThrottlingMiddleware(Throttler(user_rate=0.01, user_burst=3))
+    msg = make_message()
+
+    async def scenario():
+        passed = 0
+        for _ in range(6):
+            try:
+                await middleware.on_process_message(msg, {})
+                passed += 1
+            except CancelHandler:
+                pass
+        await middleware.on_process_message(make_message(chat_type=types.ChatType.SUPERGROUP), {})
+        return passed
+
+    assert asyncio.run(scenario()) == 3
+    assert msg.replies == [THROTTLED_TEXT]
+    stats = middleware.limiter.stats()
+    assert stats["allowed"] == 3 and stats["throttled_user"] == 3
+
+
+def test_rate_limited_handler_and_callback_route():
+    """Unit-тест: @rate_limit — свой лимит на хендлер (и на маршрут кнопок), остальные не страдают."""
+    limiter = Throttler(user_rate=100, user_burst=100)
+
+    @rate_limit(0.01, burst=1)
+    async def expensive(msg):
+        pass
+
+    async def cheap(msg):
+        pass
+
+    assert limiter.handler_allowed(7, expensive) and not limiter.handler_allowed(7, expensive)
+    assert limiter.handler_allowed(8, expensive)        # у другого пользователя свой bucket
+    assert limiter.handler_allowed(7, cheap) and limiter.handler_allowed(7, cheap)
+
+    middleware = ThrottlingMiddleware(limiter)
+
+    async def through_middleware():
+        token = current_handler.set(expensive)
+        try:
+            with pytest.raises(CancelHandler):
+                await middleware.on_process_message(make_message(), {})
+        finally:
+            current_handler.reset(token)
+
+    asyncio.run(through_middleware())
+
+    router = CallbackRouter()
+    calls, answers = [], []
+
+    @router.route("pay")
+    @rate_limit(0.01, burst=1)
+    async def on_pay(c, state, value):
+        calls.append(value)
+
+    async def answer(*args, **kwargs):
+        answers.append(args)
+
+    async def through_router():
+        state = FSMContext(MemoryStorage(), chat=9, user=9)
+        for value in ("stripe", "stripe"):
+            await router.dispatch(SimpleNamespace(data=f"pay:{value}", from_user=SimpleNamespace(id=9), answer=answer), state)
+
+    asyncio.run(through_router())
+    assert calls == ["stripe"] and answers == [(THROTTLED_TEXT,)]
+
+
+def test_open_payment_reuses_recent_link():
+    """Тест: повторный выбор оплаты в окне — та же ссылка без новой сессии; после forget_payment — новая."""
+    created = []
+
+    def fake_create(user_id, provider):
+        created.append((user_id, provider))
+        return {"success": True, "url": f"https://pay/{provider}/{len(created)}"}
+
+    with patch("pay_links._create_payment", side_effect=fake_create):
+        first = pay_links.open_payment(501, "stripe", reuse_minutes=10)
+        again = pay_links.open_payment(501, "stripe", reuse_minutes=10)
+        other = pay_links.open_payment(501, "paypal", reuse_minutes=10)
+        pay_links.forget_payment(501)
+        after_paid = pay_links.open_payment(501, "stripe", reuse_minutes=10)
+        no_reuse = pay_links.open_payment(502, "stripe", reuse_minutes=0)
+        no_reuse_again = pay_links.open_payment(502, "stripe", reuse_minutes=0)
+
+    assert again["url"] == first["url"] and again["reused"]
+    assert other["url"] != first["url"]
+    assert after_paid["url"] != first["url"]
+    assert no_reuse["url"] != no_reuse_again["url"]
+    assert len(created) == 5
+
+
+def test_concurrent_taps_create_one_session_after_expiry():
+    """Тест: параллельные нажатия (и пока чистятся устаревшие ключи) — одна сессия на ключ."""
+    created = []
+    gate = threading.Event()
+
+    def slow_create(user_id, provider):
+        gate.wait(1)
+        created.append((user_id, provider))
+        return {"success": True, "url": f"https://pay/{user_id}/{len(created)}"}
+
+    with patch("pay_links._create_payment", side_effect=slow_create):
+        with patch("pay_links._recent", {(777, "stripe"): (0.0, "https://old")}):   # давно устаревший ключ
+            threads = [threading.Thread(target=pay_links.open_payment, args=(uid, "stripe", 10))
+                       for uid in (601, 601, 601, 777, 777)]
+            for t in threads:
+                t.start()
+            gate.set()
+            for t in threads:
+                t.join(2)
+
+    assert sorted(created) == [(601, "stripe"), (777, "stripe")]
+
+
+def test_slow_session_of_one_user_does_not_block_another():
+    """Тест: пока у одного пользователя создаётся сессия, другой получает ссылку без ожидания."""
+    started, gate = threading.Event(), threading.Event()
+
+    def create(user_id, provider):
+        if user_id == 801:
+            started.set()
+            gate.wait(2)
+        return {"success": True, "url": f"https://pay/{user_id}"}
+
+    with patch("pay_links._create_payment", side_effect=create):
+        slow = threading.Thread(target=pay_links.open_payment, args=(801, "stripe", 10))
+        slow.start()
+        assert started.wait(1)
+        fast = {}
+        other = threading.Thread(target=lambda: fast.update(pay_links.open_payment(802, "stripe", 10)))
+        other.start()
+        other.join(0.5)
+        finished_before_slow = not other.is_alive()
+        gate.set()
+        slow.join(2)
+        other.join(2)
+
+    assert finished_before_slow and fast["url"] == "https://pay/802"
+    assert not pay_links._pending
+
+
+def test_failed_session_lets_waiting_tap_retry():
+    """Тест: сессия не создалась — ждавшее нажатие того же пользователя пробует само, а не виснет."""
+    calls, gate = [], threading.Event()
+
+    def create(user_id, provider):
+        calls.append(user_id)
+        if len(calls) == 1:
+            gate.wait(2)
+            return {"success": False, "error": "provider down"}
+        return {"success": True, "url": "https://pay/ok"}
+
+    results = []
+    with patch("pay_links._create_payment", side_effect=create):
+        threads = [threading.Thread(target=lambda: results.append(pay_links.open_payment(901, "paypal", 10)))
+                   for _ in range(2)]
+        for t in threads:
+            t.start()
+        gate.set()
+        for t in threads:
+            t.join(3)
+
+    assert len(calls) == 2
+    assert sorted(r["success"] for r in results) == [False, True]
@@ -0,0 +1,125 @@
+# throttling.py
+"""
+Анти-флуд для личных чатов.
+
+- На пользователя — token bucket THROTTLE_USER_RATE сообщений/кнопок в секунду с запасом
+  THROTTLE_USER_BURST; сверх него апдейт отбрасывается до хендлеров (ни БД, ни платёжек).
+- На хендлер — свой bucket на пользователя, если хендлер помечен @rate_limit(rate, burst):
+  дорогие действия (ссылка оплаты, «Il mio abbonamento») можно нажимать реже остальных.
+  Кнопки CallbackRouter проверяет так же, по хендлеру маршрута (handler_allowed).
+- Отказ — вежливый ответ: на кнопку — всплывающий текст в answerCallbackQuery, на
+  сообщение — не чаще раза в THROTTLE_NOTICE_SECONDS, чтобы флуд не превращался в флуд ответами.
+ThrottlingMiddleware ставится раньше UserContextMiddleware — отброшенный апдейт не грузит пользователя.
+"""
+import os
+import time
+import logging
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler, current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from telegram_service import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_USER_RATE = float(os.getenv("THROTTLE_USER_RATE", "1"))
+THROTTLE_USER_BURST = float(os.getenv("THROTTLE_USER_BURST", "5"))
+THROTTLE_NOTICE_SECONDS = float(os.getenv("THROTTLE_NOTICE_SECONDS", "5"))
+THROTTLE_MAX_BUCKETS = int(os.getenv("THROTTLE_MAX_BUCKETS", "10000"))
+
+THROTTLED_TEXT = "⏳ Un attimo, sto già elaborando la tua richiesta. Riprova tra qualche secondo."
+
+
+def rate_limit(rate: float, burst: float = 1):
+    """Своя частота для хендлера: rate нажатий в секунду на пользователя, burst — запас."""
+    def decorator(handler):
+        handler.throttle = (rate, burst)
+        return handler
+    return decorator
+
+
+class Throttler:
+    def __init__(self, user_rate: float = THROTTLE_USER_RATE, user_burst: float = THROTTLE_USER_BURST,
+                 max_buckets: int = THROTTLE_MAX_BUCKETS):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_buckets = max_buckets
+        self._buckets: dict[tuple, TokenBucket] = {}
+        self._noticed: dict[int, float] = {}   # пользователь -> когда последний раз отвечали на флуд
+        self._stats = {"allowed": 0, "throttled_user": 0, "throttled_handler": 0}
+
+    def _allow(self, key: tuple, rate: float, burst: float) -> bool:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                # полностью восстановившиеся bucket'ы ничего не помнят — их можно выкинуть
+                for k in [k for k, b in self._buckets.items() if b.idle()]:
+                    del self._buckets[k]
+                self._noticed.clear()
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+        return bucket.try_acquire()
+
+    def user_allowed(self, user_id: int) -> bool:
+        if self._allow(("user", user_id), self.user_rate, self.user_burst):
+            return True
+        self._stats["throttled_user"] += 1
+        return False
+
+    def handler_allowed(self, user_id: int, handler) -> bool:
+        limit = getattr(handler, "throttle", None)
+        if limit is None or self._allow((handler.__name__, user_id), *limit):
+            return True
+        self._stats["throttled_handler"] += 1
+        return False
+
+    def should_notice(self, user_id: int) -> bool:
+        now = time.monotonic()
+        if now - self._noticed.get(user_id, 0.0) < THROTTLE_NOTICE_SECONDS:
+            return False
+        self._noticed[user_id] = now
+        return True
+
+    def stats(self) -> dict:
+        return dict(self._stats, buckets=len(self._buckets))
+
+
+throttler = Throttler()
+
+
+def throttling_stats() -> dict:
+    return throttler.stats()
+
+
+async def reject_callback(callback: types.CallbackQuery):
+    try:
+        await callback.answer(THROTTLED_TEXT)
+    except Exception as e:
+        logger.debug(f"[throttling] answerCallbackQuery failed: {e}")
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, limiter: Throttler = None):
+        super().__init__()
+        self.limiter = limiter or throttler
+
+    def _allowed(self, user: types.User) -> bool:
+        if self.limiter.user_allowed(user.id) and self.limiter.handler_allowed(user.id, current_handler.get(None)):
+            self.limiter._stats["allowed"] += 1
+            return True
+        return False
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        if message.chat.type != types.ChatType.PRIVATE or message.from_user is None:
+            return
+        if not self._allowed(message.from_user):
+            if self.limiter.should_notice(message.from_user.id):
+                await message.answer(THROTTLED_TEXT)
+            raise CancelHandler()
+
+    async def on_process_callback_query(self, callback: types.CallbackQuery, data: dict):
+        if callback.message and callback.message.chat.type != types.ChatType.PRIVATE:
+            return
+        if not self._allowed(callback.from_user):
+            await reject_callback(callback)
+            raise CancelHandler()
@@ -0,0 +1,217 @@
+# update_queue.py
+"""
+Очередь апдейтов перед Dispatcher (и для polling, и для webhook).
+
+- Апдейты одного чата обрабатываются строго по порядку и по одному (FSM не гоняется сам с собой);
+  разные чаты — параллельно, UPDATE_WORKERS воркерами.
+- Чат не привязан к воркеру: свободный воркер берёт следующий чат, у которого есть
+  апдейты и который сейчас никто не обрабатывает. Медленный хендлер (Stripe, PayPal)
+  задерживает только свой чат, а не «соседей по шарду».
+- Ограничение — UPDATE_QUEUE_SIZE апдейтов в очереди и в работе. submit() ждёт места
+  (polling перестаёт забирать getUpdates — апдейты копятся у Telegram), offer() сразу
+  отказывает (webhook отвечает 503, Telegram повторит доставку).
+- drop(update) -> True — апдейт отбрасывается ещё до очереди (ни места в ней, ни FSM, ни
+  фильтров хендлеров). Для бота — is_group_noise: болтовня в группе, где бот сидит ради
+  /app, стоит одну проверку типа чата и первого символа текста.
+- stats() — глубина очереди, ожидание места (backpressure), ожидание в очереди, ошибки; их
+  показывает /health.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+UPDATE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_DRAIN_TIMEOUT", "10"))   # сколько ждать остатка при остановке
+GROUP_COMMANDS = ("app",)   # команды, на которые бот отвечает в группах
+
+_active = None   # запущенная очередь процесса (для /health)
+
+
+def chat_key(update) -> int:
+    """Ключ порядка: чат сообщения / кнопки; для прочих апдейтов порядок не важен."""
+    for message in (update.message, update.edited_message, update.channel_post, update.edited_channel_post):
+        if message:
+            return message.chat.id
+    callback = update.callback_query
+    if callback:
+        return callback.message.chat.id if callback.message else callback.from_user.id
+    return update.update_id
+
+
+def is_group_noise(update, commands=GROUP_COMMANDS) -> bool:
+    """Сообщение в группе, кроме команд из commands (/app, /app@bot) — хендлеров для него нет."""
+    message = update.message
+    if message is None or message.chat.type == "private":
+        return False
+    text = message.text
+    if not text or text[0] != "/":
+        return True
+    command = text.split(maxsplit=1)[0][1:].split("@", 1)[0].lower()
+    return command not in commands
+
+
+def queue_stats() -> dict:
+    return _active.stats() if _active is not None else {}
+
+
+class UpdateQueue:
+    def __init__(self, process, workers: int = UPDATE_WORKERS, max_pending: int = UPDATE_QUEUE_SIZE, drop=None):
+        """process(update) — корутина-обработчик одного апдейта; drop(update) — отбросить до очереди."""
+        self.process = process
+        self.drop = drop
+        self.workers = workers
+        self.max_pending = max_pending
+        self._chats: dict[int, deque] = {}   # чат -> его апдейты (первый — в работе или ждёт воркера)
+        self._ready = None                    # чаты, готовые к обработке
+        self._space = None                    # «в очереди освободилось место»
+        self._pending = 0
+        self._tasks: list[asyncio.Task] = []
+        self._busy = 0
+        self._stats = {
+            "received": 0, "dropped": 0, "processed": 0, "failed": 0, "rejected": 0,
+            "backpressure_waits": 0, "backpressure_wait_seconds": 0.0,
+            "queue_wait_seconds": 0.0, "max_queue_wait_seconds": 0.0,
+        }
+
+    # ---------- жизненный цикл ----------
+    def start(self):
+        global _active
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._space = asyncio.Event()
+        self._chats.clear()
+        self._pending = 0
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        _active = self
+        logger.info(f"[updates] {self.workers} workers, queue size {self.max_pending}")
+
+    async def stop(self, timeout: float = UPDATE_DRAIN_TIMEOUT):
+        """Даём дообработать принятое (не дольше timeout) и останавливаем воркеров."""
+        global _active
+        if not self._tasks:
+            return
+        deadline = time.monotonic() + timeout
+        while self._chats and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._chats:
+            logger.warning(f"[updates] stopping with {self._pending} unprocessed updates")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if _active is self:
+            _active = None
+
+    # ---------- приём ----------
+    def _dropped(self, update) -> bool:
+        if self.drop is not None and self.drop(update):
+            self._stats["dropped"] += 1
+            return True
+        return False
+
+    def _put(self, update):
+        key = chat_key(update)
+        self._pending += 1
+        self._stats["received"] += 1
+        item = (update, time.monotonic())
+        chat = self._chats.get(key)
+        if chat is None:
+            self._chats[key] = deque([item])
+            self._ready.put_nowait(key)
+        else:
+            # чат уже в работе или ждёт воркера — встанет за предыдущими
+            chat.append(item)
+
+    async def submit(self, update):
+        """Ставит апдейт в очередь; если места нет — ждёт (backpressure)."""
+        if self._dropped(update):
+            return
+        if self._pending >= self.max_pending:
+            started = time.monotonic()
+            self._stats["backpressure_waits"] += 1
+            while self._pending >= self.max_pending:
+                self._space.clear()
+                await self._space.wait()
+            self._stats["backpressure_wait_seconds"] += time.monotonic() - started
+        self._put(update)
+
+    def offer(self, update) -> bool:
+        """Без ожидания: False — очередь полна (или не запущена). Отброшенный drop — принят."""
+        if self._dropped(update):
+            return True
+        if self._ready is None or self._pending >= self.max_pending:
+            self._stats["rejected"] += 1
+            return False
+        self._put(update)
+        return True
+
+    # ---------- обработка ----------
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            chat = self._chats[key]
+            update, enqueued = chat[0]
+            wait = time.monotonic() - enqueued
+            self._stats["queue_wait_seconds"] += wait
+            self._stats["max_queue_wait_seconds"] = max(self._stats["max_queue_wait_seconds"], wait)
+            self._busy += 1
+            try:
+                await self.process(update)
+                self._stats["processed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._stats["failed"] += 1
+                logger.exception(f"[updates] failed to process update {update.update_id}")
+            finally:
+                self._busy -= 1
+                chat.popleft()
+                if chat:
+                    self._ready.put_nowait(key)   # следующий апдейт чата — в конец, по кругу с остальными
+                else:
+                    del self._chats[key]
+                self._pending -= 1
+                self._space.set()
+
+    # ---------- метрики ----------
+    def stats(self) -> dict:
+        out = dict(self._stats)
+        out["pending"] = self._pending
+        out["active_chats"] = len(self._chats)
+        out["busy_workers"] = self._busy
+        out["workers"] = self.workers
+        out["max_pending"] = self.max_pending
+        done = out["processed"] + out["failed"]
+        out["avg_queue_wait_seconds"] = round(out["queue_wait_seconds"] / done, 4) if done else 0.0
+        return out
+
+
+async def poll_updates(bot, queue: UpdateQueue, allowed_updates=None, timeout: int = 20,
+                       relax: float = 0, error_sleep: float = 5):
+    """
+    Long polling в очередь. Следующий getUpdates — только когда весь предыдущий пакет принят:
+    при полной очереди апдейты остаются у Telegram, а не в памяти процесса.
+    """
+    offset = None
+    while True:
+        try:
+            with bot.request_timeout(timeout + 10):
+                updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("[updates] getUpdates failed")
+            await asyncio.sleep(error_sleep)
+            continue
+
+        for update in updates:
+            await queue.submit(update)
+            offset = update.update_id + 1
+        if relax:
+            await asyncio.sleep(relax)
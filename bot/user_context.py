@@ -0,0 +1,186 @@
+# user_context.py
+"""
+Пользователь и его активная подписка — один раз на апдейт.
+
+UserContextMiddleware перед хендлером личного чата кладёт в data["user"] и
+data["subscription"] (aiogram передаёт их хендлеру, если в сигнатуре есть такие аргументы;
+хендлерам без этих аргументов пользователь не загружается вовсе).
+- Загрузка — один запрос (users LEFT JOIN активная подписка) в пуле blocking, не в event loop.
+- Кэш по telegram_id на USER_CONTEXT_TTL секунд: пользователь, листающий меню, не ходит
+  в БД на каждое нажатие. Свои изменения (/start, выбор оплаты) и активация/отмена из
+  вебхуков платёжек (webhook.py, тот же процесс) сбрасывают кэш сразу; в других процессах
+  изменение видно не позже чем через TTL.
+- В хендлеры попадают не ORM-объекты, а снимки колонок (SimpleNamespace): их можно
+  держать в кэше и читать из любой корутины без сессии.
+"""
+import os
+import time
+import inspect
+import logging
+from types import SimpleNamespace
+from datetime import datetime
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from sqlalchemy import and_
+
+from config import ADMIN_IDS
+from database import SessionLocal, User, UserRole, Subscription, get_user_by_telegram_id, create_user
+from blocking import run_blocking
+
+logger = logging.getLogger(__name__)
+
+USER_CONTEXT_TTL = float(os.getenv("USER_CONTEXT_TTL", "15"))
+USER_CONTEXT_CACHE_SIZE = int(os.getenv("USER_CONTEXT_CACHE_SIZE", "10000"))
+
+
+def snapshot(obj):
+    """Снимок колонок ORM-объекта (None -> None)."""
+    if obj is None:
+        return None
+    return SimpleNamespace(**{c.key: getattr(obj, c.key) for c in obj.__table__.columns})
+
+
+def is_admin(user, telegram_id: int = None) -> bool:
+    """Админ — по роли в БД или по ADMIN_IDS (пользователя в БД может ещё не быть)."""
+    if user is not None and user.role == UserRole.admin:
+        return True
+    tid = telegram_id if telegram_id is not None else getattr(user, "telegram_id", None)
+    return str(tid) in [str(x) for x in ADMIN_IDS]
+
+
+# =========================
+# Доступ к БД (блокирующие)
+# =========================
+def load_user_context(telegram_id: int):
+    """(user, subscription) одним запросом; subscription — активная и не истёкшая."""
+    db = SessionLocal()
+    try:
+        row = db.query(User, Subscription).outerjoin(
+            Subscription,
+            and_(
+                Subscription.user_id == User.id,
+                Subscription.status == "active",
+                Subscription.expires_at > datetime.utcnow(),
+            ),
+        ).filter(User.telegram_id == telegram_id).order_by(Subscription.expires_at.desc()).first()
+    finally:
+        db.close()
+    if row is None:
+        return None, None
+    return snapshot(row[0]), snapshot(row[1])
+
+
+def ensure_user(telegram_id: int, username: str = None, first_name: str = None, last_name: str = None):
+    """Находит или создаёт пользователя (/start). Возвращает снимок."""
+    db = SessionLocal()
+    try:
+        user = get_user_by_telegram_id(db, telegram_id)
+        if not user:
+            user = create_user(db, telegram_id=telegram_id, username=username,
+                               first_name=first_name, last_name=last_name)
+            logger.info(f"New user: telegram_id={telegram_id}")
+        return snapshot(user)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+# =========================
+# Кэш
+# =========================
+class UserContextCache:
+    def __init__(self, ttl: float = USER_CONTEXT_TTL, max_size: int = USER_CONTEXT_CACHE_SIZE, loader=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.loader = loader or load_user_context
+        self._items: dict[int, tuple[float, object, object]] = {}   # telegram_id -> (at, user, sub)
+        self._stats = {"hits": 0, "misses": 0}
+
+    async def get(self, telegram_id: int):
+        item = self._items.get(telegram_id)
+        if item is not None and time.monotonic() - item[0] < self.ttl:
+            self._stats["hits"] += 1
+            return item[1], item[2]
+        self._stats["misses"] += 1
+        user, sub = await run_blocking(self.loader, telegram_id)
+        self.put(telegram_id, user, sub)
+        return user, sub
+
+    def put(self, telegram_id: int, user, sub):
+        if len(self._items) >= self.max_size:
+            self._prune()
+        self._items[telegram_id] = (time.monotonic(), user, sub)
+
+    def invalidate(self, telegram_id: int):
+        self._items.pop(telegram_id, None)
+
+    def _prune(self):
+        deadline = time.monotonic() - self.ttl
+        # invalidate() зовут и из потоков Flask — обходим копию, а не живой dict
+        for key, item in list(self._items.items()):
+            if item[0] < deadline:
+                self._items.pop(key, None)
+        if len(self._items) >= self.max_size:
+            # всё свежее — выкидываем самые старые записи
+            for key in sorted(self._items, key=lambda k: self._items[k][0])[: len(self._items) // 2]:
+                del self._items[key]
+
+    def stats(self) -> dict:
+        return dict(self._stats, size=len(self._items))
+
+
+user_cache = UserContextCache()
+
+
+async def register_user(from_user: types.User):
+    """/start: пользователь точно есть в БД; кэш — заново (подписку перечитаем одним запросом)."""
+    await run_blocking(ensure_user, from_user.id, from_user.username, from_user.first_name, from_user.last_name, timeout=None)
+    user_cache.invalidate(from_user.id)
+    return await user_cache.get(from_user.id)
+
+
+# =========================
+# Middleware
+# =========================
+def context_args(handler) -> tuple:
+    """Какие из user / subscription хендлер принимает аргументами."""
+    params = inspect.signature(handler).parameters
+    return tuple(name for name in ("user", "subscription") if name in params)
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """
+    data["user"], data["subscription"] — только для хендлеров личного чата, которые их
+    принимают (есть аргумент user или subscription); шаги онбординга и группы БД не трогают.
+    """
+
+    def __init__(self, cache: UserContextCache = None):
+        super().__init__()
+        self.cache = cache or user_cache
+        self._wants: dict = {}   # хендлер -> нужен ли ему контекст
+
+    def _handler_wants_context(self) -> bool:
+        handler = current_handler.get(None)
+        if handler is None:
+            return False
+        wants = self._wants.get(handler)
+        if wants is None:
+            wants = self._wants[handler] = bool(context_args(handler))
+        return wants
+
+    async def _resolve(self, from_user: types.User, chat: types.Chat, data: dict):
+        if from_user is None or (chat is not None and chat.type != types.ChatType.PRIVATE):
+            return
+        if not self._handler_wants_context():
+            return
+        data["user"], data["subscription"] = await self.cache.get(from_user.id)
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        await self._resolve(message.from_user, message.chat, data)
+
+    async def on_process_callback_query(self, callback: types.CallbackQuery, data: dict):
+        await self._resolve(callback.from_user, callback.message.chat if callback.message else None, data)
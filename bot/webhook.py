@@ -1,12 +1,13 @@
 #webhook.py
 import os
+import hmac
 import stripe
 import threading
 import asyncio
 import logging
 import jwt  
 from datetime import datetime
-from flask import Flask, request, jsonify, current_app 
+from flask import Flask, request, jsonify, current_app, redirect
 from auth_telegram import bp as tg_bp
 from flask_cors import CORS
 from functools import wraps
@@ -14,7 +15,16 @@ from functools import wraps
 # --- Импорты из ваших модулей (очищены от дублей) ---
 from payment_service import verify_stripe_webhook, verify_paypal_webhook
 from database import get_db, activate_subscription, cancel_subscription, list_modules_for_user, User, Module
-from telegram_service import TelegramService
+from telegram_service import TelegramService, background_loop, send_engine
+from leader import leadership_status
+from pay_links import load_pay_token, open_payment, forget_payment, PayLinkError
+from user_context import user_cache
+from config import TELEGRAM_WEBHOOK_SECRET, TELEGRAM_WEBHOOK_PATH
+from update_queue import queue_stats
+from blocking import blocking_stats
+from callback_router import callback_stats
+from onboarding_events import events as onboarding_events
+from throttling import throttling_stats
 
 # --- Инициализация ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -41,8 +51,14 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def run_async_in_thread(coro):
-    """Запускает асинхронную задачу в отдельном потоке."""
-    threading.Thread(target=lambda: asyncio.run(coro), daemon=True).start()
+    """
+    Запускает асинхронную задачу в общем фоновом event loop.
+    Один loop на процесс — соединения к Bot API переиспользуются между вебхуками.
+    """
+    try:
+        asyncio.run_coroutine_threadsafe(coro, background_loop())
+    except Exception as e:
+        logger.error(f"Failed to schedule async task: {e}")
     
 # --- Декоратор для проверки JWT-токена ---
 def token_required(f):
@@ -109,6 +125,8 @@ def stripe_webhook():
                     amount=session.get('amount_total', 0) / 100.0, currency=session.get('currency')
                 )
                 if activated_sub:
+                    forget_payment(activated_sub.user_id)
+                    user_cache.invalidate(activated_sub.telegram_id)
                     logger.info(f"Stripe subscription activated for user_id={user_id} via order_id={order_id}")
                     run_async_in_thread(telegram_service.send_payment_success_notification(activated_sub.telegram_id, activated_sub))
                 else:
@@ -124,6 +142,7 @@ def stripe_webhook():
                 try:
                     sub = cancel_subscription(db, subscription_id=subscription_id)
                     if sub:
+                        user_cache.invalidate(sub.telegram_id)
                         logger.info(f"Stripe subscription cancelled: {subscription_id}")
                         run_async_in_thread(telegram_service.send_subscription_cancelled_notification(sub.telegram_id))
                 finally:
@@ -161,6 +180,8 @@ def paypal_webhook():
             # Вызываем нашу надежную функцию активации
             activated_sub = activate_subscription(db, user_id=int(user_id), order_id=paypal_sub_id)
             if activated_sub:
+                forget_payment(activated_sub.user_id)
+                user_cache.invalidate(activated_sub.telegram_id)
                 logger.info(f"PayPal subscription activated for user_id={user_id} via sub_id={paypal_sub_id}")
                 run_async_in_thread(telegram_service.send_payment_success_notification(activated_sub.telegram_id, activated_sub))
             else:
@@ -176,6 +197,7 @@ def paypal_webhook():
             try:
                 sub = cancel_subscription(db, subscription_id=paypal_sub_id)
                 if sub:
+                    user_cache.invalidate(sub.telegram_id)
                     logger.info(f"PayPal subscription cancelled/expired: {paypal_sub_id}")
                     run_async_in_thread(telegram_service.send_subscription_cancelled_notification(sub.telegram_id))
             finally:
@@ -213,10 +235,77 @@ def get_modules_list():
     finally:
         db.close()
 
+# === Апдейты Telegram (BOT_MODE=webhook) ===
+# (event loop бота, корутина-обработчик) — регистрирует main.start_bot, когда бот готов
+_update_target = None
+
+def set_update_handler(loop, handler):
+    global _update_target
+    _update_target = (loop, handler) if handler else None
+
+@app.route(TELEGRAM_WEBHOOK_PATH, methods=['POST'])
+def telegram_update():
+    """
+    Апдейт от Telegram. Проверяем секрет, ставим в очередь бота (update_queue) и отвечаем 200:
+    обработка идёт асинхронно, Telegram не ждёт хендлеров. Очередь полна — 503,
+    Telegram повторит доставку позже (backpressure).
+    """
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not TELEGRAM_WEBHOOK_SECRET or not hmac.compare_digest(secret, TELEGRAM_WEBHOOK_SECRET):
+        return jsonify({"error": "forbidden"}), 403
+    if _update_target is None:
+        # бот ещё стартует — Telegram повторит доставку
+        return jsonify({"error": "not_ready"}), 503
+
+    update = request.get_json(silent=True)
+    if not isinstance(update, dict) or "update_id" not in update:
+        return jsonify({"error": "bad_update"}), 400
+
+    loop, handler = _update_target
+    try:
+        accepted = asyncio.run_coroutine_threadsafe(handler(update), loop).result(timeout=5)
+    except Exception as e:
+        logger.error(f"Failed to enqueue update {update.get('update_id')}: {e}")
+        accepted = False
+    if accepted is False:
+        return jsonify({"error": "busy"}), 503
+    return jsonify({"ok": True}), 200
+
 # === Вспомогательные маршруты ===
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'timestamp': datetime.utcnow().isoformat()}), 200
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.utcnow().isoformat(),
+        'telegram_send': send_engine.stats(),
+        'leader': leadership_status(),
+        'updates': queue_stats(),
+        'blocking': blocking_stats(),
+        'callbacks': callback_stats(),
+        'onboarding_events': onboarding_events.stats(),
+        'throttling': throttling_stats(),
+    }), 200
+
+@app.route('/pay/<token>', methods=['GET'])
+def pay_redirect(token):
+    """
+    Подписанная ссылка оплаты из сообщений cron: сессия у провайдера создаётся только сейчас,
+    когда пользователь реально открыл ссылку.
+    """
+    try:
+        user_id, provider = load_pay_token(token)
+    except PayLinkError as e:
+        logger.warning(f"Pay link rejected: {e}")
+        if e.expired:
+            # Итальянский: "Il link è scaduto. Apri il bot e scegli di nuovo il metodo di pagamento."
+            return "<h2>Ссылка устарела. Откройте бота и выберите способ оплаты заново.</h2>", 410
+        return "<h2>Неверная ссылка оплаты.</h2>", 400
+
+    result = open_payment(user_id, provider)
+    if not result.get("success"):
+        logger.error(f"Pay link: failed to create {provider} payment for user_id={user_id}: {result.get('error')}")
+        return "<h2>Не удалось создать платёж. Попробуйте позже или откройте бота.</h2>", 502
+    return redirect(result["url"], code=302)
 
 @app.route('/stripe/return', methods=['GET'])
 def stripe_return():